@@ -0,0 +1,394 @@
+"""In-memory fake of the parts of the Drive v3 service used by Gitd.
+
+FakeDrive can be passed anywhere Gitd expects the service returned by
+main.get_service, so syncs can be run and measured without a Google account.
+It supports files().list/get/create/update/copy/delete/get_media/export_media,
+changes().getStartPageToken/list and batch requests, with Drive's pagination,
+resumable uploads and ranged downloads.
+
+Every simulated HTTP round trip sleeps for `latency` seconds, and requests
+can be throttled with a 403 userRateLimitExceeded error, either at random
+with probability `throttle_rate` or every `throttle_every` requests.
+"""
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUploadProgress
+
+GOOGLE_APPS_MIME = 'application/vnd.google-apps.'
+FOLDER_MIME = GOOGLE_APPS_MIME + 'folder'
+ROOT_ID = 'root'
+
+def http_error(status, reason = None):
+    """Returns the HttpError Drive would raise with the given status"""
+    resp = httplib2.Response({ 'status': status })
+    content = json.dumps({ 'error': { 'code': status, 'message': reason or str(status),
+        'errors': [{ 'reason': reason or 'error' }] } }).encode()
+    return HttpError(resp, content)
+
+class FakeRequest:
+    """Request returned by the fake's resource methods. execute() runs it as
+    a single HTTP round trip, and next_chunk() sends one chunk of a resumable
+    upload.
+    """
+    def __init__(self, drive, method, run, media = None):
+        self.drive = drive
+        self.method = method
+        self.methodId = 'drive.' + method
+        self.run = run
+        self.media = media
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self.http = None
+        self.uri = None
+        self.headers = {}
+
+    def execute(self, http = None, num_retries = 0):
+        self.drive.round_trip(self.method)
+        if self.media is not None:
+            data = self.media.getbytes(0, self.media.size())
+            self.drive.count_bytes('bytes_up', len(data))
+            return self.run(data)
+        return self.run()
+
+    def next_chunk(self, http = None, num_retries = 0):
+        self.drive.round_trip(self.method + '.chunk')
+        if self.resumable_uri is None:
+            self.resumable_uri = self.drive.new_session()
+        session = self.drive.sessions.get(self.resumable_uri)
+        if session is None:
+            raise http_error(404, 'notFound')
+        # The session keeps what was received, so a new request object can
+        # resume it from resumable_progress
+        del session[self.resumable_progress:]
+        chunk = self.media.getbytes(self.resumable_progress, self.media.chunksize())
+        session += chunk
+        self.resumable_progress += len(chunk)
+        self.drive.count_bytes('bytes_up', len(chunk))
+        size = self.media.size()
+        if self.resumable_progress < size:
+            return MediaUploadProgress(self.resumable_progress, size), None
+        del self.drive.sessions[self.resumable_uri]
+        return None, self.run(bytes(session))
+
+class FakeHttp:
+    """Transport serving the ranged GET requests MediaIoBaseDownload makes
+    for files().get_media and files().export_media
+    """
+    def __init__(self, drive, method = 'files.get_media'):
+        self.drive = drive
+        self.method = method
+
+    def request(self, uri, method = 'GET', body = None, headers = None, **kwargs):
+        file_id = uri.rsplit('/', 1)[1]
+        try:
+            self.drive.round_trip(self.method + '.chunk')
+        except HttpError as e:
+            return e.resp, e.content
+        with self.drive.lock:
+            file = self.drive.files_.get(file_id)
+            data = self.drive.contents.get(file_id, b'') if file else None
+        if data is None:
+            return httplib2.Response({ 'status': 404 }), b''
+        start, end = 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d+)', (headers or {}).get('range', ''))
+        if match:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+        if start >= len(data) and data:
+            return httplib2.Response({ 'status': 416,
+                'content-range': f"bytes */{len(data)}" }), b''
+        content = data[start:end + 1]
+        self.drive.count_bytes('bytes_down', len(content))
+        return httplib2.Response({ 'status': 206,
+            'content-range': f"bytes {start}-{start + len(content) - 1}/{len(data)}" }), content
+
+class FakeBatch:
+    """Batch request sending its requests in a single round trip"""
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback = None, request_id = None):
+        self.requests.append((request, callback or self.callback, request_id))
+
+    def execute(self, http = None):
+        self.drive.round_trip('batch')
+        for request, callback, request_id in self.requests:
+            try:
+                self.drive.maybe_throttle()
+                self.drive.count_call(request.method)
+                result, error = request.run(), None
+            except HttpError as e:
+                result, error = None, e
+            callback(request_id, result, error)
+
+class Files:
+    """The files() resource"""
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q = '', fields = None, pageSize = 100, pageToken = None, **kwargs):
+        def run():
+            matches = self.drive.query(q)
+            start = int(pageToken or 0)
+            page = { 'files': [ self.drive.metadata(x) for x in matches[start:start + pageSize] ] }
+            if start + pageSize < len(matches):
+                page['nextPageToken'] = str(start + pageSize)
+            return page
+        return FakeRequest(self.drive, 'files.list', run)
+
+    def get(self, fileId, fields = None, **kwargs):
+        def run():
+            return self.drive.metadata(self.drive.lookup(fileId))
+        return FakeRequest(self.drive, 'files.get', run)
+
+    def get_media(self, fileId, **kwargs):
+        request = FakeRequest(self.drive, 'files.get_media', None)
+        request.uri = f"fake://files/{fileId}"
+        request.http = FakeHttp(self.drive)
+        return request
+
+    def export_media(self, fileId, mimeType = None, **kwargs):
+        """Google Docs files are exported as the contents they were created
+        with, whatever the format asked for
+        """
+        request = FakeRequest(self.drive, 'files.export_media', None)
+        request.uri = f"fake://export/{fileId}"
+        request.http = FakeHttp(self.drive, 'files.export_media')
+        return request
+
+    def create(self, body = None, media_body = None, fields = None, **kwargs):
+        def run(data = None):
+            return self.drive.metadata(self.drive.create(body, data))
+        return FakeRequest(self.drive, 'files.create', run, media_body)
+
+    def update(self, fileId, body = None, media_body = None, addParents = None,
+        removeParents = None, fields = None, **kwargs):
+        def run(data = None):
+            return self.drive.metadata(self.drive.update(fileId, body, data, addParents,
+                removeParents))
+        return FakeRequest(self.drive, 'files.update', run, media_body)
+
+    def copy(self, fileId, body = None, fields = None, **kwargs):
+        def run():
+            source = self.drive.lookup(fileId)
+            return self.drive.metadata(self.drive.create(dict(body, mimeType = source['mimeType']),
+                self.drive.contents.get(source['id'])))
+        return FakeRequest(self.drive, 'files.copy', run)
+
+    def delete(self, fileId, **kwargs):
+        def run():
+            self.drive.delete(fileId)
+            return ''
+        return FakeRequest(self.drive, 'files.delete', run)
+
+class Changes:
+    """The changes() resource"""
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        def run():
+            return { 'startPageToken': str(len(self.drive.changes_)) }
+        return FakeRequest(self.drive, 'changes.getStartPageToken', run)
+
+    def list(self, pageToken, pageSize = 100, fields = None, **kwargs):
+        def run():
+            start = int(pageToken)
+            if start > len(self.drive.changes_):
+                raise http_error(404, 'notFound')
+            changes = []
+            for file_id in self.drive.changes_[start:start + pageSize]:
+                file = self.drive.files_.get(file_id)
+                if file is None:
+                    changes.append({ 'fileId': file_id, 'removed': True })
+                else:
+                    changes.append({ 'fileId': file_id, 'removed': False,
+                        'file': self.drive.metadata(file) })
+            result = { 'changes': changes }
+            if start + pageSize < len(self.drive.changes_):
+                result['nextPageToken'] = str(start + pageSize)
+            else:
+                result['newStartPageToken'] = str(len(self.drive.changes_))
+            return result
+        return FakeRequest(self.drive, 'changes.list', run)
+
+class FakeDrive:
+    """In-memory Drive service.
+    stats counts the simulated HTTP round trips, the API calls by method
+    (a batch counts once as a round trip and once per call inside it), the
+    bytes uploaded and downloaded and the requests throttled.
+    """
+    def __init__(self, latency = 0, throttle_rate = 0, throttle_every = 0, seed = 0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.throttle_every = throttle_every
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.files_ = { ROOT_ID: { 'id': ROOT_ID, 'name': 'My Drive', 'mimeType': FOLDER_MIME,
+            'parents': [], 'trashed': False, 'version': 1 } }
+        self.children = { ROOT_ID: set() }
+        self.contents = {}
+        self.changes_ = []
+        self.sessions = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the request and byte counters"""
+        with self.lock:
+            self.stats = Counter()
+            self.calls = Counter()
+
+    # Service interface
+
+    def files(self):
+        return Files(self)
+
+    def changes(self):
+        return Changes(self)
+
+    def new_batch_http_request(self, callback = None):
+        return FakeBatch(self, callback)
+
+    # Accounting
+
+    def maybe_throttle(self):
+        with self.lock:
+            self.stats['requests'] += 1
+            throttle = (self.throttle_every and self.stats['requests'] % self.throttle_every == 0) or\
+                (self.throttle_rate and self.random.random() < self.throttle_rate)
+            if throttle:
+                self.stats['throttled'] += 1
+        if throttle:
+            raise http_error(403, 'userRateLimitExceeded')
+
+    def round_trip(self, method):
+        with self.lock:
+            self.stats['round_trips'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method != 'batch':
+            self.maybe_throttle()
+            self.count_call(method)
+
+    def count_call(self, method):
+        with self.lock:
+            self.calls[method] += 1
+
+    def count_bytes(self, key, count):
+        with self.lock:
+            self.stats[key] += count
+
+    # Storage
+
+    def lookup(self, file_id):
+        with self.lock:
+            file = self.files_.get(file_id)
+        if file is None:
+            raise http_error(404, 'notFound')
+        return file
+
+    def metadata(self, file):
+        result = { x: file[x] for x in ('id', 'name', 'mimeType', 'parents', 'trashed') }
+        result['parents'] = list(result['parents'])
+        result['version'] = str(file['version'])
+        if not file['mimeType'].startswith(GOOGLE_APPS_MIME):
+            data = self.contents.get(file['id'], b'')
+            result.update(md5Checksum = file['md5Checksum'], size = str(len(data)))
+        return result
+
+    def touch(self, file_id):
+        self.changes_.append(file_id)
+
+    def new_session(self):
+        with self.lock:
+            uri = f"fake://upload/{next(self.ids)}"
+            self.sessions[uri] = bytearray()
+        return uri
+
+    def create(self, body, data = None):
+        with self.lock:
+            file_id = f"id{next(self.ids)}"
+            parents = [ ROOT_ID if x == 'root' else x for x in body.get('parents', [ROOT_ID]) ]
+            file = { 'id': file_id, 'name': body['name'], 'parents': parents, 'trashed': False,
+                'mimeType': body.get('mimeType', 'application/octet-stream'), 'version': 1 }
+            self.files_[file_id] = file
+            if file['mimeType'] == FOLDER_MIME:
+                self.children[file_id] = set()
+            else:
+                self.set_content(file, data or b'')
+            for parent in parents:
+                self.children.setdefault(parent, set()).add(file_id)
+            self.touch(file_id)
+            return file
+
+    def update(self, file_id, body = None, data = None, add_parents = None, remove_parents = None):
+        with self.lock:
+            file = self.lookup(file_id)
+            for key, value in (body or {}).items():
+                file[key] = value
+            file['version'] += 1
+            if add_parents:
+                for parent in add_parents.split(','):
+                    file['parents'].append(parent)
+                    self.children.setdefault(parent, set()).add(file_id)
+            if remove_parents:
+                for parent in remove_parents.split(','):
+                    file['parents'].remove(parent)
+                    self.children[parent].discard(file_id)
+            if data is not None:
+                self.set_content(file, data)
+            self.touch(file_id)
+            return file
+
+    def set_content(self, file, data):
+        self.contents[file['id']] = bytes(data)
+        file['md5Checksum'] = hashlib.md5(data).hexdigest()
+
+    def delete(self, file_id):
+        with self.lock:
+            file = self.lookup(file_id)
+            for child in list(self.children.get(file_id, ())):
+                self.delete(child)
+            for parent in file['parents']:
+                self.children[parent].discard(file_id)
+            del self.files_[file_id]
+            self.children.pop(file_id, None)
+            self.contents.pop(file_id, None)
+            self.touch(file_id)
+
+    def query(self, q):
+        """Returns the files matching a query of the forms used by Gitd:
+        parent, mimeType, trashed and name clauses joined with 'and', with
+        names optionally grouped with 'or'.
+        """
+        with self.lock:
+            parent = re.search(r"'([^']*)' in parents", q)
+            if parent:
+                parent_id = ROOT_ID if parent.group(1) == 'root' else parent.group(1)
+                candidates = [ self.files_[x] for x in sorted(self.children.get(parent_id, ())) ]
+            else:
+                candidates = [ x for x in self.files_.values() if x['id'] != ROOT_ID ]
+            names = [ x.replace("\\'", "'").replace('\\\\', '\\')
+                for x in re.findall(r"name = '((?:[^'\\]|\\.)*)'", q) ]
+            result = []
+            for file in candidates:
+                if 'trashed = false' in q and file['trashed']:
+                    continue
+                if re.search(r"mimeType ?= ?'", q) and file['mimeType'] != FOLDER_MIME:
+                    continue
+                if "mimeType != '" in q and file['mimeType'] == FOLDER_MIME:
+                    continue
+                if names and file['name'] not in names:
+                    continue
+                result.append(file)
+            return result
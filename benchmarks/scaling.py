@@ -0,0 +1,58 @@
+"""Measures how long planning a push and a pull takes for a single folder
+holding N entries, to check matching stays linear as folders grow.
+
+Synthetic local and remote snapshots are used, so nothing is read from disk
+or Drive. A tenth of the local files are new, a tenth of the remote files
+were deleted locally and the rest are present on both sides.
+
+Usage: python3 benchmarks/scaling.py [N ...]
+"""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gitd.functions import RemoteTree
+from gitd.scanner import LocalTree, LocalFile
+from gitd.sync import plan_push, plan_pull
+
+SIZES = [ 1000, 10000, 100000, 1000000 ]
+
+def build_trees(count):
+    """Returns local and remote snapshots of a folder of count files
+    """
+    remote = RemoteTree('root')
+    local = LocalTree()
+    local.children[''] = []
+    tenth = count // 10
+    for i in range(count):
+        if i >= tenth:
+            # Sizes differ between the two sides so no file is hashed
+            remote.add('root', { 'id': f"id{i}", 'name': f"file{i}", 'mimeType': 'text/plain',
+                'md5Checksum': f"{i:032x}", 'size': str(i + 1) })
+        if i < count - tenth:
+            local.add('', LocalFile(f"file{i}", f"file{i}", False, 2 * count + i, 0, i))
+    return remote, local
+
+def measure(count):
+    """Returns the time taken to plan a push and a pull of count entries
+    """
+    remote, local = build_trees(count)
+    start = time.perf_counter()
+    push = plan_push('/nonexistent/', remote, 'root', after_time = 1, local = local)
+    push_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pull = plan_pull('/nonexistent/', remote, 'root', local = local)
+    pull_time = time.perf_counter() - start
+    assert len(push.uploads) == count // 10 and len(pull.deletes) == count // 10
+    return push_time, pull_time
+
+def main():
+    sizes = [ int(x) for x in sys.argv[1:] ] or SIZES
+    print(f"{'entries':>10} {'push (s)':>10} {'pull (s)':>10} {'us/entry':>10}")
+    for count in sizes:
+        push_time, pull_time = measure(count)
+        print(f"{count:>10} {push_time:>10.3f} {pull_time:>10.3f} " +
+            f"{(push_time + pull_time) / count * 1e6:>10.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Measures clone, push, pull and no-op syncs against an in-memory fake of
+Drive, reporting the wall time, the Drive requests made and the bytes moved
+by each step.
+
+Each scenario builds a synthetic tree, then:
+  push    initialises a repository and pushes the whole tree
+  clone   clones it into a second folder
+  modify  changes, adds and deletes a tenth of the files and pushes again
+  pull    pulls those changes into the clone
+  no-op   pushes and pulls again with nothing changed
+
+Scenarios:
+  small   many small files spread over a few folders
+  huge    a few large files, uploaded and downloaded in chunks
+  deep    files spread along deeply nested folders
+
+Usage: python3 benchmarks/sync.py [--scale S] [--latency MS] [--throttle P]
+    [--jobs N] [scenario ...]
+"""
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_drive import FakeDrive
+from gitd.client import Client
+from gitd.functions import format_size
+from gitd.scheduler import SCHEDULER
+
+MB = 1024 * 1024
+
+def build_small(root, scale, rng):
+    """Many 1-4 KB files in 20 folders"""
+    for i in range(int(2000 * scale)):
+        write_file(os.path.join(root, f"dir{i % 20}", f"file{i}.txt"), rng.randint(1024, 4096), rng)
+
+def build_huge(root, scale, rng):
+    """Four files of 24 MB"""
+    for i in range(4):
+        write_file(os.path.join(root, f"blob{i}.bin"), int(24 * MB * scale), rng)
+
+def build_deep(root, scale, rng):
+    """Five chains of 40 nested folders, with a few files at each level"""
+    for chain in range(5):
+        path = os.path.join(root, f"chain{chain}")
+        for depth in range(int(40 * scale)):
+            path = os.path.join(path, f"level{depth}")
+            for i in range(3):
+                write_file(os.path.join(path, f"file{i}.txt"), rng.randint(256, 2048), rng)
+
+SCENARIOS = { 'small': build_small, 'huge': build_huge, 'deep': build_deep }
+
+def write_file(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(size))
+
+def modify_tree(root, rng):
+    """Rewrites, adds and deletes files making up a tenth of the tree, and at
+    least one of each"""
+    files = sorted(os.path.join(folder, x) for folder, _, names in os.walk(root)
+        for x in names if not x.startswith('.gitd'))
+    for i, path in enumerate(rng.sample(files, max(min(3, len(files)), len(files) // 10))):
+        if i % 3 == 0:
+            os.remove(path)
+        elif i % 3 == 1:
+            write_file(path + '.new', max(1, os.path.getsize(path) // 4), rng)
+        else:
+            write_file(path, os.path.getsize(path), rng)
+
+def measure(drive, label, function, *args, **kwargs):
+    """Runs a sync step, returning a row of the wall time, requests and bytes
+    moved"""
+    drive.reset_stats()
+    retries = SCHEDULER.retries
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    return (label, seconds, drive.stats['round_trips'], sum(drive.calls.values()),
+        SCHEDULER.retries - retries, drive.stats['bytes_up'], drive.stats['bytes_down'])
+
+def run_scenario(name, scale, latency, throttle, jobs):
+    """Returns the rows measured for the named scenario"""
+    rng = random.Random(name)
+    drive = FakeDrive(latency = latency, throttle_rate = throttle)
+    client = Client(drive, jobs = jobs)
+    work = tempfile.mkdtemp(prefix = 'gitd-bench-')
+    try:
+        source = os.path.join(work, 'source')
+        os.mkdir(source)
+        SCENARIOS[name](source, scale, rng)
+        clones = os.path.join(work, 'clones')
+        os.mkdir(clones)
+        clone = os.path.join(clones, 'bench')
+
+        def push():
+            client.init(source, 'bench')
+            client.push(source, force = True)
+
+        rows = [ measure(drive, 'push', push),
+            measure(drive, 'clone', client.clone, clones, 'bench') ]
+        modify_tree(source, rng)
+        rows.append(measure(drive, 'modify', client.push, source, force = True))
+        rows.append(measure(drive, 'pull', client.pull, clone, force = True))
+        rows.append(measure(drive, 'no-op push', client.push, source, force = True))
+        rows.append(measure(drive, 'no-op pull', client.pull, clone, force = True))
+        return rows
+    finally:
+        shutil.rmtree(work)
+
+def main(arguments):
+    scale, latency, throttle, jobs = 1.0, 0.0, 0.0, 4
+    names = []
+    arguments = list(arguments)
+    while arguments:
+        arg = arguments.pop(0)
+        if arg == '--scale':
+            scale = float(arguments.pop(0))
+        elif arg == '--latency':
+            latency = float(arguments.pop(0)) / 1000
+        elif arg == '--throttle':
+            throttle = float(arguments.pop(0))
+        elif arg == '--jobs':
+            jobs = int(arguments.pop(0))
+        else:
+            names.append(arg)
+    for name in names:
+        if name not in SCENARIOS:
+            print(f"Error: unknown scenario '{name}', choose from {', '.join(SCENARIOS)}")
+            return
+
+    # Don't let the rate limit meant for Drive hide the cost of the sync itself
+    SCHEDULER.max_rate = SCHEDULER.rate = SCHEDULER.tokens = 1000000
+    SCHEDULER.base_delay = 0.01
+    print("| scenario | step | time (s) | round trips | calls | retries | up | down |")
+    print("|---|---|--:|--:|--:|--:|--:|--:|")
+    for name in names or SCENARIOS:
+        for label, seconds, trips, calls, retries, up, down in run_scenario(name, scale,
+            latency, throttle, jobs):
+            print(f"| {name} | {label} | {seconds:.2f} | {trips} | {calls} | {retries} | " +
+                f"{format_size(up)} | {format_size(down)} |")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,42 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import FileIO
 from os import listdir
+import os
+import sys
+import threading
 from .repository import *
 from .functions import *
+from .scheduler import SCHEDULER
+
+class RepoOutput:
+    """Stands in for sys.stdout while several repositories are synced at
+    once, prefixing every line printed by a repository's thread with the
+    repository's name so their output can be told apart. Partial lines, such
+    as prompts, are written out when flushed.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def set_prefix(self, prefix):
+        """Set the prefix of the lines printed by the current thread
+        """
+        self.local.prefix = prefix
+        self.local.line = ''
+
+    def write(self, text):
+        prefix = getattr(self.local, 'prefix', None)
+        if prefix is None:
+            with self.lock:
+                return self.stream.write(text)
+        lines = (self.local.line + text).split('\n')
+        self.local.line = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write(''.join(f"{prefix}{x}\n" for x in lines))
+        return len(text)
+
+    def flush(self):
+        prefix = getattr(self.local, 'prefix', None)
+        with self.lock:
+            if prefix is not None and self.local.line:
+                self.stream.write(prefix + self.local.line)
+                self.local.line = ''
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
 
 class Client:
     """Client object
     User interaction methods are stored in this object.
     """
-    def __init__(self, service):
+    def __init__(self, service, http_factory = None, jobs = 1, folder_cache = None,
+        chunk_size = CHUNK_SIZE, download_chunk_size = DOWNLOAD_CHUNK_SIZE):
         self.service = service
+        self.http_factory = http_factory
+        self.jobs = jobs
+        self.folder_cache = folder_cache
+        self.chunk_size = chunk_size
+        self.download_chunk_size = download_chunk_size
+        # Leave room for requests made by the main thread alongside the workers
+        SCHEDULER.set_concurrency(jobs + 1)
+
+    def get_pool(self):
+        """Returns a new transfer pool running up to self.jobs transfers at once
+        """
+        return TransferPool(self.http_factory, self.jobs, self.chunk_size,
+            self.download_chunk_size)
 
-    def clone(self, container, path = "root"):
+    def clone(self, container, path = "root", exports = None, include = None, exclude = (),
+        metadata_only = False):
         """Clone a repository into the given container folder.
         If no path is supplied then the "root" path will be chosen.
+        Google Docs files are exported in the formats given by the exports
+        dict of extensions by Google Docs type, or the default ones.
+        If include is given, only those relative paths are cloned, and paths
+        matching the gitignore-style patterns in exclude are left out. A
+        metadata_only clone downloads nothing but an index of the remote tree
+        unless include is given; paths are then downloaded with fetch.
         """
-        repo = clone_repo_in_folder(self.service, container, path)
+        repo = clone_repo_in_folder(self.service, container, path, self.folder_cache)
         if repo:
             if not repo.is_corrupt():
-                repo.pull()
-                print(f"{repo.get_name()} cloned.")
+                if exports is not None:
+                    repo.set_export_formats(exports)
+                if metadata_only and include is None:
+                    include = []
+                if include is not None or exclude:
+                    repo.set_sparse(include, exclude)
+                if metadata_only:
+                    repo.index_remote()
+                pool = self.get_pool()
+                plan = repo.pull(pool = pool)
+                pool.close()
+                if plan is not None:
+                    print(f"{repo.get_name()} cloned.")
         else:
             print("Error: Unable to clone a repository where one already exists")
         
-    def push(self, container, path = None):
+    def push(self, container, path = None, checksum = False, force = False, dry_run = False):
         """Push changes to a repository in the given container folder.
+        If checksum is set to True, only files whose contents differ from Drive
+        are uploaded. If dry_run is set to True, the planned changes are only
+        printed.
         """
         repo = get_repo_in_folder(self.service, container)
         if repo:
-            repo.push()
+            pool = self.get_pool()
+            repo.push(checksum = checksum, force = force, pool = pool, dry_run = dry_run)
+            pool.close()
         else:
             print("Error: repository doesn't exist in this folder")
 
-    def pull(self, container, path = None):
+    def pull(self, container, path = None, force = False, dry_run = False, exports = None):
         """Pull changes into a repository in the given container folder.
+        If dry_run is set to True, the planned changes are only printed.
+        If exports is given, it replaces the formats Google Docs files are
+        exported in.
         """
         repo = get_repo_in_folder(self.service, container)
         if repo:
-            repo.pull()
+            if exports is not None and not dry_run:
+                repo.set_export_formats(exports)
+            pool = self.get_pool()
+            repo.pull(pool = pool, dry_run = dry_run, force = force)
+            pool.close()
+        else:
+            print("Error: repository doesn't exist in this folder")
+
+    def fetch(self, container, path = None, force = False):
+        """Download the given path into a sparse or metadata-only clone in the
+        given container folder, or refresh its index of the remote tree if no
+        path is supplied.
+        """
+        repo = get_repo_in_folder(self.service, container)
+        if repo:
+            pool = self.get_pool()
+            repo.fetch(path, pool = pool, force = force)
+            pool.close()
+        else:
+            print("Error: repository doesn't exist in this folder")
+
+    def pack(self, container, path, threshold = None, off = False):
+        """Pack the small files of the given folder of the repository in the
+        given container folder from the next push on, or stop packing it if
+        off is set. threshold is the size in bytes below which files are
+        packed, or None for the default.
+        """
+        repo = get_repo_in_folder(self.service, container)
+        if repo:
+            if off:
+                repo.pack(path, None)
+            elif threshold is not None:
+                repo.pack(path, threshold)
+            else:
+                repo.pack(path)
+        else:
+            print("Error: repository doesn't exist in this folder")
+
+    def pull_all(self, container, force = False, dry_run = False, repo_jobs = 4, exports = None):
+        """Pull every repository found beneath the given container folder,
+        repo_jobs of them at a time. See sync_all.
+        """
+        def pull(repo, pool):
+            if exports is not None and not dry_run:
+                repo.set_export_formats(exports)
+            return repo.pull(pool = pool, dry_run = dry_run, force = force)
+        self.sync_all(container, pull, repo_jobs, dry_run)
+
+    def push_all(self, container, checksum = False, force = False, dry_run = False,
+        repo_jobs = 4):
+        """Push every repository found beneath the given container folder,
+        repo_jobs of them at a time. See sync_all.
+        """
+        def push(repo, pool):
+            return repo.push(checksum = checksum, force = force, pool = pool, dry_run = dry_run)
+        self.sync_all(container, push, repo_jobs, dry_run)
+
+    def sync_all(self, container, sync, repo_jobs = 4, dry_run = False):
+        """Run sync(repo, pool) on every repository found beneath the given
+        container folder, which returns the plan it ran or None. Up to
+        repo_jobs repositories are synced at once in this process, sharing
+        its service, folder cache, rate limit and transfer workers, and a
+        combined summary is printed at the end. A repository that fails
+        doesn't stop the others.
+        """
+        folders = find_repos(container)
+        if not folders:
+            print("Error: no repositories found in this folder")
+            return
+        repo_jobs = max(1, min(repo_jobs, len(folders)))
+        SCHEDULER.set_concurrency(self.jobs + repo_jobs)
+        pool = self.get_pool()
+        output = RepoOutput(sys.stdout) if repo_jobs > 1 else None
+
+        def run(folder):
+            name = os.path.relpath(folder, container)
+            if output is not None:
+                output.set_prefix(f"[{name}] ")
+            else:
+                print(f"{name}:")
+            repo_pool = pool.share()
+            try:
+                repo = get_repo_in_folder(self.service, folder, self.folder_cache)
+                plan = sync(repo, repo_pool)
+                repo_pool.close()
+                return name, plan, repo_pool.failed, None
+            except Exception as e:
+                print(f"Error: {e}")
+                return name, None, repo_pool.failed, e
+            finally:
+                if output is not None:
+                    output.flush()
+                    output.set_prefix(None)
+
+        if output is None:
+            results = [ run(x) for x in folders ]
+        else:
+            stdout = sys.stdout
+            sys.stdout = output
+            try:
+                with ThreadPoolExecutor(max_workers = repo_jobs) as executor:
+                    results = list(executor.map(run, folders))
+            finally:
+                sys.stdout = stdout
+        pool.close()
+        print_sync_summary(results, dry_run)
+
+    def watch(self, container, delay = 1, interval = 30, force = False):
+        """Keep the repository in the given container folder in sync,
+        pushing local changes as they happen and pulling remote changes every
+        interval seconds, until interrupted.
+        """
+        repo = get_repo_in_folder(self.service, container)
+        if repo:
+            pool = self.get_pool()
+            repo.watch(pool = pool, delay = delay, interval = interval, force = force)
+            pool.close()
+        else:
+            print("Error: repository doesn't exist in this folder")
+
+    def status(self, container, checksum = False):
+        """Show the changes a push and a pull would make to the repository in
+        the given container folder.
+        """
+        repo = get_repo_in_folder(self.service, container)
+        if repo:
+            repo.status(checksum = checksum)
         else:
             print("Error: repository doesn't exist in this folder")
     
@@ -44,7 +255,7 @@ class Client:
         """Initialise a new repository inside the current folder at the given
         path inside the user's Drive.
         """
-        folder = create_folder(self.service, path, fail_if_exists = True)
+        folder = create_folder(self.service, path, fail_if_exists = True, cache = self.folder_cache)
         if not folder:
             print(f"Error: This repository already exists, clone it by running 'gitd clone {path}'")
         else:
@@ -54,8 +265,20 @@ class Client:
     def list_repos(self, path = ''):
         """Gets and displays available repositories inside the user's Drive at the given path.
         """
-        path_id = find_folder_id(self.service, path)
-        repos = [ x['name'] for x in get_folders(self.service, path_id) ]
+        path_id = find_folder_id(self.service, path, cache = self.folder_cache)
+        tree = None
+        if path_id is not None:
+            tree = get_remote_tree(self.service, path_id, recursive = False)
+            if tree.missing and self.folder_cache is not None:
+                # The cached ID is stale, look the path up on Drive again
+                self.folder_cache.invalidate('/'.join(x for x in path.split('/') if x))
+                path_id = find_folder_id(self.service, path, cache = self.folder_cache)
+                if path_id is not None:
+                    tree = get_remote_tree(self.service, path_id, recursive = False)
+        if path_id is None or tree.missing:
+            print(f"Error: '{path}' doesn't exist")
+            return
+        repos = [ x['name'] for x in tree.get_folders(path_id) ]
         repos.sort()
 
         if len(repos) < 1:
@@ -63,4 +286,34 @@ class Client:
 
         for repo in repos:
             print(repo)
-        
\ No newline at end of file
+        
+def print_sync_summary(results, dry_run = False):
+    """Print the combined summary of syncing several repositories, given the
+    (name, plan, failed transfers, error) result of each. Repositories that
+    were already up-to-date are only counted.
+    """
+    print(f"Summary of {len(results)} repositories:")
+    uploads = downloads = deletes = upload_bytes = download_bytes = 0
+    counts = { 'up-to-date': 0, 'changed': 0, 'failed': 0, 'skipped': 0 }
+    for name, plan, failed, error in results:
+        if error is not None:
+            status = 'failed'
+            print(f" {name}: error: {error}")
+        elif plan is None:
+            status = 'skipped'
+            print(f" {name}: skipped")
+        elif plan.is_empty() and not failed:
+            status = 'up-to-date'
+        else:
+            status = 'failed' if failed else 'changed'
+            print(f" {name}: {plan.summary()}" +
+                (f", {failed} failed transfer(s)" if failed else ""))
+            uploads += len(plan.uploads)
+            upload_bytes += plan.upload_bytes()
+            downloads += len(plan.downloads)
+            download_bytes += plan.download_bytes()
+            deletes += len(plan.top_deletes())
+        counts[status] += 1
+    print(("Planned" if dry_run else "Total") + f": {uploads} upload(s) " +
+        f"({format_size(upload_bytes)}), {downloads} download(s) ({format_size(download_bytes)}), " +
+        f"{deletes} deletion(s); " + ', '.join(f"{count} {status}" for status, count in counts.items()))
@@ -0,0 +1,71 @@
+import json
+import os
+
+def get_cache_dir():
+    """Returns the folder Gitd keeps its per-user cache files in
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gitd')
+
+class FolderCache:
+    """Cache of Drive folder paths to folder IDs, shared by every repository
+    of the current user.
+    Paths are stored relative to the root of the user's Drive in the format
+    'foo/bar'. Entries are trusted until Drive reports the cached folder as
+    trashed or missing, at which point the caller should invalidate it.
+    """
+    def __init__(self, path = None):
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'folders.json')
+        self.path = path
+        self.folders = {}
+        self.modified = False
+        try:
+            with open(path, 'rb') as cache_file:
+                self.folders = json.loads(cache_file.read())
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def get(self, path):
+        """Returns the cached ID of the folder at the given path, or None
+        """
+        return self.folders.get(path)
+
+    def set(self, path, folder_id):
+        """Cache the ID of the folder at the given path
+        """
+        if self.folders.get(path) != folder_id:
+            self.folders[path] = folder_id
+            self.modified = True
+
+    def longest_prefix(self, pfolders):
+        """Returns the number of leading folders of the list pfolders whose IDs
+        are cached, and the ID of the last of them (or None).
+        """
+        for count in range(len(pfolders), 0, -1):
+            folder_id = self.get('/'.join(pfolders[:count]))
+            if folder_id:
+                return count, folder_id
+        return 0, None
+
+    def invalidate(self, path):
+        """Forget the folder at the given path and every folder beneath it
+        """
+        for key in list(self.folders):
+            if key == path or key.startswith(path + '/'):
+                del self.folders[key]
+                self.modified = True
+
+    def save(self):
+        """Write the cache to disk if it has changed.
+        The cache is written to a temporary file first and moved into place,
+        so concurrent Gitd processes never read a partial cache.
+        """
+        if not self.modified:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(json.dumps(self.folders).encode())
+        os.replace(temp_path, self.path)
+        self.modified = False
@@ -1,73 +1,211 @@
+import mmap
 import os
 from io import FileIO
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
-from googleapiclient.errors import HttpError
-from shutil import rmtree
 from hashlib import md5
+import threading
+import time
+from .scheduler import SCHEDULER, error_status, is_retryable, is_throttled
+from .stats import STATS, timed
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+BATCH_SIZE = 100 # Maximum number of requests in a Drive batch request
+PAGE_SIZE = 1000 # Maximum number of files returned by a single list request
+CHUNK_SIZE = 8 * 1024 * 1024 # Default size of upload chunks, must be a multiple of 256 KB
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024 # Default size of download chunks
+READ_SIZE = 1024 * 1024 # Size of reads when hashing local files
+MMAP_SIZE = 64 * 1024 * 1024 # Files at least this large are memory mapped when hashed
+PROMPT_LOCK = threading.RLock() # Held while asking the user a question
+SNAPSHOT_FIELDS = 'nextPageToken, files(id, name, mimeType, md5Checksum, size, version)'
+CHANGE_FIELDS = 'nextPageToken, newStartPageToken, changes(fileId, removed, ' +\
+    'file(name, id, md5Checksum, size, mimeType, parents, trashed, version))'
+GOOGLE_APPS_MIME = 'application/vnd.google-apps.' # Prefix of Google Docs MIME types
+# Formats Google Docs files are exported in by default, by Google Docs type
+EXPORT_FORMATS = {
+    'document': 'docx',
+    'spreadsheet': 'xlsx',
+    'presentation': 'pptx',
+    'drawing': 'pdf',
+    'script': 'json'
+}
+# MIME types of the formats Google Docs files can be exported in, by extension
+EXPORT_MIME_TYPES = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'odt': 'application/vnd.oasis.opendocument.text',
+    'ods': 'application/x-vnd.oasis.opendocument.spreadsheet',
+    'odp': 'application/vnd.oasis.opendocument.presentation',
+    'rtf': 'application/rtf',
+    'epub': 'application/epub+zip',
+    'html': 'text/html',
+    'txt': 'text/plain',
+    'md': 'text/markdown',
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'svg': 'image/svg+xml',
+    'json': 'application/vnd.google-apps.script+json'
+}
 
 # Useful functions
 
-def get_files(service, path_id, fields = 'files(name, id, mimeType)'):
-    """Returns a list of all files inside the given folder id
+class RemoteTree:
+    """In-memory snapshot of a Drive folder tree.
+    Files and folders are indexed by ID, and each folder's children are
+    indexed by name. When a folder holds several items with the same name,
+    the first one listed is the one found by name.
     """
-    q = f"'{path_id}' in parents and mimeType != 'application/vnd.google-apps.folder' and trashed = false"
-    result = service.files().list(q=q, fields = fields).execute()['files']
-    return result
-
-def get_folders(service, path_id):
-    """Returns a list of all folders inside the given folder id
+    def __init__(self, root_id):
+        self.root_id = root_id
+        self.missing = False
+        self.by_id = { root_id: { 'id': root_id, 'name': '', 'mimeType': FOLDER_MIME } }
+        self.children = { root_id: {} }
+        self.parents = {}
+
+    def add(self, parent_id, file):
+        """Add a file or folder to the given parent folder
+        """
+        self.by_id[file['id']] = file
+        self.parents[file['id']] = parent_id
+        self.children.setdefault(parent_id, {}).setdefault(file['name'], file)
+        if file['mimeType'] == FOLDER_MIME:
+            self.children.setdefault(file['id'], {})
+
+    def get(self, file_id):
+        """Returns the file or folder with the given ID, or None
+        """
+        return self.by_id.get(file_id)
+
+    def get_child(self, folder_id, name):
+        """Returns the item with the given name inside a folder, or None
+        """
+        return self.children.get(folder_id, {}).get(name)
+
+    def get_files(self, folder_id):
+        """Returns a list of the files inside the given folder
+        """
+        return [ x for x in self.children.get(folder_id, {}).values()
+            if x['mimeType'] != FOLDER_MIME ]
+
+    def get_folders(self, folder_id):
+        """Returns a list of the folders inside the given folder
+        """
+        return [ x for x in self.children.get(folder_id, {}).values()
+            if x['mimeType'] == FOLDER_MIME ]
+
+    def walk(self, folder_id, prefix):
+        """Yields a (relative path, file) tuple for everything beneath the
+        given folder, where prefix is the relative path of the folder
+        """
+        for file in self.children.get(folder_id, {}).values():
+            relpath = join_path(prefix, file['name'])
+            yield relpath, file
+            if file['mimeType'] == FOLDER_MIME:
+                yield from self.walk(file['id'], relpath)
+
+@timed('list remote tree')
+def get_remote_tree(service, path_id, recursive = True, ignore = None, prefix = ''):
+    """Returns a RemoteTree snapshot of the Drive folder with the given ID.
+    Each folder is listed once with a single query for both files and folders,
+    following every result page. The folders of each level of the tree are
+    listed together in batch requests.
+    If recursive is False, only the folder's direct children are listed.
+    If the folder itself is trashed or doesn't exist, the returned tree is
+    empty and its missing attribute is set to True.
+    Files and folders matched by the IgnoreRules ignore are left out of the
+    snapshot, and ignored folders aren't listed. Gitd's own files, such as
+    the indexes of packed folders, are always kept. prefix is the path of the
+    folder relative to the repository, which ignore rules are matched against.
     """
-    q = f"'{path_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false"
-    result = service.files().list(q=q).execute()['files']
-    return result
-
-def create_folder(service, path, from_path = 'root', fail_if_exists = False):
+    tree = RemoteTree(path_id)
+    paths = { path_id: prefix }
+    check = service.files().get(fileId = path_id, fields = 'id, trashed')
+    level = [ path_id ]
+    while level:
+        next_level = []
+        pending = [ (folder_id, None) for folder_id in level ]
+        while pending:
+            requests = []
+            for folder_id, token in pending:
+                q = f"'{folder_id}' in parents and trashed = false"
+                requests.append(service.files().list(q = q, fields = SNAPSHOT_FIELDS,
+                    pageSize = PAGE_SIZE, pageToken = token))
+            if check is not None:
+                # Check the folder itself exists in the same batch as the
+                # first listing
+                requests.insert(0, check)
+            results = batch_execute(service, requests)
+            if check is not None:
+                check = None
+                root, error = results.pop(0)
+                if error is not None and error_status(error) != 404:
+                    raise error
+                if error is not None or root.get('trashed'):
+                    tree.missing = True
+                    return tree
+            next_pages = []
+            for (folder_id, _), (result, error) in zip(pending, results):
+                if error:
+                    raise error
+                for file in result.get('files', []):
+                    is_folder = file['mimeType'] == FOLDER_MIME
+                    if ignore is not None and not is_repo_file(file['name']):
+                        relpath = join_path(paths[folder_id], file['name'])
+                        if ignore.match(relpath, is_folder):
+                            continue
+                        paths[file['id']] = relpath
+                    tree.add(folder_id, file)
+                    if recursive and is_folder:
+                        next_level.append(file['id'])
+                if result.get('nextPageToken'):
+                    next_pages.append((folder_id, result['nextPageToken']))
+            pending = next_pages
+        level = next_level
+    return tree
+
+def create_folder(service, path, from_path = 'root', fail_if_exists = False, cache = None):
     """Creates a folder with the given path. If fail_if_exists is set to True
     then the function will return False if a folder at the given path already
     exists.
+    If a FolderCache is supplied, it is used to resolve the path and the IDs
+    of any folders created are added to it.
 
     If this function succeeds then the ID of the new folder will be returned
     """
-    if 'path' == '':
-        return 'root'
-
     pfolders = path.split('/') # Get folder names
     pfolders = [ f for f in pfolders if f != '' ] # Prune folders named ''
 
-    current_id = from_path
-    for pf in pfolders:
-        q = f"'{current_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false"
-        lfolders = service.files().list(q=q).execute()
-        found = False
-        for lf in lfolders['files']:
-            if lf['name'] == pf:
-                if fail_if_exists and pf == pfolders[-1:][0]:
-                    # Destination folder exists, return error if fail_if_exists
-                    # was specified.
-                    return False
-                else:
-                    current_id = lf['id']
-                    found = True
-                    break
-        if not found:
-            # Folder doesn't exist, create it
-            body = {
-                'name': pf,
-                'parents': [current_id],
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            result = service.files().create(body = body).execute()
-            current_id = result['id']
+    count, current_id = resolve_path(service, pfolders, from_path, cache, check = fail_if_exists)
+    if fail_if_exists and pfolders and count == len(pfolders):
+        # Destination folder exists, return error if fail_if_exists was
+        # specified.
+        return False
+
+    for i in range(count, len(pfolders)):
+        # Folder doesn't exist, create it
+        body = {
+            'name': pfolders[i],
+            'parents': [current_id],
+            'mimeType': FOLDER_MIME
+        }
+        result = SCHEDULER.execute(service.files().create(body = body))
+        current_id = result['id']
+        if cache is not None and from_path == 'root':
+            cache.set('/'.join(pfolders[:i + 1]), current_id)
 
     return current_id
     
 
-def find_folder_id(service, path, from_path = 'root'):
+def find_folder_id(service, path, from_path = 'root', cache = None):
     """Find the ID of the folder at the given path
     Path should be in the format of 'foo/bar'. If the ID can't be found, None
     will be returned. 
     To start scanning from a directory other than 'root', set the from_path
     variable
+    If a FolderCache is supplied, cached folders are used without listing
+    them on Drive again.
     """
     if path == '':
         return 'root'
@@ -75,177 +213,534 @@ def find_folder_id(service, path, from_path = 'root'):
     pfolders = path.split('/') # Get folder names
     pfolders = [ f for f in pfolders if f != '' ] # Prune folders named ''
 
-    current_id = from_path
-    for pf in pfolders:
-        q = f"'{current_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed = false"
-        lfolders = service.files().list(q=q).execute()
-        found = False
-        for lf in lfolders['files']:
-            if lf['name'] == pf:
-                current_id = lf['id']
-                found = True
-                break
-        if not found:
-            return None
+    count, folder_id = resolve_path(service, pfolders, from_path, cache)
+    if count < len(pfolders):
+        return None
+    return folder_id
+
+def resolve_path(service, pfolders, from_path = 'root', cache = None, check = False):
+    """Resolves as much of the given list of folder names as exists, starting
+    from the folder from_path. Returns the number of folders found and the ID
+    of the last of them (or from_path if none were found).
+    Paths from 'root' are looked up in the FolderCache first, if one is
+    supplied, and only the folders missing from it are looked up on Drive.
+    The last cached folder is checked in the same batch, and if it turns out
+    to be trashed or missing it's invalidated and the path resolved again from
+    the root. A path that's cached in full is returned without any request
+    unless check is set, so callers should invalidate it themselves if Drive
+    later reports the folder missing.
+    """
+    if not pfolders:
+        return 0, from_path
+    count, folder_id = 0, from_path
+    use_cache = cache is not None and from_path == 'root'
+    if use_cache:
+        count, cached_id = cache.longest_prefix(pfolders)
+        folder_id = cached_id or from_path
+        if count == len(pfolders) and not check:
+            return count, folder_id
+
+    ids = lookup_folders(service, pfolders[count:], folder_id)
+    if ids is None and count > 0:
+        # Cached folder no longer exists, resolve the whole path again
+        cache.invalidate('/'.join(pfolders[:count]))
+        count, folder_id = 0, from_path
+        ids = lookup_folders(service, pfolders, folder_id)
+    if ids is None:
+        return 0, from_path
+
+    for i, found_id in enumerate(ids, count + 1):
+        if use_cache:
+            cache.set('/'.join(pfolders[:i]), found_id)
+        folder_id = found_id
+    return count + len(ids), folder_id
+
+def lookup_folders(service, pfolders, from_id):
+    """Returns the IDs of the folders along the given list of folder names,
+    starting from the folder from_id. If a folder doesn't exist, the IDs of
+    the folders found before it are returned. If from_id itself is trashed or
+    doesn't exist, None is returned.
+    Each folder is looked up among the children of the one before it, so
+    only the starting folder's subtree is queried. The first lookup is
+    batched with a request for the starting folder.
+    """
+    requests = [ service.files().get(fileId = from_id, fields = 'id, trashed') ]
+    if pfolders:
+        requests.append(child_folder_request(service, from_id, pfolders[0]))
+    results = batch_execute(service, requests)
+    start, error = results[0]
+    if error_status(error) == 404:
+        return None
+    if error:
+        raise error
+    if start.get('trashed'):
+        return None
+
+    ids = []
+    for i, pf in enumerate(pfolders):
+        if i == 0:
+            listing, error = results[1]
+            if error:
+                raise error
+        else:
+            listing = SCHEDULER.execute(child_folder_request(service, ids[-1], pf))
+        folders = listing.get('files', [])
+        if not folders:
+            break
+        ids.append(folders[0]['id'])
+    return ids
+
+def child_folder_request(service, parent_id, name):
+    """Returns a request listing the folder with the given name inside the
+    folder parent_id
+    """
+    q = f"'{parent_id}' in parents and name = '{escape_query(name)}' " +\
+        f"and mimeType = '{FOLDER_MIME}' and trashed = false"
+    return service.files().list(q = q, fields = 'files(id)', pageSize = 1)
 
-    return current_id
+def escape_query(value):
+    """Escapes a string for use inside a quoted Drive query value
+    """
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+def batch_execute(service, requests):
+    """Executes the given Drive requests using batch HTTP requests of up to
+    BATCH_SIZE requests each.
+    Returns a list of (result, error) tuples in the same order as the given
+    requests, where error is the HttpError raised by that request, or None.
+    Requests failing with a retryable error, such as a rate limit, are sent
+    again in a later batch after backing off.
+    """
+    results = [ (None, None) ] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    def send(ids):
+        batch = service.new_batch_http_request(callback = callback)
+        for i in ids:
+            batch.add(requests[i], request_id = str(i))
+        batch.execute()
+
+    pending = list(range(len(requests)))
+    attempt = 0
+    while pending:
+        for start in range(0, len(pending), BATCH_SIZE):
+            ids = pending[start:start + BATCH_SIZE]
+            SCHEDULER.call(send, ids, cost = len(ids), operation = 'batch')
+        pending = [ i for i in pending if is_retryable(results[i][1]) ]
+        if not pending or attempt >= SCHEDULER.max_retries:
+            break
+        throttled = [ results[i][1] for i in pending if is_throttled(results[i][1]) ]
+        if throttled:
+            SCHEDULER.adapt(throttled[0])
+        STATS.retry('drive batch', len(pending))
+        SCHEDULER.backoff(attempt)
+        attempt += 1
+    return results
+
+def get_start_page_token(service):
+    """Returns the page token marking the current end of the changes feed
+    """
+    return SCHEDULER.execute(service.changes().getStartPageToken())['startPageToken']
 
-def push_from_folder(service, container, folder, recursive = True, force = False, after_time = None):
-    """Pushes files from the inside the container folder into the Drive folder with the given folder ID.
-    This function is set to recursive by default, so it will upload files
-    inside sub-directories
+def get_changes(service, token):
+    """Returns a tuple of all changes made since the given page token and the
+    page token to use for the next request.
+    If the given token has expired or is invalid, (None, None) is returned and
+    a full walk of the repository is required.
     """
-    container = to_path(container)
-    ls = [ x for x in os.listdir(container) ]
+    changes = []
+    while True:
+        try:
+            result = SCHEDULER.execute(service.changes().list(pageToken = token,
+                pageSize = PAGE_SIZE, spaces = 'drive', fields = CHANGE_FIELDS))
+        except Exception as e:
+            if error_status(e) in (400, 404, 410):
+                return None, None
+            raise
+        changes += result.get('changes', [])
+        if 'newStartPageToken' in result:
+            return changes, result['newStartPageToken']
+        token = result['nextPageToken']
+
+def join_path(prefix, name):
+    """Joins a relative repository path and a file name
+    """
+    return f"{prefix}/{name}" if prefix else name
 
-    ffiles = [ x for x in ls if os.path.isfile(container+x) ]
-    ffolders = [ x for x in ls if x not in ffiles ]
+def is_inside(relpath, roots):
+    """Returns True if the relative path is inside any of the given relative
+    root paths. Each folder containing relpath is looked up in roots, so
+    roots should be a set when there are many of them.
+    """
+    index = relpath.rfind('/')
+    while index > 0:
+        relpath = relpath[:index]
+        if relpath in roots:
+            return True
+        index = relpath.rfind('/')
+    return False
+
+def is_google_doc(file):
+    """Returns True if the given Drive file is a Google Docs file, which has
+    no contents of its own and has to be exported to be downloaded
+    """
+    return file['mimeType'].startswith(GOOGLE_APPS_MIME) and file['mimeType'] != FOLDER_MIME
 
-    efiles = get_files(service, folder)
-    efolders = get_folders(service, folder)
+def export_format(file, formats = None):
+    """Returns the extension of the format the given Google Docs file is
+    exported in, using the formats dict of extensions by Google Docs type, or
+    None if it isn't exported.
+    """
+    return (formats or EXPORT_FORMATS).get(file['mimeType'][len(GOOGLE_APPS_MIME):])
 
-    to_delete = [ x for x in efiles if x['name'] not in ffiles ]
-    for efolder in efolders:
-        if efolder['name'] not in ffolders:
-            to_delete.append(efolder)
+def local_name(file, formats = None):
+    """Returns the name of the local copy of the given Drive file. Google
+    Docs files are named after the format they're exported in, or None is
+    returned if they aren't exported.
+    """
+    if not is_google_doc(file):
+        return file['name']
+    extension = export_format(file, formats)
+    if extension is None:
+        return None
+    if file['name'].lower().endswith('.' + extension):
+        return file['name']
+    return f"{file['name']}.{extension}"
+
+def parse_export_formats(spec):
+    """Returns the formats dict described by a comma separated list of
+    type=extension pairs, e.g. 'document=odt,drawing=none', starting from
+    EXPORT_FORMATS. Types set to 'none' aren't exported. Raises ValueError if
+    a type or format is unknown.
+    """
+    formats = dict(EXPORT_FORMATS)
+    for pair in spec.split(','):
+        kind, _, extension = pair.strip().partition('=')
+        extension = extension.lower().lstrip('.')
+        if kind not in EXPORT_FORMATS:
+            raise ValueError(f"unknown Google Docs type '{kind}', choose from " +
+                ', '.join(EXPORT_FORMATS))
+        if extension != 'none' and extension not in EXPORT_MIME_TYPES:
+            raise ValueError(f"unknown export format '{extension}', choose from " +
+                ', '.join(EXPORT_MIME_TYPES))
+        formats[kind] = None if extension == 'none' else extension
+    return formats
+
+def is_repo_file(name):
+    """Returns True if the given file name is one of Gitd's own repository
+    files, which are never pushed, pulled or deleted.
+    """
+    return name == '.gitd' or name.startswith('.gitd-')
 
-    # If files need to be deleted, ask user if they wish to proceed
-    if not force and (len(to_delete) > 0):
-        print("The following files/folders are present and need to be deleted in order to push.")
-        for file in to_delete:
-            if(file['mimeType'] == 'application/vnd.google-apps.folder'):
-                print(f" {file['name']}/...")
-            else:
-                print(f" {file['name']}")
-        if not prompt("Do you still wish to proceed (y/n)? "):
-            return
-
-    # Delete out-dated files on Google Drive
-    for file in to_delete:
-        service.files().delete(fileId = file['id']).execute()
-
-    # Upload files
-    for ffile in ffiles:
-        if(ffile == '.gitd'):
-            continue
-        updated = False
-        for efile in efiles:
-            if ffile == efile['name']:
-                # Check if file was modified after the given after_time
-                if not after_time or\
-                    (os.path.getmtime(os.path.join(container, ffile)) <= after_time):
-                    # File was modified before or at given after time, skip it.
-                    print(f"{ffile} already up-to-date.")
-                    updated = True
-                    break
-                else:
-                    # File modified after given after_time, upload it.
-                    print(f"Updating {ffile}...")
-                    media = MediaFileUpload(container+ffile)
-                    service.files().update(fileId = efile['id'], media_body = media).execute()
-                    updated = True
-                    break
-        if not updated:
-            print(f"Uploading new file {ffile}...")
-
-            body = {
-                'name': ffile,
-                'parents': [folder]
-            }
-
-            media = MediaFileUpload(container+ffile)
-
-            service.files().create(body = body, media_body = media).execute()
-
-    # Create folders
-    for ffolder in ffolders:
-        updated = False
-        for efolder in efolders:
-            if ffolder == efolder['name']:
-                push_from_folder(service, container+ffolder+"/", efolder['id'])
-                updated = True
-                break
-        if not updated:
-            # Folder doesn't exist on Drive, create it
-            body = {
-                'name': ffolder,
-                'parents': [folder],
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-
-            result = service.files().create(body = body).execute()
-            # Upload contents
-            push_from_folder(service, container+ffolder+"/", result['id'])
-
-
-def pull_from_folder(service, container, folder, recursive = True, force = False):
-    """Pulls files from the given folder ID and stores them in the container path.
-    This function is set to recursive by default, so it will download files
-    inside sub-directories.
-    If force is set to True then the program will automatically assume that the
-    the user responds 'Yes' to any prompt.
-    """
-    container = to_path(container)
-    files = get_files(service, folder, fields = 'files(name, id, md5Checksum, mimeType)')
-    for x in get_folders(service, folder):
-        files.append(x)
-    
-    # Check to see if any files need deleting
-    ffiles = [ x['name'] for x in files ]
-    to_delete = [ x for x in os.listdir(container) if x not in ffiles \
-        and x != '.gitd' ]
-
-    # If files need to be deleted, ask user if they wish to proceed
-    if not force and (len(to_delete) > 0):
-        print("The following files/folders are present and need to be deleted in order to pull.")
-        for file in to_delete:
-            if(os.path.isdir(os.path.join(container, file))):
-                print(f" {file}/...")
-            else:
-                print(f" {file}")
-        if not prompt("Do you still wish to proceed (y/n)? "):
-            return
-    
-    # Delete files that didn't exist on the Google Drive
-    for file in to_delete:
-        if(os.path.isdir(os.path.join(container, file))):
-            # Delete the directory
-            rmtree(os.path.join(container, file))
-        else:
-            # Delete the file
-            os.remove(os.path.join(container, file))
-
-    # Download files from Drive
-    for file in files:
-        if(file['name'] == '.gitd'):
-            continue
-
-        if(file['mimeType'] == 'application/vnd.google-apps.folder'):
-            # File is of type folder, create folder an download it's files
-            path = os.path.join(container, file['name'])
-            safe_create_folder(path)
-            if recursive:
-                pull_from_folder(service, path, file['id'])
-        else:
-            file_path = os.path.join(container, file['name'])
-            if(os.path.isfile(file_path)):
-                emd5 = get_md5_checksum(file_path)
-                fmd5 = file['md5Checksum']
-                if(emd5 == fmd5):
-                    print(f"File '{file['name']}' is up-to-date.")
-                    continue
-            print(f"Pulling file '{file['name']}' into {container}...")
-            request = service.files().get_media(fileId=file['id'])
-            fh = FileIO(file_path,'wb')
-            try:
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while done is False:
-                    status, done = downloader.next_chunk()
-                    print("Download %d%%." % int(status.progress() * 100))
-            except HttpError:
-                print("Failed")
+def transfer(pool, label, function, *args, on_done = None, **kwargs):
+    """Runs function(http, *args, **kwargs) through the given transfer pool,
+    or immediately with the service's own transport if no pool is supplied.
+    on_done is called with the result once the transfer has finished.
+    """
+    if pool is None:
+        result = function(None, *args, **kwargs)
+        if on_done:
+            on_done(result)
+    else:
+        pool.submit(label, lambda http, *a: function(http, *a, **kwargs), *args,
+            on_done = on_done)
+
+def schedule_upload(service, pool, file_path, manifest, relpath, body = None, file_id = None,
+    checksum = None, on_recorded = None):
+    """Schedules the upload of a local file on the transfer pool, either as a
+    new file described by body or over the existing Drive file file_id.
+    The result is recorded in the manifest and the upload's throughput is
+    printed once it finishes. on_recorded, if given, is called after that.
+    """
+    chunk_size = pool.chunk_size if pool is not None else CHUNK_SIZE
+
+    def on_done(result):
+        if manifest is not None:
+            manifest.set_file(relpath, result['id'], result.get('md5Checksum', checksum))
+        if on_recorded:
+            on_recorded()
+        sent, seconds = result['transferred'], result['seconds']
+        print(f"Uploaded {relpath or file_path}: {format_size(sent)} in {seconds:.1f}s " +
+            f"({format_size(sent / max(seconds, 0.001))}/s)")
+
+    transfer(pool, relpath or file_path, upload_file, service, file_path, body = body,
+        file_id = file_id, chunk_size = chunk_size, manifest = manifest, relpath = relpath,
+        on_done = on_done)
+
+def upload_file(http, service, file_path, body = None, file_id = None, chunk_size = CHUNK_SIZE,
+    manifest = None, relpath = None):
+    """Uploads the local file at file_path, either as a new file described by
+    body or over the existing Drive file with the given file_id.
+    Files larger than chunk_size are sent with a resumable upload in chunks of
+    chunk_size bytes. If a manifest is supplied, the session URI and committed
+    offset are recorded after every chunk, and an upload interrupted by an
+    earlier run continues from there as long as the file hasn't changed.
+    Returns the ID and md5 checksum of the uploaded file, along with the
+    number of bytes sent and the time taken.
+    """
+    # Imported here as it pulls in httplib2, which is slow to import and only
+    # needed once something is transferred
+    from googleapiclient.http import MediaFileUpload
+    start = time.time()
+    stat = os.stat(file_path)
+    if stat.st_size <= chunk_size:
+        media = MediaFileUpload(file_path)
+        result = SCHEDULER.execute(upload_request(service, media, body, file_id), http)
+        result.update(transferred = stat.st_size, seconds = time.time() - start)
+        STATS.record('upload file', result['seconds'], bytes = stat.st_size, start = start)
+        return result
+
+    media = MediaFileUpload(file_path, chunksize = chunk_size, resumable = True)
+    request = upload_request(service, media, body, file_id)
+    resumed = 0
+    session = manifest.get_upload(relpath) if manifest is not None else None
+    if session and session['file_id'] == file_id and session['size'] == stat.st_size and\
+        session['mtime_ns'] == stat.st_mtime_ns:
+        request.resumable_uri = session['session_uri']
+        request.resumable_progress = resumed = session['offset']
+        print(f"Resuming upload of {relpath} from {format_size(resumed)}...")
+
+    result = None
+    while result is None:
+        try:
+            status, result = SCHEDULER.call(request.next_chunk, http = http,
+                operation = 'upload chunk')
+        except Exception as e:
+            if resumed and error_status(e) in (404, 410):
+                # Upload session has expired, start again from the beginning
+                manifest.clear_upload(relpath)
+                return upload_file(http, service, file_path, body, file_id, chunk_size,
+                    manifest, relpath)
+            raise
+        if status is not None and manifest is not None:
+            manifest.set_upload(relpath, file_id, request.resumable_uri,
+                status.resumable_progress, stat)
+
+    if manifest is not None:
+        manifest.clear_upload(relpath)
+    result.update(transferred = stat.st_size - resumed, seconds = time.time() - start)
+    STATS.record('upload file', result['seconds'], bytes = result['transferred'], start = start)
+    return result
+
+def upload_request(service, media, body = None, file_id = None):
+    """Returns the request uploading media as a new file described by body, or
+    over the existing Drive file with the given file_id.
+    """
+    if file_id:
+        return service.files().update(fileId = file_id, media_body = media,
+            fields = 'id, md5Checksum')
+    return service.files().create(body = body, media_body = media,
+        fields = 'id, md5Checksum')
+
+def format_size(size):
+    """Returns the given number of bytes as a human readable string
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def schedule_download(service, pool, file, file_path, manifest = None, relpath = None,
+    on_recorded = None):
+    """Schedules the download of the given Drive file to file_path on the
+    transfer pool. If a manifest is supplied, the local copy is recorded in it
+    under the given relative path once the download finishes. on_recorded,
+    if given, is called after that.
+    """
+    def on_done(stat):
+        if manifest is not None:
+            manifest.set_local(relpath, stat, file['md5Checksum'])
+        if on_recorded:
+            on_recorded()
+
+    progress = pool is None or not pool.is_parallel()
+    chunk_size = pool.download_chunk_size if pool is not None else DOWNLOAD_CHUNK_SIZE
+    transfer(pool, relpath or file_path, fetch_file, service, file['id'], file_path,
+        progress = progress, chunk_size = chunk_size, checksum = file['md5Checksum'],
+        size = file.get('size'), manifest = manifest, relpath = relpath, on_done = on_done)
+
+def fetch_file(http, service, file_id, file_path, progress = False, chunk_size = DOWNLOAD_CHUNK_SIZE,
+    checksum = None, size = None, manifest = None, relpath = None):
+    """Downloads the Drive file with the given ID to file_path, returning the
+    stat result of the downloaded file. If progress is True then the download
+    progress is printed.
+    The file is downloaded in ranged requests of chunk_size bytes into a
+    temporary file next to file_path, which is synced to disk and renamed
+    over file_path once it's complete and matches the given md5 checksum, so
+    file_path is never left truncated. If the download is interrupted, the
+    temporary file is kept and the next download of the same file continues
+    from the end of it. If a manifest is supplied, downloads larger than a
+    chunk are recorded in it under relpath until they finish, so a partial
+    download is only continued if the file is unchanged, and is removed by
+    discard_partial_downloads otherwise.
+    """
+    start = time.time()
+    temp_path = partial_path(file_path, file_id)
+    resumed = os.path.getsize(temp_path) if os.path.isfile(temp_path) else 0
+    if resumed:
+        partial = manifest.get_download(relpath) if manifest is not None else None
+        if (size is not None and resumed > int(size)) or (manifest is not None and
+            (partial is None or partial['file_id'] != file_id or partial['md5'] != checksum)):
+            # Partial download of another version of the file
+            os.remove(temp_path)
+            resumed = 0
+    hash_md5 = md5()
+    if resumed:
+        with open(temp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_SIZE), b""):
+                hash_md5.update(chunk)
+
+    if size is None or resumed < int(size):
+        track = manifest is not None and (size is None or int(size) > chunk_size)
+        if track:
+            manifest.set_download(relpath, file_id, checksum)
+        request = service.files().get_media(fileId=file_id)
+        if http is None:
+            http = request.http
+        try:
+            with FileIO(temp_path, 'ab') as fh:
+                offset, total = resumed, None
+                while total is None or offset < total:
+                    content, first, total = SCHEDULER.call(download_range, http, request,
+                        offset, chunk_size, operation = 'download chunk')
+                    if first != offset:
+                        # Drive sent the whole file rather than the range
+                        fh.truncate(0)
+                        hash_md5 = md5()
+                        offset = resumed = 0
+                    if not content:
+                        break
+                    hash_md5.update(content)
+                    fh.write(content)
+                    offset += len(content)
+                    if progress:
+                        print("Download %d%%." % int(offset * 100 / max(total, 1)))
+                fh.flush()
+                os.fsync(fh.fileno())
+        except Exception as e:
+            if resumed and error_status(e) == 416:
+                # Partial download doesn't fit the file any more, start again
+                os.remove(temp_path)
+                return fetch_file(http, service, file_id, file_path, progress, chunk_size,
+                    checksum, size, manifest, relpath)
+            if not track and os.path.isfile(temp_path):
+                # Only downloads recorded in the manifest are continued
+                os.remove(temp_path)
+            raise
+    elif not os.path.isfile(temp_path):
+        # Empty files have nothing to download
+        open(temp_path, 'wb').close()
+
+    if checksum and hash_md5.hexdigest() != checksum:
+        os.remove(temp_path)
+        if resumed:
+            # The file changed on Drive since the partial download was made
+            return fetch_file(http, service, file_id, file_path, progress, chunk_size,
+                checksum, size, manifest, relpath)
+        if manifest is not None:
+            manifest.clear_download(relpath)
+        raise IOError(f"checksum mismatch downloading {os.path.basename(file_path)}")
+
+    os.replace(temp_path, file_path)
+    if manifest is not None:
+        manifest.clear_download(relpath)
+    stat = os.stat(file_path)
+    STATS.record('download file', time.time() - start, bytes = stat.st_size - resumed,
+        start = start)
+    return stat
+
+def schedule_export(service, pool, file, file_path, extension, manifest = None, relpath = None,
+    on_recorded = None):
+    """Schedules the export of the given Google Docs file to file_path, in
+    the format with the given extension, on the transfer pool. If a manifest
+    is supplied, the local copy and the version of the document it was
+    exported from are recorded in it once the export finishes. on_recorded,
+    if given, is called after that.
+    """
+    def on_done(result):
+        stat, checksum = result
+        if manifest is not None:
+            manifest.set_local(relpath, stat, checksum)
+            manifest.set_file(relpath, file['id'])
+            manifest.set_export(relpath, file['id'], file.get('version'), extension)
+        if on_recorded:
+            on_recorded()
+
+    transfer(pool, relpath or file_path, export_file, service, file['id'], file_path,
+        EXPORT_MIME_TYPES[extension], on_done = on_done)
+
+def export_file(http, service, file_id, file_path, mime_type):
+    """Exports the Google Docs file with the given ID to file_path as
+    mime_type, returning the stat result and md5 checksum of the exported
+    file. Like fetch_file, the export is written to a temporary file which
+    replaces file_path once it's complete.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    start = time.time()
+    temp_path = os.path.join(os.path.dirname(file_path), f".gitd-{file_id}.export")
+    hash_md5 = md5()
+    request = service.files().export_media(fileId = file_id, mimeType = mime_type)
+    if http is not None:
+        request.http = http
+    with FileIO(temp_path, 'wb') as fh:
+        try:
+            downloader = MediaIoBaseDownload(HashingWriter(fh, hash_md5), request)
+            done = False
+            while done is False:
+                _, done = SCHEDULER.call(downloader.next_chunk, operation = 'export chunk')
+            fh.flush()
+            os.fsync(fh.fileno())
+        except BaseException:
             fh.close()
+            os.remove(temp_path)
+            raise
+
+    os.replace(temp_path, file_path)
+    stat = os.stat(file_path)
+    STATS.record('export file', time.time() - start, bytes = stat.st_size, start = start)
+    return stat, hash_md5.hexdigest()
+
+class HashingWriter:
+    """File wrapper updating an md5 hash with everything written to it
+    """
+    def __init__(self, fh, hash_md5):
+        self.fh = fh
+        self.hash_md5 = hash_md5
+
+    def write(self, data):
+        self.hash_md5.update(data)
+        return self.fh.write(data)
+
+def partial_path(file_path, file_id):
+    """Returns the path of the partial download of the Drive file file_id
+    into file_path
+    """
+    return os.path.join(os.path.dirname(file_path), f".gitd-{file_id}.part")
+
+def download_range(http, request, offset, chunk_size):
+    """Requests up to chunk_size bytes of the media request's file starting
+    at offset, with the HTTP transport http. Returns the bytes received, the
+    offset they start at and the total size of the file.
+    """
+    headers = { x: y for x, y in request.headers.items()
+        if x.lower() not in ('accept', 'accept-encoding', 'user-agent') }
+    headers['range'] = f"bytes={offset}-{offset + chunk_size - 1}"
+    resp, content = http.request(request.uri, 'GET', headers = headers)
+    if resp.status == 416 and not offset:
+        # Empty files have no range to send
+        return b'', 0, 0
+    if resp.status == 200:
+        # The whole file was sent
+        return content, 0, len(content)
+    if resp.status != 206:
+        from googleapiclient.errors import HttpError
+        raise HttpError(resp, content, uri = request.uri)
+    if 'content-range' in resp:
+        return content, offset, int(resp['content-range'].rsplit('/', 1)[1])
+    return content, offset, offset + len(content)
 
 def safe_create_folder(directory):
     """Checks to see if the directory already exists, if not then create it.
@@ -264,24 +759,39 @@ def prompt(message):
     """Ask user for a 'y' or 'n' response to a message.
     Return True if the user enters 'y' and False if user enters 'n'.
     """
-    ans = None
-    while(ans == None):
-        ans = input(message)
-        if(ans == 'y'):
-            ans = True
-        elif(ans == 'n'):
-            return
-        else:
-            print('Invalid input')
-            ans = None
-    
-    return ans
+    # Repositories synced in parallel take turns asking
+    with PROMPT_LOCK:
+        ans = None
+        while(ans == None):
+            ans = input(message)
+            if(ans == 'y'):
+                ans = True
+            elif(ans == 'n'):
+                return
+            else:
+                print('Invalid input')
+                ans = None
+
+        return ans
 
 def get_md5_checksum(path):
     """Returns the md5 checksum of the given file
+    Large files are mapped into memory and hashed in one pass, smaller files
+    are read into a reused buffer of READ_SIZE bytes. hashlib releases the
+    GIL while hashing, so files can be hashed on several threads at once.
     """
     hash_md5 = md5()
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_SIZE:
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+                hash_md5.update(data)
+        else:
+            buffer = bytearray(READ_SIZE)
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hash_md5.update(view[:read])
     return hash_md5.hexdigest()
\ No newline at end of file
@@ -0,0 +1,201 @@
+import os
+import re
+
+IGNORE_FILE = ".gitdignore"
+
+def translate(pattern):
+    """Returns the regular expression matching the given gitignore-style glob.
+    '*' and '?' don't match '/', '**' matches across folders and '[...]'
+    matches a character class.
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            # Any number of leading folders, including none
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                regex += re.escape(c)
+            else:
+                chars = pattern[i + 1:end]
+                if chars[0] == '!':
+                    chars = '^' + chars[1:]
+                regex += '[' + chars.replace('\\', '\\\\') + ']'
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+class IgnoreRules:
+    """Compiled set of gitignore-style patterns, as read from a .gitdignore
+    file at the root of a repository.
+
+    Patterns follow gitignore's rules: a leading '!' re-includes paths
+    excluded by an earlier pattern, a trailing '/' only matches folders, and a
+    pattern containing a '/' anywhere but at the end is anchored to the root
+    of the repository rather than matched against names at any depth. The
+    last matching pattern wins.
+
+    Consecutive patterns of the same kind are compiled into a single regular
+    expression, so a path is checked with a handful of regex matches however
+    many patterns there are. As excluded folders are pruned rather than
+    walked, a file inside an excluded folder can't be re-included.
+    """
+    def __init__(self, lines = ()):
+        self.groups = []
+        rules = []
+        for line in lines:
+            rule = self.parse(line)
+            if rule is not None:
+                rules.append(rule)
+
+        # Merge runs of patterns with the same flags into one regex
+        for regex, negate, dir_only in rules:
+            if self.groups and self.groups[-1][1:] == [negate, dir_only]:
+                self.groups[-1][0].append(regex)
+            else:
+                self.groups.append([[regex], negate, dir_only])
+        self.groups = [ (re.compile('|'.join(f"(?:{x})" for x in regexes)), negate, dir_only)
+            for regexes, negate, dir_only in reversed(self.groups) ]
+
+    @staticmethod
+    def parse(line):
+        """Returns the (regex, negate, dir_only) rule for a line of an ignore
+        file, or None for blank lines and comments.
+        """
+        line = line.rstrip('\n').rstrip('\r')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            return None
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+        if '/' in line:
+            # Anchored to the root of the repository
+            regex = '^' + translate(line.lstrip('/')) + '$'
+        else:
+            regex = '^(?:.*/)?' + translate(line) + '$'
+        return regex, negate, dir_only
+
+    def __bool__(self):
+        return bool(self.groups)
+
+    def match(self, relpath, is_dir = False):
+        """Returns True if the given relative path is ignored
+        """
+        for regex, negate, dir_only in self.groups:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                return not negate
+        return False
+
+    def match_path(self, relpath, is_dir = False):
+        """Returns True if the given relative path, or any folder it's in, is
+        ignored. Used for paths that weren't reached by walking the tree.
+        """
+        parts = relpath.split('/')
+        for i in range(1, len(parts)):
+            if self.match('/'.join(parts[:i]), True):
+                return True
+        return self.match(relpath, is_dir)
+
+class SparseRules:
+    """Include and exclude specs of a sparse clone, combined with the rules
+    of the repository's .gitdignore file.
+
+    include is a list of relative paths of the files and folders the clone
+    covers, or None for the whole repository. The folders leading to an
+    included path are walked but the other files in them are left out.
+    exclude is a list of gitignore-style patterns left out even inside
+    included folders. Paths left out are matched, exactly like ignored
+    paths: they're neither pulled, pushed nor deleted on either side.
+    """
+    def __init__(self, include = None, exclude = (), ignore = None):
+        self.include = None
+        self.parents = set()
+        if include is not None:
+            self.include = set(x.strip('/') for x in include)
+            for path in self.include:
+                index = path.rfind('/')
+                while index > 0:
+                    self.parents.add(path[:index])
+                    index = path.rfind('/', 0, index)
+                if path:
+                    self.parents.add('')
+        self.exclude = IgnoreRules(exclude)
+        self.ignore = ignore
+
+    def __bool__(self):
+        return True
+
+    def covers(self, relpath):
+        """Returns True if the given relative path is inside an included path
+        """
+        if self.include is None or '' in self.include:
+            return True
+        index = len(relpath)
+        while index > 0:
+            if relpath[:index] in self.include:
+                return True
+            index = relpath.rfind('/', 0, index)
+        return False
+
+    def is_included(self, relpath, is_dir = False):
+        return self.covers(relpath) or (is_dir and relpath in self.parents)
+
+    def match(self, relpath, is_dir = False):
+        """Returns True if the given relative path is left out of the clone
+        """
+        if not self.is_included(relpath, is_dir) or self.exclude.match(relpath, is_dir):
+            return True
+        return self.ignore is not None and self.ignore.match(relpath, is_dir)
+
+    def match_path(self, relpath, is_dir = False):
+        """Returns True if the given relative path, or any folder it's in, is
+        left out of the clone
+        """
+        if not self.is_included(relpath, is_dir) or self.exclude.match_path(relpath, is_dir):
+            return True
+        return self.ignore is not None and self.ignore.match_path(relpath, is_dir)
+
+def load_ignore(container, sparse = None):
+    """Returns the IgnoreRules of the .gitdignore file at the root of the
+    repository in the container folder, or None if there isn't one.
+    If the sparse dict of 'include' and 'exclude' specs is given, they're
+    returned as SparseRules combined with the .gitdignore rules.
+    """
+    try:
+        with open(os.path.join(container, IGNORE_FILE), encoding = 'utf-8') as ignore_file:
+            rules = IgnoreRules(ignore_file)
+    except FileNotFoundError:
+        rules = None
+    if not rules:
+        rules = None
+    if sparse:
+        return SparseRules(sparse.get('include'), sparse.get('exclude', ()), rules)
+    return rules
@@ -0,0 +1,85 @@
+import json
+from .sync import SyncPlan
+
+# Kinds of operations recorded in the journal, with the SyncPlan list they
+# come from and the key of the path they're recorded under
+OPERATIONS = (
+    ('folder', 'folders', 'path'),
+    ('move', 'moves', 'to'),
+    ('copy', 'copies', 'path'),
+    ('delete', 'deletes', 'path'),
+    ('upload', 'uploads', 'path'),
+    ('download', 'downloads', 'path'),
+    ('pack', 'packs', 'path')
+)
+
+class Journal:
+    """Write-ahead journal of the sync in progress in a repository, kept in
+    its manifest.
+
+    The whole plan is saved before anything is changed, and each operation
+    is recorded as done, along with its manifest updates, as soon as it
+    finishes. If the sync is interrupted, the next push or pull in the same
+    direction loads the plan back without the finished operations and runs
+    the rest, without scanning the repository or listing Drive again.
+    A sync in the other direction can't start until it has been resumed.
+    """
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    def pending(self):
+        """Returns the direction of the interrupted sync in the journal, or
+        None if there is none
+        """
+        row = self.manifest.fetchone("SELECT direction FROM journal")
+        return row[0] if row is not None else None
+
+    def begin(self, plan, **state):
+        """Save a plan about to be run, along with state to restore when
+        it's resumed, replacing any earlier journal in the same direction.
+        Raises ValueError if a sync in the other direction was interrupted.
+        """
+        pending = self.pending()
+        if pending is not None and pending != plan.direction:
+            raise ValueError(f"an interrupted {pending} hasn't finished")
+        self.manifest.execute("DELETE FROM journal")
+        self.manifest.execute("DELETE FROM journal_done")
+        self.manifest.execute("INSERT INTO journal (direction, plan, state) VALUES (?, ?, ?)",
+            (plan.direction, json.dumps(plan.to_dict()), json.dumps(state)))
+        self.manifest.commit()
+
+    def load(self, direction):
+        """Returns the plan of an interrupted sync in the given direction,
+        without the operations that were done, and the state saved with it.
+        Returns None, None if there is none.
+        """
+        row = self.manifest.fetchone("SELECT direction, plan, state FROM journal")
+        if row is None or row[0] != direction:
+            return None, None
+        plan = SyncPlan.from_dict(json.loads(row[1]))
+        done = { (kind, path): result for kind, path, result in
+            self.manifest.fetchall("SELECT kind, path, result FROM journal_done") }
+        for kind, name, key in OPERATIONS:
+            operations = getattr(plan, name)
+            if kind == 'folder':
+                # Folders created on Drive are needed by the uploads into them
+                for folder in operations:
+                    if done.get((kind, folder['path'])):
+                        plan.folder_ids[folder['path']] = done[(kind, folder['path'])]
+            setattr(plan, name, [ x for x in operations if (kind, x[key]) not in done ])
+        return plan, json.loads(row[2])
+
+    def done(self, kind, path, result = None):
+        """Record an operation of the plan as done, committing it along with
+        the manifest changes it made
+        """
+        self.manifest.execute("INSERT OR REPLACE INTO journal_done (kind, path, result) " +
+            "VALUES (?, ?, ?)", (kind, path, result))
+        self.manifest.commit()
+
+    def finish(self):
+        """Forget the journal once its sync has finished
+        """
+        self.manifest.execute("DELETE FROM journal")
+        self.manifest.execute("DELETE FROM journal_done")
+        self.manifest.commit()
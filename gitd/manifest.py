@@ -0,0 +1,431 @@
+import os
+import sqlite3
+import threading
+from .functions import get_md5_checksum
+
+MANIFEST_FILE = ".gitd-manifest"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    md5 TEXT,
+    file_id TEXT,
+    remote_md5 TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_id ON files (file_id);
+CREATE TABLE IF NOT EXISTS folders (
+    folder_id TEXT PRIMARY KEY,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS folders_by_path ON folders (path);
+CREATE TABLE IF NOT EXISTS exports (
+    path TEXT PRIMARY KEY,
+    file_id TEXT,
+    version INTEGER,
+    format TEXT
+);
+CREATE TABLE IF NOT EXISTS remote_tree (
+    path TEXT PRIMARY KEY,
+    file_id TEXT,
+    name TEXT,
+    mime_type TEXT,
+    size INTEGER,
+    md5 TEXT
+);
+CREATE TABLE IF NOT EXISTS pack_indexes (
+    path TEXT PRIMARY KEY,
+    file_id TEXT,
+    md5 TEXT,
+    data BLOB,
+    synced TEXT
+);
+CREATE TABLE IF NOT EXISTS journal (
+    direction TEXT,
+    plan TEXT,
+    state TEXT
+);
+CREATE TABLE IF NOT EXISTS journal_done (
+    kind TEXT,
+    path TEXT,
+    result TEXT,
+    PRIMARY KEY (kind, path)
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    path TEXT PRIMARY KEY,
+    file_id TEXT,
+    session_uri TEXT,
+    offset INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    path TEXT PRIMARY KEY,
+    file_id TEXT,
+    md5 TEXT
+);
+"""
+
+# Tables keyed by a relative path, which follow their entries when a path is
+# moved or forgotten
+PATH_TABLES = ('files', 'folders', 'uploads', 'downloads', 'exports', 'pack_indexes')
+
+def tree_range(relpath):
+    """Returns the SQL condition and parameters matching the given relative
+    path and everything beneath it.
+    '0' is the character after '/', so the range covers exactly the paths
+    starting with relpath + '/'.
+    """
+    return "(path = ? OR (path >= ? AND path < ?))", (relpath, relpath + '/', relpath + '0')
+
+class Manifest:
+    """Persistent manifest of the files inside a repository.
+    For each file the manifest records its path relative to the repository,
+    the stat signature (size, mtime_ns and inode) and md5 checksum of the
+    local copy, and the Drive ID and md5 checksum of the remote copy.
+    The Drive IDs of the repository's folders are also recorded so changes
+    reported by Drive can be mapped back to local paths.
+
+    The manifest is stored as an SQLite database next to the config file, so
+    entries are updated in place rather than rewriting the whole manifest.
+    The in-flight upload sessions and partial downloads of the repository
+    are stored alongside it, as are the versions of the Google Docs files
+    exported into it, the index of the whole remote tree kept by
+    metadata-only clones, the indexes of packed folders and the journal of
+    the sync in progress.
+
+    The database is kept in write-ahead logging mode, so every commit is
+    atomic and cheap enough to be made after each finished transfer, and a
+    sync that's killed loses nothing it had recorded.
+
+    Transfer workers record upload progress from their own threads, so every
+    query goes through a lock.
+    """
+    def __init__(self, container):
+        self.container = container
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(container, MANIFEST_FILE),
+            check_same_thread = False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def execute(self, sql, params = ()):
+        """Run an SQL statement on the manifest
+        """
+        with self.lock:
+            self.db.execute(sql, params)
+
+    def fetchone(self, sql, params = ()):
+        """Run an SQL query on the manifest and return the first row, or None
+        """
+        with self.lock:
+            return self.db.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params = ()):
+        """Run an SQL query on the manifest and return every row
+        """
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def commit(self):
+        """Write pending changes to disk
+        """
+        with self.lock:
+            self.db.commit()
+
+    def is_empty(self):
+        """Returns True if the manifest has no record of the remote tree
+        """
+        return self.fetchone("SELECT 1 FROM folders LIMIT 1") is None
+
+    def reset_remote(self, path_id):
+        """Forget every remote ID ahead of a full walk of the Drive folder.
+        Local checksums are kept so the walk doesn't need to rehash files.
+        """
+        self.execute("DELETE FROM folders")
+        self.execute("UPDATE files SET file_id = NULL, remote_md5 = NULL")
+        self.set_folder(path_id, '')
+
+    # Local files
+
+    def checksum(self, relpath, stat = None):
+        """Returns the md5 checksum of the local file at the given relative
+        path. The file is only read if its stat signature has changed since
+        the checksum was last recorded.
+        """
+        path = os.path.join(self.container, relpath)
+        if stat is None:
+            stat = os.stat(path)
+        row = self.fetchone("SELECT size, mtime_ns, inode, md5 FROM files WHERE path = ?",
+            (relpath,))
+        if row and row[3] and row[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return row[3]
+        checksum = get_md5_checksum(path)
+        self.set_local(relpath, stat, checksum)
+        return checksum
+
+    def set_local(self, relpath, stat, checksum):
+        """Record the stat signature and checksum of a local file
+        """
+        self.execute("INSERT INTO files (path, size, mtime_ns, inode, md5) VALUES (?, ?, ?, ?, ?) " +
+            "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, " +
+            "inode = excluded.inode, md5 = excluded.md5",
+            (relpath, stat.st_size, stat.st_mtime_ns, stat.st_ino, checksum))
+
+    def is_unchanged(self, relpath, stat, checksum):
+        """Returns True if the local file at the given relative path was
+        recorded with the given checksum and its stat signature hasn't changed
+        since, e.g. because it was downloaded and not modified
+        """
+        row = self.fetchone("SELECT size, mtime_ns, inode, md5 FROM files WHERE path = ?",
+            (relpath,))
+        return row is not None and checksum is not None and\
+            row == (stat.st_size, stat.st_mtime_ns, stat.st_ino, checksum)
+
+    def local_signatures(self):
+        """Returns a dict of the stat signature (size, mtime_ns, inode) of
+        every local file with a recorded checksum, by relative path
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT path, size, mtime_ns, inode FROM files " +
+                "WHERE md5 IS NOT NULL").fetchall()
+        return { row[0]: row[1:] for row in rows }
+
+    def get(self, relpath):
+        """Returns the manifest entry for the given relative path as a dict,
+        or None if the path isn't in the manifest.
+        """
+        row = self.fetchone("SELECT path, size, mtime_ns, inode, md5, file_id, remote_md5 " +
+            "FROM files WHERE path = ?", (relpath,))
+        if row is None:
+            return None
+        keys = ('path', 'size', 'mtime_ns', 'inode', 'md5', 'file_id', 'remote_md5')
+        return dict(zip(keys, row))
+
+    # Remote files
+
+    def set_file(self, relpath, file_id, remote_md5 = None):
+        """Record the Drive ID and checksum of the remote copy of a file
+        """
+        self.execute("UPDATE files SET file_id = NULL, remote_md5 = NULL " +
+            "WHERE file_id = ? AND path != ?", (file_id, relpath))
+        self.execute("INSERT INTO files (path, file_id, remote_md5) VALUES (?, ?, ?) " +
+            "ON CONFLICT(path) DO UPDATE SET file_id = excluded.file_id, remote_md5 = excluded.remote_md5",
+            (relpath, file_id, remote_md5))
+
+    def file_path(self, file_id):
+        """Returns the relative path of the file with the given Drive ID, or
+        None if it isn't part of the repository.
+        """
+        row = self.fetchone("SELECT path FROM files WHERE file_id = ?", (file_id,))
+        return row[0] if row else None
+
+    def set_folder(self, folder_id, relpath):
+        """Record the Drive ID of a folder in the repository
+        """
+        self.execute("INSERT OR REPLACE INTO folders (folder_id, path) VALUES (?, ?)",
+            (folder_id, relpath))
+
+    def folder_path(self, folder_id):
+        """Returns the relative path of the folder with the given Drive ID, or
+        None if it isn't part of the repository.
+        """
+        row = self.fetchone("SELECT path FROM folders WHERE folder_id = ?", (folder_id,))
+        return row[0] if row else None
+
+    def folder_id(self, relpath):
+        """Returns the Drive ID of the folder at the given relative path, or
+        None if it isn't in the manifest.
+        """
+        row = self.fetchone("SELECT folder_id FROM folders WHERE path = ?", (relpath,))
+        return row[0] if row else None
+
+    def has_id(self, drive_id):
+        """Returns True if the given Drive ID is a file or folder in the repository
+        """
+        return self.file_path(drive_id) is not None or self.folder_path(drive_id) is not None
+
+    # Exported Google Docs files
+
+    def get_export(self, relpath):
+        """Returns the Drive ID, version and format of the Google Docs file
+        the local file at the given relative path was exported from as a
+        dict, or None if it isn't an export.
+        """
+        row = self.fetchone("SELECT file_id, version, format FROM exports WHERE path = ?",
+            (relpath,))
+        if row is None:
+            return None
+        return dict(zip(('file_id', 'version', 'format'), row))
+
+    def set_export(self, relpath, file_id, version, extension):
+        """Record the version of the Google Docs file the local file at the
+        given relative path was exported from, and the format it was exported in
+        """
+        self.execute("INSERT OR REPLACE INTO exports (path, file_id, version, format) " +
+            "VALUES (?, ?, ?, ?)", (relpath, file_id, int(version) if version else None, extension))
+
+    # Tree operations
+
+    def move(self, old_path, new_path):
+        """Move the entry at old_path, and everything beneath it, to new_path
+        """
+        condition, params = tree_range(old_path)
+        self.forget(new_path)
+        for table in PATH_TABLES:
+            self.execute(f"UPDATE {table} SET path = ? || substr(path, ?) WHERE {condition}",
+                (new_path, len(old_path) + 1) + params)
+
+    def forget(self, relpath):
+        """Remove the entry at the given relative path, and everything beneath
+        it, from the manifest.
+        """
+        condition, params = tree_range(relpath)
+        for table in PATH_TABLES:
+            self.execute(f"DELETE FROM {table} WHERE {condition}", params)
+
+    # Indexes of packed folders
+
+    def get_pack_index(self, relpath):
+        """Returns the last index of the packed folder at the given relative
+        path seen on Drive as a dict of its Drive ID, md5 checksum and
+        compressed data, along with the checksum of the index last synced, or
+        None if the folder has never been packed.
+        """
+        row = self.fetchone("SELECT file_id, md5, data, synced FROM pack_indexes WHERE path = ?",
+            (relpath,))
+        if row is None:
+            return None
+        return dict(zip(('file_id', 'md5', 'data', 'synced'), row))
+
+    def set_pack_index(self, relpath, file_id, checksum, data, synced = False):
+        """Record the index of a packed folder seen on Drive, and mark it as
+        synced if synced is set
+        """
+        self.execute("INSERT INTO pack_indexes (path, file_id, md5, data) VALUES (?, ?, ?, ?) " +
+            "ON CONFLICT(path) DO UPDATE SET file_id = excluded.file_id, md5 = excluded.md5, " +
+            "data = excluded.data", (relpath, file_id, checksum, data))
+        if synced:
+            self.set_pack_synced(relpath, checksum)
+
+    def set_pack_synced(self, relpath, checksum):
+        """Record the md5 checksum of the index a packed folder was last
+        synced with
+        """
+        self.execute("UPDATE pack_indexes SET synced = ? WHERE path = ?", (checksum, relpath))
+
+    def pack_folders(self):
+        """Returns the relative paths of the folders that have been synced as
+        packed folders
+        """
+        return [ row[0] for row in
+            self.fetchall("SELECT path FROM pack_indexes WHERE synced IS NOT NULL") ]
+
+    def forget_pack_index(self, relpath):
+        """Forget the index of a folder that's no longer packed
+        """
+        self.execute("DELETE FROM pack_indexes WHERE path = ?", (relpath,))
+
+    # Index of the remote tree
+
+    def set_remote_tree(self, entries):
+        """Replace the index of the remote tree with the given (relative
+        path, Drive file) pairs
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM remote_tree")
+            self.db.executemany("INSERT OR REPLACE INTO remote_tree " +
+                "(path, file_id, name, mime_type, size, md5) VALUES (?, ?, ?, ?, ?, ?)",
+                ((relpath, x['id'], x['name'], x['mimeType'], int(x.get('size') or 0),
+                    x.get('md5Checksum')) for relpath, x in entries))
+
+    def get_remote(self, relpath):
+        """Returns the Drive file or folder at the given relative path in the
+        index of the remote tree, as a dict of the fields Drive returns, or
+        None if it isn't in the index
+        """
+        row = self.fetchone("SELECT file_id, name, mime_type, size, md5 FROM remote_tree " +
+            "WHERE path = ?", (relpath,))
+        if row is None:
+            return None
+        file = dict(zip(('id', 'name', 'mimeType'), row[:3]))
+        if row[4]:
+            file.update(size = str(row[3]), md5Checksum = row[4])
+        return file
+
+    def remote_size(self, relpath):
+        """Returns the number of files beneath the given relative path in
+        the index of the remote tree and their total size
+        """
+        condition, params = tree_range(relpath) if relpath else ("1", ())
+        row = self.fetchone("SELECT COUNT(md5), SUM(size) FROM remote_tree WHERE " + condition,
+            params)
+        return row[0], row[1] or 0
+
+    # Upload sessions
+
+    def get_upload(self, relpath):
+        """Returns the in-flight resumable upload of the given relative path as
+        a dict, or None if there isn't one.
+        """
+        row = self.fetchone("SELECT file_id, session_uri, offset, size, mtime_ns FROM uploads " +
+            "WHERE path = ?", (relpath,))
+        if row is None:
+            return None
+        return dict(zip(('file_id', 'session_uri', 'offset', 'size', 'mtime_ns'), row))
+
+    def set_upload(self, relpath, file_id, session_uri, offset, stat):
+        """Record the session URI and committed byte offset of a resumable
+        upload, along with the stat signature of the file being uploaded.
+        The change is committed immediately so it survives an interruption.
+        """
+        with self.lock:
+            self.execute("INSERT OR REPLACE INTO uploads " +
+                "(path, file_id, session_uri, offset, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)",
+                (relpath, file_id, session_uri, offset, stat.st_size, stat.st_mtime_ns))
+            self.db.commit()
+
+    def clear_upload(self, relpath):
+        """Forget the resumable upload of the given relative path
+        """
+        with self.lock:
+            self.execute("DELETE FROM uploads WHERE path = ?", (relpath,))
+            self.db.commit()
+
+    # Partial downloads
+
+    def get_download(self, relpath):
+        """Returns the partial download of the given relative path as a dict
+        of the Drive ID and md5 checksum of the file being downloaded, or None
+        if there isn't one.
+        """
+        row = self.fetchone("SELECT file_id, md5 FROM downloads WHERE path = ?", (relpath,))
+        if row is None:
+            return None
+        return { 'path': relpath, 'file_id': row[0], 'md5': row[1] }
+
+    def get_downloads(self):
+        """Returns every partial download, as returned by get_download
+        """
+        return [ { 'path': x[0], 'file_id': x[1], 'md5': x[2] }
+            for x in self.fetchall("SELECT path, file_id, md5 FROM downloads") ]
+
+    def set_download(self, relpath, file_id, md5):
+        """Record the download of the Drive file file_id, with the given md5
+        checksum, to the given relative path. The change is committed
+        immediately so it survives an interruption.
+        """
+        with self.lock:
+            self.execute("INSERT OR REPLACE INTO downloads (path, file_id, md5) VALUES (?, ?, ?)",
+                (relpath, file_id, md5))
+            self.db.commit()
+
+    def clear_download(self, relpath):
+        """Forget the partial download of the given relative path
+        """
+        with self.lock:
+            self.execute("DELETE FROM downloads WHERE path = ?", (relpath,))
+            self.db.commit()
@@ -0,0 +1,630 @@
+import gzip
+import json
+import os
+from hashlib import md5
+from io import FileIO
+from .functions import *
+from .scanner import LocalFile, hash_files, scan_tree
+
+PACK_INDEX = ".gitd-packs" # Name of the index of a packed folder on Drive
+PACK_PREFIX = ".gitd-pack-" # Prefix of the names of packs on Drive
+PACK_THRESHOLD = 64 * 1024 # Files smaller than this are packed by default
+PACK_FILES = 256 # Average number of files in a pack
+PACK_SIZE = 16 * 1024 * 1024 # A pack is closed once it holds this many bytes
+
+# Packed folders
+#
+# The files of a packed folder smaller than its threshold aren't stored on
+# Drive one by one. They're concatenated into packs, and an index of the
+# folder, kept next to the packs, records which pack each file is in, at what
+# offset, and its size and md5 checksum:
+#
+#   { 'threshold': 65536,
+#     'packs': { key: { 'id': ..., 'md5': ..., 'size': ...,
+#                       'files': [[name, offset, size, md5], ...] } } }
+#
+# Names are relative to the packed folder, and the key of a pack is a
+# checksum of the names, sizes and checksums of its files, so a pack is only
+# built and uploaded again when one of its files changes. Larger files, and
+# the folders they're in, are synced as usual.
+
+def packed_folder(relpath, thresholds):
+    """Returns the packed folder the given relative path is inside, given the
+    dict of thresholds by packed folder, or None
+    """
+    for folder in thresholds:
+        if folder == '' or relpath.startswith(folder + '/'):
+            return folder
+    return None
+
+def is_packed(relpath, size, thresholds):
+    """Returns True if a file of the given size at relpath is stored in a
+    pack, given the dict of thresholds by packed folder
+    """
+    folder = packed_folder(relpath, thresholds)
+    return folder is not None and thresholds[folder] is not None and size < thresholds[folder]
+
+def split_packed(local, thresholds):
+    """Removes the files of the LocalTree local that are stored in packs,
+    given the dict of thresholds by packed folder, and returns them as lists
+    of entries by packed folder. Folders beneath a packed folder left with
+    nothing but packed files are removed too, as they aren't needed on Drive.
+    """
+    packed = {}
+    for folder, threshold in thresholds.items():
+        if threshold is None:
+            continue
+        entries = [ x for x in local.walk(folder) if not x.is_dir and x.st_size < threshold ]
+        packed[folder] = entries
+        local.remove(set(x.path for x in entries))
+
+        # Folders that held packed files, deepest first
+        emptied = set()
+        for entry in entries:
+            parent = entry.path.rpartition('/')[0]
+            while parent != folder and parent not in emptied:
+                emptied.add(parent)
+                parent = parent.rpartition('/')[0]
+        levels = {}
+        for path in emptied:
+            levels.setdefault(path.count('/'), []).append(path)
+        for depth in sorted(levels, reverse = True):
+            local.remove(set(x for x in levels[depth] if not local.children.get(x)))
+    return packed
+
+def pack_members(container, folder, entries, manifest):
+    """Returns the sorted (name, size, md5 checksum) tuples of the files of a
+    packed folder from their LocalTree entries, with names relative to the
+    folder. Files whose checksum isn't in the manifest are hashed in parallel.
+    """
+    hash_files(container, entries, manifest)
+    start = len(folder) + 1 if folder else 0
+    members = []
+    for entry in entries:
+        try:
+            checksum = manifest.checksum(entry.path, entry)
+        except FileNotFoundError:
+            continue
+        members.append((entry.path[start:], entry.st_size, checksum))
+    return sorted(members)
+
+def changed_members(container, packed, paths, manifest, ignore = None):
+    """Returns the members of a packed folder, as returned by pack_members,
+    once the given relative paths have changed. They're worked out from the
+    folder's index on Drive so only the changed paths are scanned, and files
+    changed on Drive by others are kept. Returns None if the folder has no
+    index or the folder itself changed, in which case the whole folder has
+    to be scanned.
+    """
+    folder = packed['path']
+    index = packed['index']
+    if index is None or index['threshold'] != packed['threshold']:
+        return None
+    changed = set(x for x in paths if x == folder or packed_folder(x, { folder: None }) is not None)
+    if folder in changed:
+        return None
+
+    members = {}
+    for pack in index['packs'].values():
+        for name, _, size, checksum in pack['files']:
+            relpath = join_path(folder, name)
+            if relpath not in changed and not is_inside(relpath, changed):
+                members[name] = (name, size, checksum)
+
+    container = to_path(container)
+    entries = []
+    for relpath in sorted(changed):
+        if any(is_repo_file(x) for x in relpath.split('/')):
+            continue
+        if os.path.isdir(container + relpath):
+            if ignore is None or not ignore.match_path(relpath, True):
+                entries += [ x for x in scan_tree(container, relpath, ignore).walk(relpath)
+                    if not x.is_dir ]
+        elif os.path.isfile(container + relpath):
+            if ignore is None or not ignore.match_path(relpath, False):
+                stat = os.stat(container + relpath)
+                entries.append(LocalFile(relpath, os.path.basename(relpath), False, stat.st_size,
+                    stat.st_mtime_ns, stat.st_ino))
+    entries = [ x for x in entries if x.st_size < packed['threshold'] ]
+    for member in pack_members(container, folder, entries, manifest):
+        members[member[0]] = member
+    return sorted(members.values())
+
+def group_members(members):
+    """Splits the sorted members of a packed folder into the groups stored
+    in each pack. A pack ends after a file whose name hashes to a multiple
+    of PACK_FILES, so adding or removing a file only changes the pack it
+    falls in, or once it holds PACK_SIZE bytes.
+    """
+    groups = []
+    group = []
+    size = 0
+    for member in members:
+        group.append(member)
+        size += member[1]
+        if size >= PACK_SIZE or int(md5(member[0].encode()).hexdigest()[:8], 16) % PACK_FILES == 0:
+            groups.append(group)
+            group = []
+            size = 0
+    if group:
+        groups.append(group)
+    return groups
+
+def pack_key(members):
+    """Returns the key of the pack holding the given (name, size, md5
+    checksum) members
+    """
+    digest = md5()
+    for name, size, checksum in members:
+        digest.update(f"{name}\0{size}\0{checksum}\n".encode())
+    return digest.hexdigest()
+
+def encode_index(index):
+    """Returns the compressed data of a packed folder's index
+    """
+    return gzip.compress(json.dumps(index, separators = (',', ':')).encode(), mtime = 0)
+
+def decode_index(data):
+    """Returns the index of a packed folder from its compressed data
+    """
+    return json.loads(gzip.decompress(data))
+
+def find_tree_folder(tree, root_id, relpath):
+    """Returns the Drive ID of the folder at the given relative path in the
+    RemoteTree tree, or None
+    """
+    folder_id = root_id
+    for name in relpath.split('/') if relpath else []:
+        folder = tree.get_child(folder_id, name)
+        if folder is None or folder['mimeType'] != FOLDER_MIME:
+            return None
+        folder_id = folder['id']
+    return folder_id
+
+def find_packed_folders(tree, root_id):
+    """Returns the relative paths of the folders of the RemoteTree tree that
+    hold a pack index
+    """
+    folders = [''] if tree.get_child(root_id, PACK_INDEX) else []
+    for relpath, file in tree.walk(root_id, ''):
+        if file['mimeType'] == FOLDER_MIME and tree.get_child(file['id'], PACK_INDEX):
+            folders.append(relpath)
+    return folders
+
+def changed_packed_folders(changes, manifest):
+    """Returns the relative paths of the folders of the repository in which
+    a pack index shows up in the changes returned by get_changes
+    """
+    folders = set()
+    for change in changes:
+        file = change.get('file') or {}
+        if file.get('name') != PACK_INDEX:
+            continue
+        for parent in file.get('parents', []):
+            relpath = manifest.folder_path(parent)
+            if relpath is not None:
+                folders.add(relpath)
+    return sorted(folders)
+
+def find_index(service, folder_id, cached = None, changes = None):
+    """Returns the Drive file of the index in the packed folder folder_id, or
+    None if there isn't one. If the changes returned by get_changes are
+    given, the index is looked for among them, and the index last seen,
+    cached, is kept if they don't include it.
+    """
+    if changes is not None:
+        for change in reversed(changes):
+            file = change.get('file') or {}
+            if (cached and change['fileId'] == cached['file_id']) or\
+                (file.get('name') == PACK_INDEX and folder_id in file.get('parents', [])):
+                if change.get('removed') or file.get('trashed') or\
+                    folder_id not in file.get('parents', []):
+                    return None
+                return file
+        if cached and cached['file_id']:
+            return { 'id': cached['file_id'], 'md5Checksum': cached['md5'] }
+    q = f"'{folder_id}' in parents and name = '{PACK_INDEX}' and trashed = false"
+    files = SCHEDULER.execute(service.files().list(q = q, pageSize = 1,
+        fields = 'files(id, name, mimeType, md5Checksum, size)')).get('files', [])
+    return files[0] if files else None
+
+def download_index(service, container, file):
+    """Downloads the given pack index from Drive, returning its compressed data
+    """
+    path = os.path.join(container, f".gitd-index-{file['id']}")
+    fetch_file(None, service, file['id'], path, checksum = file.get('md5Checksum'),
+        size = file.get('size'))
+    try:
+        with open(path, 'rb') as index_file:
+            return index_file.read()
+    finally:
+        os.remove(path)
+
+def load_packs(service, container, manifest, thresholds, root_id, tree = None, changes = None):
+    """Returns the state of each packed folder by relative path, given the
+    dict of thresholds folders are packed with. A threshold of None stands
+    for a folder that's no longer packed.
+    Each folder's state holds its Drive ID, its index on Drive and the
+    checksum of the index last synced. Folders and their indexes are found in
+    the RemoteTree tree if given, along with the Drive files of their packs.
+    Otherwise folders are looked up in the manifest and their indexes among
+    the changes returned by get_changes, if given, or on Drive.
+    Indexes are only downloaded when they differ from the copy in the manifest.
+    """
+    packs = {}
+    for folder, threshold in sorted(thresholds.items()):
+        cached = manifest.get_pack_index(folder)
+        packed = { 'path': folder, 'threshold': threshold, 'folder_id': None, 'index': None,
+            'index_id': None, 'index_md5': None, 'synced': cached['synced'] if cached else None,
+            'files': None }
+        packs[folder] = packed
+        if tree is not None:
+            folder_id = find_tree_folder(tree, root_id, folder)
+            if folder_id is None:
+                continue
+            index_file = tree.get_child(folder_id, PACK_INDEX)
+            packed['files'] = [ x for x in tree.get_files(folder_id)
+                if x['name'].startswith(PACK_PREFIX) ]
+        else:
+            folder_id = manifest.folder_id(folder) if folder else root_id
+            if folder_id is None:
+                continue
+            index_file = find_index(service, folder_id, cached, changes)
+        packed['folder_id'] = folder_id
+        if index_file is None:
+            continue
+
+        checksum = index_file.get('md5Checksum')
+        if cached and cached['md5'] == checksum and cached['data']:
+            data = cached['data']
+        else:
+            data = download_index(service, container, index_file)
+            manifest.set_pack_index(folder, index_file['id'], checksum, data)
+        packed.update(index = decode_index(data), index_id = index_file['id'],
+            index_md5 = checksum)
+    return packs
+
+def index_members(packed, ignore = None):
+    """Returns the (name, size, md5 checksum) members of a packed folder's
+    index whose relative path is matched by the IgnoreRules ignore, such as
+    the files a sparse clone leaves out, along with a dict of where each is
+    stored: the ID, checksum and size of its pack and its offset in it
+    """
+    members = []
+    sources = {}
+    if packed['index'] is None or ignore is None:
+        return members, sources
+    for pack in packed['index']['packs'].values():
+        for name, offset, size, checksum in pack['files']:
+            if ignore.match_path(join_path(packed['path'], name), False):
+                members.append((name, size, checksum))
+                sources[name] = [pack['id'], pack['md5'], pack['size'], offset]
+    return members, sources
+
+def plan_pack_push(plan, packed, members, force = False, ignore = None):
+    """Adds the packs storing the given members of a packed folder, as
+    returned by pack_members, to a push plan. Packs already in the folder's
+    index on Drive are kept, and only the packs whose files changed are built
+    and uploaded. Packs the new index no longer refers to are deleted.
+    Files of the index matched by the IgnoreRules ignore are kept in the
+    folder's packs, as they're never pushed or deleted, and copied from the
+    packs they're in when the pack holding them is rebuilt.
+    If the index changed on Drive since the last sync, the folder is listed
+    as a conflict rather than packed, unless force is set.
+    """
+    index = packed['index']
+    if index is not None and packed['index_md5'] != packed['synced'] and not force:
+        plan.conflicts.append({ 'path': packed['path'] + '/' })
+        return
+    kept, sources = index_members(packed, ignore)
+    if kept:
+        members = sorted([ x for x in members if x[0] not in sources ] + kept)
+    if index is None and not members:
+        return
+
+    old = index['packs'] if index is not None else {}
+    keep = {}
+    build = []
+    for group in group_members(members):
+        key = pack_key(group)
+        if key in old:
+            keep[key] = old[key]
+        else:
+            pack = { 'key': key, 'files': [ list(x) for x in group ] }
+            copied = { x[0]: sources[x[0]] for x in group if x[0] in sources }
+            if copied:
+                pack['sources'] = copied
+            build.append(pack)
+    deletes = [ x['id'] for key, x in sorted(old.items()) if key not in keep ]
+    if packed['files'] is not None:
+        # Packs left over by interrupted pushes
+        known = set(x['id'] for x in old.values())
+        deletes += [ x['id'] for x in packed['files'] if x['id'] not in known ]
+    if index is not None and not build and not deletes and\
+        index['threshold'] == packed['threshold']:
+        return
+    # Packs of files changed on Drive by others are kept when forced, but
+    # still have to be pulled
+    synced = index is None or packed['index_md5'] == packed['synced']
+    plan.packs.append({ 'path': packed['path'], 'threshold': packed['threshold'],
+        'index_id': packed['index_id'], 'keep': keep, 'build': build, 'deletes': deletes,
+        'synced': synced })
+
+def plan_pack_removal(plan, packed, manifest):
+    """Adds the deletion of the index and packs of a folder that's no longer
+    packed to a push plan. Its files are pushed one by one instead.
+    """
+    deletes = [ x['id'] for x in packed['files'] or () ]
+    if packed['index_id']:
+        deletes.append(packed['index_id'])
+        if packed['files'] is None:
+            deletes += [ x['id'] for x in packed['index']['packs'].values() ]
+    if not deletes:
+        manifest.forget_pack_index(packed['path'])
+        return
+    plan.packs.append({ 'path': packed['path'], 'remove': True, 'deletes': deletes })
+
+def plan_pack_pull(container, plan, manifest, packed, entries, ignore = None):
+    """Adds the packs to download to a pull plan, given the LocalTree entries
+    of the packed folder's local files. Only the packs holding a file that's
+    missing or differs locally are downloaded, and only those files are
+    unpacked. Files matched by the IgnoreRules ignore, such as those a sparse
+    clone leaves out, aren't unpacked. Local files missing from the index are
+    deleted, unless the plan downloads them as ordinary files.
+    """
+    folder = packed['path']
+    hash_files(container, entries, manifest)
+    local = { x.path: x for x in entries }
+    downloads = set(x['path'] for x in plan.downloads)
+    deleted = set(x['path'] for x in plan.deletes)
+    deleted_folders = set(x['path'] for x in plan.deletes if x['folder'])
+
+    members = set()
+    unpack = []
+    for key, pack in sorted(packed['index']['packs'].items()):
+        stale = []
+        for name, offset, size, checksum in pack['files']:
+            relpath = join_path(folder, name)
+            members.add(relpath)
+            if ignore is not None and ignore.match_path(relpath, False):
+                continue
+            entry = local.get(relpath)
+            if entry is not None and entry.st_size == size and relpath not in deleted and\
+                not is_inside(relpath, deleted_folders):
+                try:
+                    if manifest.checksum(relpath, entry) == checksum:
+                        continue
+                except FileNotFoundError:
+                    pass
+            stale.append([name, offset, size, checksum])
+        if stale:
+            unpack.append({ 'key': key, 'id': pack['id'], 'md5': pack['md5'], 'size': pack['size'],
+                'files': stale })
+
+    # Packed files are unpacked over whatever is in their way
+    plan.deletes = [ x for x in plan.deletes if x['folder'] or x['path'] not in members ]
+    for entry in entries:
+        if entry.path not in members and entry.path not in downloads:
+            plan.deletes.append({ 'path': entry.path, 'folder': False })
+    if unpack or packed['index_md5'] != packed['synced']:
+        plan.packs.append({ 'path': folder, 'index_md5': packed['index_md5'], 'unpack': unpack })
+
+def upload_pack(http, service, container, folder, pack, folder_id, chunk_size = CHUNK_SIZE):
+    """Builds the given pack of files of a packed folder and uploads it into
+    the Drive folder folder_id. The pack is written to a temporary file, and
+    files are hashed again as they're read, so a file that changed since the
+    pack was planned is stored as it is now. Files deleted since then are
+    left out. Files listed in the pack's sources aren't read locally but
+    copied from the packs on Drive they're in. Returns the pack's entry in
+    the folder's index, with its key.
+    The temporary file is kept inside the packed folder, as packs of
+    different folders can have the same key.
+    """
+    container = to_path(container)
+    temp_path = container + join_path(folder, f"{PACK_PREFIX}{pack['key']}.tmp")
+    sources = pack.get('sources', {})
+    fetched = {}
+    files = []
+    offset = 0
+    try:
+        with FileIO(temp_path, 'wb') as pack_file:
+            for name, size, checksum in pack['files']:
+                if name in sources:
+                    data = read_source(http, service, temp_path, sources[name], size, fetched)
+                    if md5(data).hexdigest() != checksum:
+                        raise IOError(f"checksum mismatch copying {name}")
+                else:
+                    try:
+                        with open(container + join_path(folder, name), 'rb') as f:
+                            data = f.read()
+                    except FileNotFoundError:
+                        continue
+                pack_file.write(data)
+                files.append([name, offset, len(data), md5(data).hexdigest()])
+                offset += len(data)
+        key = pack_key([ (x[0], x[2], x[3]) for x in files ])
+        result = upload_file(http, service, temp_path,
+            body = { 'name': PACK_PREFIX + key, 'parents': [folder_id] }, chunk_size = chunk_size)
+    finally:
+        for path in [temp_path] + list(fetched.values()):
+            if os.path.exists(path):
+                os.remove(path)
+    return { 'key': key, 'id': result['id'], 'md5': result['md5Checksum'], 'size': offset,
+        'files': files }
+
+def read_source(http, service, temp_path, source, size, fetched):
+    """Returns the size bytes of a file stored in a pack on Drive, given its
+    source as listed by index_members. Each pack is only downloaded once,
+    next to the pack being built at temp_path, and the dict fetched maps the
+    IDs of the packs downloaded so far to their paths, which the caller
+    removes.
+    """
+    pack_id, checksum, pack_size, offset = source
+    if pack_id not in fetched:
+        fetched[pack_id] = f"{temp_path}.{pack_id}"
+        fetch_file(http, service, pack_id, fetched[pack_id], checksum = checksum,
+            size = pack_size)
+    with open(fetched[pack_id], 'rb') as pack_file:
+        pack_file.seek(offset)
+        return pack_file.read(size)
+
+def write_index(service, container, manifest, folder, folder_id, index_id, index, synced = True):
+    """Uploads the index of a packed folder into the Drive folder folder_id,
+    over the existing index index_id if given, and records it in the
+    manifest, as synced if synced is set
+    """
+    data = encode_index(index)
+    temp_path = to_path(container) + join_path(folder, PACK_INDEX + '.tmp')
+    with FileIO(temp_path, 'wb') as index_file:
+        index_file.write(data)
+    try:
+        if index_id:
+            result = upload_file(None, service, temp_path, file_id = index_id)
+        else:
+            result = upload_file(None, service, temp_path,
+                body = { 'name': PACK_INDEX, 'parents': [folder_id] })
+    finally:
+        os.remove(temp_path)
+    if manifest is not None:
+        manifest.set_pack_index(folder, result['id'], result['md5Checksum'], data, synced)
+
+def delete_files(service, file_ids, label):
+    """Deletes the Drive files with the given IDs in batch requests,
+    reporting those that couldn't be deleted. Returns True if they all were.
+    """
+    requests = [ service.files().delete(fileId = x) for x in file_ids ]
+    failed = [ error for _, error in batch_execute(service, requests)
+        if error is not None and error.resp.status != 404 ]
+    for error in failed:
+        print(f"Failed to delete a pack of {label}: {error}")
+    return not failed
+
+def execute_pack_push(service, container, plan, manifest = None, pool = None, journal = None):
+    """Builds and uploads the new packs of a push plan on the transfer pool,
+    then replaces the index of each packed folder and deletes the packs it no
+    longer refers to. An index is only replaced once all the folder's new
+    packs are on Drive, so the index on Drive always refers to whole packs.
+    """
+    chunk_size = pool.chunk_size if pool is not None else CHUNK_SIZE
+    built = {}
+    packs = [ x for x in plan.packs if not x.get('remove') and x['path'] in plan.folder_ids ]
+    for op in packs:
+        results = built[op['path']] = {}
+        for pack in op['build']:
+            print(f"Packing {len(pack['files'])} file(s) of {op['path'] or '/'}...")
+            transfer(pool, f"{op['path'] or '/'} pack {pack['key']}", upload_pack, service,
+                container, op['path'], pack, plan.folder_ids[op['path']], chunk_size = chunk_size,
+                on_done = lambda result, results = results: results.update({ result['key']: result }))
+    if pool is not None:
+        pool.wait()
+
+    for op in packs:
+        results = built[op['path']]
+        if len(results) < len(op['build']):
+            print(f"Failed to update the index of {op['path'] or '/'}, some of its packs " +
+                "couldn't be uploaded")
+            continue
+        index = { 'threshold': op['threshold'], 'packs': dict(op['keep']) }
+        for key, result in results.items():
+            index['packs'][key] = { x: result[x] for x in ('id', 'md5', 'size', 'files') }
+        write_index(service, container, manifest, op['path'], plan.folder_ids[op['path']],
+            op['index_id'], index, op['synced'])
+        delete_files(service, op['deletes'], op['path'] or '/')
+        if journal is not None:
+            journal.done('pack', op['path'])
+
+def execute_pack_removal(service, plan, manifest = None, pool = None, journal = None):
+    """Deletes the index and packs of the folders a push plan stops packing,
+    once their files have been uploaded one by one
+    """
+    removals = [ x for x in plan.packs if x.get('remove') ]
+    if not removals:
+        return
+    if pool is not None:
+        pool.wait()
+        if pool.failures:
+            print("Leaving the packs of unpacked folders on Drive until every file is uploaded")
+            return
+    for op in removals:
+        print(f"Removing the packs of {op['path'] or '/'}...")
+        if not delete_files(service, op['deletes'], op['path'] or '/'):
+            continue
+        if manifest is not None:
+            manifest.forget_pack_index(op['path'])
+        if journal is not None:
+            journal.done('pack', op['path'])
+
+def schedule_unpack(service, pool, container, folder, pack, manifest = None, on_recorded = None):
+    """Schedules the download of a pack of the packed folder at the relative
+    path folder on the transfer pool, unpacking the files it lists. If a
+    manifest is supplied, the unpacked files are recorded in it once the
+    pack is done. on_recorded, if given, is called after that.
+    """
+    def on_done(unpacked):
+        if manifest is not None:
+            for relpath, stat, checksum in unpacked:
+                manifest.set_local(relpath, stat, checksum)
+        if on_recorded:
+            on_recorded()
+
+    chunk_size = pool.download_chunk_size if pool is not None else DOWNLOAD_CHUNK_SIZE
+    transfer(pool, f"{folder or '/'} pack {pack['key']}", unpack_pack, service, container, folder,
+        pack, chunk_size = chunk_size, on_done = on_done)
+
+def unpack_pack(http, service, container, folder, pack, chunk_size = DOWNLOAD_CHUNK_SIZE):
+    """Downloads a pack of the packed folder at the relative path folder and
+    writes out the files it lists, checking each against its md5 checksum.
+    Each file is written to a temporary file that replaces it once complete.
+    The pack is downloaded inside the packed folder, as packs of different
+    folders can have the same key.
+    Returns the (relative path, stat result, md5 checksum) of every file.
+    """
+    container = to_path(container)
+    pack_path = container + join_path(folder, PACK_PREFIX + pack['key'])
+    os.makedirs(os.path.dirname(pack_path), exist_ok = True)
+    fetch_file(http, service, pack['id'], pack_path, chunk_size = chunk_size,
+        checksum = pack['md5'], size = pack['size'])
+    unpacked = []
+    try:
+        with open(pack_path, 'rb') as pack_file:
+            for name, offset, size, checksum in pack['files']:
+                pack_file.seek(offset)
+                data = pack_file.read(size)
+                if md5(data).hexdigest() != checksum:
+                    raise IOError(f"checksum mismatch unpacking {name}")
+                relpath = join_path(folder, name)
+                path = container + relpath
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+                temp_path = os.path.join(os.path.dirname(path), f".gitd-unpack-{os.path.basename(path)}")
+                with FileIO(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+                unpacked.append((relpath, os.stat(path), checksum))
+    finally:
+        os.remove(pack_path)
+    return unpacked
+
+def execute_pack_pull(service, container, plan, manifest = None, pool = None, journal = None):
+    """Schedules the packs of a pull plan to be downloaded and unpacked on
+    the transfer pool. Each packed folder's index is recorded as synced once
+    all its packs are unpacked.
+    """
+    for op in plan.packs:
+        def finished(op = op):
+            if manifest is not None:
+                manifest.set_pack_synced(op['path'], op['index_md5'])
+            if journal is not None:
+                journal.done('pack', op['path'])
+
+        if not op['unpack']:
+            finished()
+            continue
+        remaining = [len(op['unpack'])]
+        def on_recorded(finished = finished, remaining = remaining):
+            remaining[0] -= 1
+            if not remaining[0]:
+                finished()
+
+        for pack in op['unpack']:
+            print(f"Unpacking {len(pack['files'])} file(s) into {op['path'] or '/'}...")
+            schedule_unpack(service, pool, container, op['path'], pack, manifest, on_recorded)
@@ -1,22 +1,51 @@
 from io import FileIO
 import json
 from .functions import *
+from .ignore import load_ignore
+from .journal import Journal
+from .manifest import Manifest
+from .packs import PACK_THRESHOLD, changed_packed_folders, find_packed_folders, load_packs,\
+    packed_folder
+from .sync import *
+from .transfer import TransferPool
 import os
 import time
 
 REPO_FILE = ".gitd"
 
-def get_repo_in_folder(service, folder):
+def get_repo_in_folder(service, folder, folder_cache = None):
     """Attempts to get the repository in the given folder, if none exists,
     return None.
     """
     folder = to_path(folder)
     if(os.path.isfile(folder+REPO_FILE)):
-        return Repository(service, folder)
+        return Repository(service, folder, folder_cache = folder_cache)
     else:
         return None
 
-def clone_repo_in_folder(service, folder, path):
+def find_repos(folder):
+    """Returns the folders beneath the given folder, including itself, that
+    hold a repository, sorted by path. Repositories aren't searched for
+    inside other repositories, and hidden folders are skipped.
+    """
+    found = []
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        if os.path.isfile(os.path.join(current, REPO_FILE)):
+            found.append(current)
+            continue
+        try:
+            scan = os.scandir(current)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with scan:
+            for entry in scan:
+                if not entry.name.startswith('.') and entry.is_dir(follow_symlinks = False):
+                    stack.append(entry.path)
+    return sorted(found)
+
+def clone_repo_in_folder(service, folder, path, folder_cache = None):
     # Create repo folder
     name = path.split('/')[-1:][0]
     destination = os.path.join(folder, name)
@@ -29,12 +58,12 @@ def clone_repo_in_folder(service, folder, path):
         # Return false, can't clone a repository into a folder already contains a repository
         return False    
     else:
-        return Repository(service, destination, path = path)
+        return Repository(service, destination, path = path, folder_cache = folder_cache)
 
 class Repository:
     """ Gitd Repository class
     """
-    def __init__(self, service, container, path = None, path_id = None):
+    def __init__(self, service, container, path = None, path_id = None, folder_cache = None):
         container = to_path(container)
         self.service = service
         self.container = container
@@ -49,13 +78,18 @@ class Repository:
             }
 
         self.corrupt = False
+        self.folder_cache = folder_cache
+        # Set when the folder's ID was just looked up, so it may come from a
+        # stale folder cache
+        self.resolved = False
 
         # Attempt to find pre-existing config file
         self.read_config()
         if 'path_id' not in self.data:
             # If no path ID was supplied, get the path ID
             if path_id == None:
-                path_id = find_folder_id(service, path)
+                path_id = find_folder_id(service, path, cache = folder_cache)
+                self.resolved = folder_cache is not None
                 if(path_id == None):
                     print("Error: This repository doesn't exist :(")
                     print(f"Tip: You can create a new repository by calling 'gitd init \"{path}\"'")
@@ -65,27 +99,410 @@ class Repository:
             # Set path ID in config
             self.data['path_id'] = path_id
 
+        self.manifest = None
         if not self.is_corrupt():
+            self.manifest = Manifest(container)
             self.write_config()
 
-    def pull(self):
+    def remote_tree(self, ignore = None):
+        """Returns a RemoteTree snapshot of the repository's Drive folder.
+        If the folder's ID was just looked up and Drive reports it missing,
+        the ID came from a stale folder cache, so it's evicted and the path
+        looked up again on Drive.
+        """
+        tree = get_remote_tree(self.service, self.data['path_id'], ignore = ignore)
+        if tree.missing and self.resolved:
+            self.resolved = False
+            self.folder_cache.invalidate('/'.join(x for x in self.data['path'].split('/') if x))
+            path_id = find_folder_id(self.service, self.data['path'], cache = self.folder_cache)
+            if path_id is not None and path_id != self.data['path_id']:
+                self.data['path_id'] = path_id
+                self.write_config()
+                tree = get_remote_tree(self.service, path_id, ignore = ignore)
+        return tree
+
+    def plan_pull(self, tree = None):
+        """Returns a SyncPlan pulling changes from the Drive folder, the
+        changes token to store once the plan has been run, and whether the
+        plan only covers the changes recorded since the last sync.
+        If the repository has a changes token, only those changes are planned.
+        Otherwise the Drive folder is walked in full, reusing tree if given.
+        Returns a None plan if the Drive folder no longer exists.
+        """
+        ignore = self.load_ignore()
+        if self.data.get('changes_token') and not self.manifest.is_empty():
+            changes, token = get_changes(self.service, self.data['changes_token'])
+            if changes is not None:
+                packs = self.load_packs(changes = changes,
+                    found = changed_packed_folders(changes, self.manifest))
+                plan = plan_changes(self.service, self.container, changes, self.manifest, ignore,
+                    self.get_export_formats(), packs)
+                return plan, token, True
+            print("Changes token has expired, pulling the whole repository...")
+
+        # Take the token before walking so that changes made during the walk
+        # are replayed by the next pull
+        token = get_start_page_token(self.service)
+        if tree is None:
+            tree = self.remote_tree(ignore)
+        if tree.missing:
+            print("Error: the repository's folder no longer exists on Drive")
+            return None, None, False
+        packs = self.load_packs(tree, found = find_packed_folders(tree, self.data['path_id']))
+        plan = plan_pull(self.container, tree, self.data['path_id'], self.manifest, ignore = ignore,
+            exports = self.get_export_formats(), packs = packs)
+        return plan, token, False
+
+    def pull(self, pool = None, dry_run = False, force = False):
         """Pull changes from the Drive folder
+        If the repository has a changes token, only the changes recorded since
+        the last sync are replayed. A full walk of the Drive folder is only
+        performed when there is no token or it has expired.
+        Downloads are run on the given transfer pool, or one at a time if no
+        pool is supplied. If dry_run is set to True, the planned changes are
+        printed and nothing is transferred.
+        The plan is journaled as it runs, and if an earlier pull was
+        interrupted, its unfinished operations are run instead of planning
+        again.
+        Returns the plan that was run, or printed if dry_run is set, or None
+        if nothing was run.
         """
         if self.is_corrupt():
-            return
+            return None
+
+        if pool is None:
+            pool = TransferPool()
+
+        journal = Journal(self.manifest)
+        plan, state = journal.load('pull')
+        if plan is None and journal.pending() == 'push':
+            print("Error: a push was interrupted, run 'gitd push' to finish it first")
+            return None
+        if plan is not None:
+            print("Resuming the interrupted pull...")
+            token, incremental = state['token'], state['incremental']
+            if dry_run:
+                plan.print_plan()
+                return plan
+        else:
+            with STATS.span('plan pull'):
+                plan, token, incremental = self.plan_pull()
+            if plan is None:
+                return None
+            if dry_run:
+                plan.print_plan()
+            if dry_run or not plan.confirm(force):
+                # Keep the checksums computed while planning
+                self.manifest.commit()
+                return plan if dry_run else None
+            journal.begin(plan, token = token, incremental = incremental)
 
-        pull_from_folder(self.service, self.container, self.data['path_id'])
-        self.set_sync_time(time.time())
+        if not incremental:
+            self.manifest.reset_remote(self.data['path_id'])
+        discard_partial_downloads(self.container, plan, self.manifest)
+        with STATS.span('execute pull'):
+            execute_pull(self.service, self.container, plan, self.manifest, pool, journal)
+            pool.wait()
+        if pool.report():
+            self.data['changes_token'] = token
+            self.set_sync_time(time.time())
+        elif incremental:
+            # Keep the old token so the changes are replayed by the next pull
+            self.manifest.commit()
+        else:
+            # Files that failed won't show up in the changes feed, so the next
+            # pull has to walk the whole repository again
+            self.data['changes_token'] = None
+            self.write_config()
+            self.manifest.commit()
+        journal.finish()
+        return plan
 
-    def push(self):
+    def push(self, checksum = False, force = False, pool = None, dry_run = False):
         """Push changes to the Drive folder
+        If checksum is set to True, files are compared with Drive by content
+        instead of by modification time.
+        Uploads are run on the given transfer pool, or one at a time if no
+        pool is supplied. If dry_run is set to True, the planned changes are
+        printed and nothing is transferred.
+        The plan is journaled as it runs, and if an earlier push was
+        interrupted, its unfinished operations are run instead of planning
+        again.
+        Returns the plan that was run, or printed if dry_run is set, or None
+        if nothing was run.
+        """
+        if self.is_corrupt():
+            return None
+
+        if pool is None:
+            pool = TransferPool()
+
+        # Files changed from here on are newer than the sync time, so they're
+        # pushed again next time even if they change while being uploaded
+        started = time.time()
+        journal = Journal(self.manifest)
+        plan, state = journal.load('push')
+        if plan is None and journal.pending() == 'pull':
+            print("Error: a pull was interrupted, run 'gitd pull' to finish it first")
+            return None
+        if plan is not None:
+            print("Resuming the interrupted push...")
+            started = state['started']
+            if dry_run:
+                plan.print_plan()
+                return plan
+        else:
+            ignore = self.load_ignore()
+            tree = self.remote_tree(ignore)
+            if tree.missing:
+                print("Error: the repository's folder no longer exists on Drive")
+                return None
+            with STATS.span('plan push'):
+                plan = plan_push(self.container, tree, self.data['path_id'], self.manifest,
+                    checksum = checksum, after_time = self.get_sync_time(), force = force,
+                    ignore = ignore, exports = self.get_export_formats(),
+                    packs = self.load_packs(tree))
+            if dry_run:
+                plan.print_plan()
+            if dry_run or not plan.confirm(force):
+                # Keep the checksums computed while planning
+                self.manifest.commit()
+                return plan if dry_run else None
+            journal.begin(plan, started = started)
+
+        with STATS.span('execute push'):
+            execute_push(self.service, self.container, plan, self.manifest, pool, journal)
+            pool.wait()
+        if pool.report():
+            self.set_sync_time(started)
+        else:
+            # Leave the sync time alone so failed files are pushed again
+            self.manifest.commit()
+        journal.finish()
+        return plan
+
+    def status(self, checksum = False):
+        """Print what a push and a pull would change, without transferring
+        anything.
+        """
+        if self.is_corrupt():
+            return
+
+        ignore = self.load_ignore()
+        tree = self.remote_tree(ignore)
+        if tree.missing:
+            print("Error: the repository's folder no longer exists on Drive")
+            return
+
+        print("Changes to push:")
+        plan_push(self.container, tree, self.data['path_id'], self.manifest,
+            checksum = checksum, after_time = self.get_sync_time(), ignore = ignore,
+            exports = self.get_export_formats(), packs = self.load_packs(tree)).print_plan()
+
+        print("Changes to pull:")
+        plan, _, _ = self.plan_pull(tree)
+        if plan is not None:
+            plan.print_plan()
+        # Keep the checksums computed while planning
+        self.manifest.commit()
+
+    def push_paths(self, paths, moves = (), pool = None, ignore = None):
+        """Push only the given relative paths, and the (old, new) pairs of
+        paths in moves, using the manifest instead of walking the repository
+        and listing Drive. Deletions aren't confirmed.
+        """
+        if pool is None:
+            pool = TransferPool()
+
+        # Packed folders the paths are in, which are repacked
+        changed = set(paths) | set(x for move in moves for x in move)
+        thresholds = { x: y for x, y in self.get_packs().items()
+            if any(z == x or packed_folder(z, { x: y }) is not None for z in changed) }
+        with STATS.span('plan paths'):
+            packs = load_packs(self.service, self.container, self.manifest, thresholds,
+                self.data['path_id']) if thresholds else None
+            plan = plan_paths(self.container, paths, self.manifest, self.data['path_id'],
+                moves, ignore, packs)
+        if plan.is_empty():
+            self.manifest.commit()
+            return
+        print(plan.summary())
+        with STATS.span('execute push'):
+            execute_push(self.service, self.container, plan, self.manifest, pool)
+            pool.wait()
+        pool.report()
+        self.manifest.commit()
+
+    def index_remote(self):
+        """Walk the whole Drive folder, including the parts a sparse clone
+        leaves out, and keep an index of it in the manifest so paths can be
+        fetched without listing Drive again.
+        """
+        if self.is_corrupt():
+            return
+        sparse = self.get_sparse() or {}
+        ignore = load_ignore(self.container, { 'exclude': sparse.get('exclude', ()) })
+        tree = self.remote_tree(ignore)
+        if tree.missing:
+            print("Error: the repository's folder no longer exists on Drive")
+            return
+        exports = self.get_export_formats()
+
+        def walk(folder_id, prefix):
+            for file in tree.get_files(folder_id) + tree.get_folders(folder_id):
+                name = local_name(file, exports)
+                if name is None or is_repo_file(name):
+                    continue
+                relpath = join_path(prefix, name)
+                yield relpath, file
+                if file['mimeType'] == FOLDER_MIME:
+                    yield from walk(file['id'], relpath)
+
+        self.manifest.set_remote_tree(walk(self.data['path_id'], ''))
+        self.manifest.commit()
+        count, size = self.manifest.remote_size('')
+        print(f"Indexed {count} file(s) ({format_size(size)}) on Drive.")
+
+    def find_remote(self, relpath):
+        """Returns the (relative path, Drive file) pairs of the folders
+        leading to the given relative path and of the path itself, or None if
+        it doesn't exist on Drive. Paths are looked up in the index of the
+        remote tree first, and folders missing from it are listed on Drive.
+        """
+        found = []
+        folder_id = self.data['path_id']
+        exports = self.get_export_formats()
+        parts = relpath.split('/') if relpath else []
+        for i in range(len(parts)):
+            path = '/'.join(parts[:i + 1])
+            file = self.manifest.get_remote(path)
+            if file is None:
+                tree = get_remote_tree(self.service, folder_id, recursive = False)
+                children = tree.get_files(folder_id) + tree.get_folders(folder_id)
+                file = next((x for x in children if local_name(x, exports) == parts[i]), None)
+                if file is None:
+                    return None
+            found.append((path, file))
+            folder_id = file['id']
+        return found
+
+    def fetch(self, relpath = None, pool = None, force = False):
+        """Download the file or folder at the given relative path into a
+        sparse or metadata-only clone, and add it to the paths the clone's
+        pulls and pushes cover. Without a path, the index of the remote tree
+        is refreshed instead.
         """
         if self.is_corrupt():
             return
-        
-        push_from_folder(self.service, self.container,
-            self.data['path_id'], after_time = self.get_sync_time())
-        self.set_sync_time(time.time())
+        if relpath is None:
+            self.index_remote()
+            return
+
+        if pool is None:
+            pool = TransferPool()
+
+        relpath = relpath.strip('/')
+        found = self.find_remote(relpath)
+        if found is None:
+            print(f"Error: '{relpath}' doesn't exist in the repository on Drive")
+            print("Tip: refresh the index of the repository by calling 'gitd fetch'")
+            return
+        file = found[-1][1] if found else { 'id': self.data['path_id'], 'mimeType': FOLDER_MIME }
+        self.include_path(relpath)
+        ignore = self.load_ignore()
+        exports = self.get_export_formats()
+
+        with STATS.span('plan fetch'):
+            if file['mimeType'] == FOLDER_MIME:
+                tree = get_remote_tree(self.service, file['id'], ignore = ignore, prefix = relpath)
+                if tree.missing:
+                    print(f"Error: '{relpath}' no longer exists on Drive")
+                    return
+                plan = plan_pull(self.container, tree, file['id'], self.manifest, prefix = relpath,
+                    ignore = ignore, exports = exports)
+            else:
+                file = SCHEDULER.execute(self.service.files().get(fileId = file['id'],
+                    fields = 'id, name, mimeType, md5Checksum, size, version, trashed'))
+                if file.get('trashed'):
+                    print(f"Error: '{relpath}' no longer exists on Drive")
+                    return
+                plan = SyncPlan('pull', exports = exports)
+                plan.records.append(('file', relpath, file['id'], file.get('md5Checksum')))
+                plan_download(plan, relpath, file)
+            # Record the folders leading to the path so changes inside them
+            # can be pulled and new files pushed
+            for path, folder in found:
+                if folder['mimeType'] != FOLDER_MIME:
+                    continue
+                plan.records.append(('folder', folder['id'], path))
+                if not os.path.isdir(self.container + path):
+                    plan.folders.append({ 'path': path, 'name': folder['name'],
+                        'parent': path.rpartition('/')[0] })
+        print(plan.summary())
+        if not plan.confirm(force):
+            self.manifest.commit()
+            return
+
+        with STATS.span('execute pull'):
+            execute_pull(self.service, self.container, plan, self.manifest, pool)
+            pool.wait()
+        pool.report()
+        self.manifest.commit()
+
+    def watch(self, pool = None, delay = 1, interval = 30, force = False):
+        """Keep the repository in sync until interrupted.
+        After an initial pull and push, local changes are watched with
+        inotify and pushed delay seconds after a burst of writes ends, without
+        walking the repository again. The Drive changes feed is polled every
+        interval seconds and remote changes are pulled. Once watching,
+        deletions on either side are applied without asking; force only
+        applies to the initial sync.
+        """
+        if self.is_corrupt():
+            return
+
+        if pool is None:
+            pool = TransferPool()
+
+        # Imported here to keep ctypes out of the start up of other commands
+        from .watch import Watcher
+        ignore = self.load_ignore()
+        # Start watching before the initial sync so nothing is missed
+        try:
+            watcher = Watcher(self.container, ignore, delay = delay)
+        except OSError as e:
+            print(f"Error: unable to watch the repository: {e.strerror or e}")
+            return
+        try:
+            self.pull(pool = pool, force = force)
+            self.push(pool = pool, force = force)
+            if not self.data.get('changes_token'):
+                self.reset_changes_token()
+            print(f"Watching {self.get_name()} for changes, press Ctrl+C to stop...")
+
+            next_poll = time.monotonic() + interval
+            while True:
+                timeout = watcher.timeout()
+                wait = next_poll - time.monotonic()
+                watcher.read(max(0, wait if timeout is None else min(timeout, wait)))
+                if watcher.overflowed:
+                    # Events were lost, check the whole repository
+                    watcher.take()
+                    self.push(pool = pool, force = True)
+                elif watcher.is_ready():
+                    paths, moves = watcher.take()
+                    self.push_paths(paths, moves, pool, ignore)
+                if time.monotonic() >= next_poll:
+                    # Push pending changes first so they aren't overwritten
+                    paths, moves = watcher.take()
+                    if paths or moves:
+                        self.push_paths(paths, moves, pool, ignore)
+                    self.pull(pool = pool, force = True)
+                    next_poll = time.monotonic() + interval
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            watcher.close()
 
     def read_config(self):
         """Attempt to read config file and set config data.
@@ -101,12 +518,15 @@ class Repository:
             return False
 
     def write_config(self):
-        """Write current config to the config file
+        """Write current config to the config file. It's written to a
+        temporary file which then replaces the config, so an interrupted
+        write never leaves it truncated.
         """
-        config_file = FileIO(self.container + REPO_FILE, "wb")
-        config_file.seek(0)
-        config_file.truncate(0)
-        config_file.write(json.dumps(self.data).encode())
+        temp_path = self.container + ".gitd-config.tmp"
+        with FileIO(temp_path, "wb") as config_file:
+            config_file.write(json.dumps(self.data).encode())
+            os.fsync(config_file.fileno())
+        os.replace(temp_path, self.container + REPO_FILE)
 
     def is_corrupt(self):
         """Return bool for if the repository is corrupt
@@ -127,18 +547,149 @@ class Repository:
     def set_sync_time(self, time):
         self.data['sync_time'] = time
         self.write_config()
+        if self.manifest is not None:
+            self.manifest.commit()
     
     def get_sync_time(self):
         return self.data['sync_time']
 
+    def get_export_formats(self):
+        return self.data.get('export_formats')
+
+    def set_export_formats(self, formats):
+        """Set the formats Google Docs files are exported in, as a dict of
+        extensions by Google Docs type. If they changed, the next pull walks
+        the whole repository so existing documents are exported again.
+        """
+        if formats != self.get_export_formats():
+            self.data['export_formats'] = formats
+            self.data['changes_token'] = None
+            self.write_config()
+
+    def get_sparse(self):
+        return self.data.get('sparse')
+
+    def set_sparse(self, include = None, exclude = ()):
+        """Limit the repository to the given relative paths, or to the whole
+        Drive folder if include is None, leaving out paths matching the
+        gitignore-style patterns in exclude
+        """
+        if include is None and not exclude:
+            self.data.pop('sparse', None)
+        else:
+            self.data['sparse'] = { 'include': include, 'exclude': list(exclude) }
+        self.write_config()
+
+    def include_path(self, relpath):
+        """Add the given relative path to the paths a sparse clone covers
+        """
+        sparse = self.get_sparse()
+        if sparse is None or load_ignore(self.container, sparse).covers(relpath):
+            return
+        if not relpath:
+            # The whole repository is included
+            self.set_sparse(None, sparse.get('exclude', ()))
+            return
+        # Paths inside the new one are now redundant
+        include = [ x for x in sparse['include']
+            if x != relpath and not x.startswith(relpath + '/') ]
+        self.set_sparse(include + [relpath], sparse.get('exclude', ()))
+
+    def get_packs(self):
+        return self.data.get('packs', {})
+
+    def set_packs(self, packs):
+        """Set the folders whose small files are packed, as a dict of the
+        size below which files are packed by relative path
+        """
+        if packs:
+            self.data['packs'] = packs
+        else:
+            self.data.pop('packs', None)
+        self.write_config()
+
+    def pack(self, relpath, threshold = PACK_THRESHOLD):
+        """Pack the files smaller than threshold bytes inside the folder at
+        the given relative path from the next push on, or stop packing it if
+        threshold is None
+        """
+        if self.is_corrupt():
+            return
+        relpath = relpath.strip('/')
+        packs = dict(self.get_packs())
+        if threshold is None:
+            if relpath not in packs:
+                print(f"Error: '{relpath or '/'}' isn't packed")
+                return
+            del packs[relpath]
+            self.set_packs(packs)
+            print(f"'{relpath or '/'}' will be unpacked on the next push.")
+            return
+
+        if not os.path.isdir(self.container + relpath):
+            print(f"Error: '{relpath}' isn't a folder in the repository")
+            return
+        for folder in packs:
+            if folder != relpath and (packed_folder(folder, { relpath: None }) is not None or
+                packed_folder(relpath, { folder: None }) is not None):
+                print(f"Error: '{relpath or '/'}' overlaps the packed folder '{folder or '/'}'")
+                return
+        packs[relpath] = threshold
+        self.set_packs(packs)
+        print(f"Files in '{relpath or '/'}' smaller than {format_size(threshold)} will be packed " +
+            "on the next push.")
+
+    def load_packs(self, tree = None, changes = None, found = None):
+        """Returns the state of the repository's packed folders, as returned
+        by load_packs, including the folders no longer packed whose packs may
+        still be on Drive.
+        When pulling, found lists the folders a pack index was found in. Those
+        that were never synced are packed from then on, and packed folders
+        whose index was removed from Drive since they were synced no longer are.
+        """
+        thresholds = dict(self.get_packs())
+        for folder in list(found or ()) + self.manifest.pack_folders():
+            thresholds.setdefault(folder, None)
+        packs = load_packs(self.service, self.container, self.manifest, thresholds,
+            self.data['path_id'], tree, changes)
+        if found is None:
+            return packs
+
+        config = dict(self.get_packs())
+        for folder, packed in packs.items():
+            if packed['index'] is not None and folder not in config and not packed['synced']:
+                print(f"'{folder or '/'}' is packed on Drive, its small files are kept in packs.")
+                config[folder] = packed['threshold'] = packed['index']['threshold']
+            elif packed['index'] is None and packed['synced'] and packed['folder_id'] is not None:
+                config.pop(folder, None)
+                self.manifest.forget_pack_index(folder)
+        if config != self.get_packs():
+            self.set_packs(config)
+        return packs
+
+    def load_ignore(self):
+        """Returns the rules of the paths left out of the repository: those
+        of its .gitdignore file, and its sparse specs if it's a sparse clone
+        """
+        return load_ignore(self.container, self.get_sparse())
+
     def reset_changes_token(self):
-        self.data['changes_token'] = self.service.changes().getStartPageToken().execute()['startPageToken']
+        self.data['changes_token'] = get_start_page_token(self.service)
         self.write_config()
 
     def is_out_of_date(self):
-        """Returns True if the repository is out o; the Drive has been modified
-        since the last pull/push request.
+        """Returns True if the repository is out of date; the Drive has been
+        modified since the last pull/push request.
         """
-        pass
-        #files = self.service.files().list(q=f"'{self.data['path_id']}' in parents and trashed = false", fields="files(name, id, md5Checksum)").execute()
-        #print(files)
+        if not self.data.get('changes_token') or self.manifest.is_empty():
+            return True
+        changes, _ = get_changes(self.service, self.data['changes_token'])
+        if changes is None:
+            return True
+        for change in changes:
+            if self.manifest.has_id(change['fileId']):
+                return True
+            parents = change.get('file', {}).get('parents', [])
+            if any(self.manifest.folder_path(parent) is not None for parent in parents):
+                return True
+        return False
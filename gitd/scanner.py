@@ -0,0 +1,150 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .functions import get_md5_checksum, is_repo_file, join_path, to_path
+from .stats import STATS, timed
+
+# A file or folder found by scan_tree. The stat fields are named like those of
+# os.stat_result, so an entry can be passed wherever a stat result is expected.
+LocalFile = namedtuple('LocalFile', 'path name is_dir st_size st_mtime_ns st_ino')
+
+class LocalTree:
+    """Snapshot of the files and folders inside a local repository, built by
+    scan_tree. Entries are indexed by relative path, and by the relative path
+    of the folder they're in.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.children = {}
+
+    def add(self, prefix, entry):
+        """Add an entry found inside the folder at the relative path prefix
+        """
+        self.entries[entry.path] = entry
+        self.children[prefix].append(entry)
+
+    def get(self, relpath):
+        """Returns the entry at the given relative path, or None
+        """
+        return self.entries.get(relpath)
+
+    def is_dir(self, relpath):
+        """Returns True if the given relative path was scanned as a folder
+        """
+        return relpath in self.children
+
+    def get_files(self, prefix):
+        """Returns the files inside the folder at the relative path prefix
+        """
+        return [ x for x in self.children.get(prefix, []) if not x.is_dir ]
+
+    def get_folders(self, prefix):
+        """Returns the folders inside the folder at the relative path prefix
+        """
+        return [ x for x in self.children.get(prefix, []) if x.is_dir ]
+
+    def walk(self, prefix):
+        """Yields every entry beneath the folder at the relative path prefix
+        """
+        stack = [prefix]
+        while stack:
+            for entry in self.children.get(stack.pop(), []):
+                yield entry
+                if entry.is_dir:
+                    stack.append(entry.path)
+
+    def files(self):
+        """Returns every file in the snapshot
+        """
+        return [ x for x in self.entries.values() if not x.is_dir ]
+
+    def remove(self, paths):
+        """Remove the entries at the given set of relative paths. Folders
+        should be removed along with everything inside them.
+        """
+        for relpath in paths:
+            self.entries.pop(relpath, None)
+            self.children.pop(relpath, None)
+        for prefix in set(x.rpartition('/')[0] for x in paths):
+            if prefix in self.children:
+                self.children[prefix] = [ x for x in self.children[prefix] if x.path not in paths ]
+
+@timed('scan local tree')
+def scan_tree(container, prefix = '', ignore = None):
+    """Returns a LocalTree of everything beneath the folder at the relative
+    path prefix inside the container folder, leaving out Gitd's own files and
+    anything matched by the IgnoreRules ignore.
+    The tree is walked with os.scandir, so each file is only stat'ed once and
+    folders don't need to be stat'ed at all. Ignored folders aren't entered.
+    """
+    container = to_path(container)
+    tree = LocalTree()
+    stack = [prefix]
+    while stack:
+        folder = stack.pop()
+        try:
+            scan = os.scandir(container + folder if folder else container)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        tree.children[folder] = []
+        with scan:
+            for entry in scan:
+                if is_repo_file(entry.name):
+                    continue
+                relpath = join_path(folder, entry.name)
+                is_dir = entry.is_dir()
+                if ignore is not None and ignore.match(relpath, is_dir):
+                    continue
+                if is_dir:
+                    tree.add(folder, LocalFile(relpath, entry.name, True, 0, 0, 0))
+                    stack.append(relpath)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    tree.add(folder, LocalFile(relpath, entry.name, False, stat.st_size,
+                        stat.st_mtime_ns, stat.st_ino))
+    return tree
+
+@timed('hash local tree')
+def hash_tree(container, tree, manifest, jobs = None):
+    """Records the md5 checksum of every file in the LocalTree tree whose
+    stat signature differs from the one in the manifest.
+    Files are hashed on a pool of jobs threads, one per CPU by default, so a
+    large tree is hashed at disk speed rather than one file at a time.
+    """
+    hash_files(container, tree.files(), manifest, jobs)
+
+def hash_files(container, files, manifest, jobs = None):
+    """Records the md5 checksum of every LocalFile in files whose stat
+    signature differs from the one in the manifest, like hash_tree
+    """
+    container = to_path(container)
+    signatures = manifest.local_signatures()
+    stale = [ x for x in files
+        if signatures.get(x.path) != (x.st_size, x.st_mtime_ns, x.st_ino) ]
+    if not stale:
+        return
+
+    jobs = jobs or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers = jobs) as executor:
+        # Hash in slices to keep the number of queued files bounded
+        step = jobs * 64
+        for start in range(0, len(stale), step):
+            entries = stale[start:start + step]
+            checksums = executor.map(lambda x: try_checksum(container + x.path), entries)
+            for entry, checksum in zip(entries, checksums):
+                if checksum is not None:
+                    manifest.set_local(entry.path, entry, checksum)
+
+def try_checksum(path):
+    """Returns the md5 checksum of the given file, or None if it has been
+    deleted since it was scanned
+    """
+    start = time.time()
+    try:
+        size = os.path.getsize(path)
+        checksum = get_md5_checksum(path)
+    except FileNotFoundError:
+        return None
+    STATS.record('hash file', time.time() - start, bytes = size, start = start)
+    return checksum
@@ -0,0 +1,190 @@
+import json
+import random
+import threading
+import time
+from .stats import STATS
+
+# Reasons given by Drive alongside a 403 when a request was rate limited
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+# Statuses of errors that are worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def error_status(error):
+    """Returns the HTTP status of the given HttpError, or None for any other
+    error. The status is read from the error's response, so the Google API
+    client doesn't need to be imported to tell errors apart.
+    """
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+def error_reason(error):
+    """Returns the reason Drive gave for the given HttpError, or None
+    """
+    try:
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+def is_throttled(error):
+    """Returns True if the given error means Drive is rate limiting us
+    """
+    status = error_status(error)
+    return status == 429 or (status == 403 and error_reason(error) in RATE_LIMIT_REASONS)
+
+def is_retryable(error):
+    """Returns True if the request that raised the given error can be retried
+    """
+    if error_status(error) is not None:
+        return error_status(error) in RETRY_STATUSES or is_throttled(error)
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+def request_name(request):
+    """Returns the name of the API method a Drive request calls, such as
+    'files.list'
+    """
+    method = getattr(request, 'methodId', None) or 'request'
+    return method[len('drive.'):] if method.startswith('drive.') else method
+
+class RequestScheduler:
+    """Central scheduler every Drive API call goes through.
+
+    Requests are spread out with a token bucket refilled at `rate` requests
+    per second, and at most `concurrency` requests are in flight at once
+    across all threads. Requests failing with a rate limit, a server error or
+    a connection error are retried up to max_retries times, sleeping for an
+    exponentially growing, randomly jittered delay between attempts.
+
+    The rate and concurrency adapt to how Drive responds: both are halved
+    whenever a request is throttled, and grow back slowly while requests
+    succeed, up to max_rate and max_concurrency. This keeps large syncs
+    running at the highest rate Drive will sustain instead of failing.
+
+    The number of requests, retries and throttle events are counted so they
+    can be reported at the end of a sync. Each call, the time spent waiting
+    for the rate limit and the time spent backing off are also recorded in
+    STATS.
+    """
+    def __init__(self, max_rate = 100, max_concurrency = 8, max_retries = 8,
+        base_delay = 0.5, max_delay = 64):
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate = max_rate
+        self.concurrency = max_concurrency
+        self.tokens = max_rate
+        self.refilled = time.monotonic()
+        self.active = 0
+        self.condition = threading.Condition()
+        self.requests = 0
+        self.retries = 0
+        self.throttles = 0
+
+    def set_concurrency(self, concurrency):
+        """Set the maximum number of requests in flight at once
+        """
+        with self.condition:
+            self.max_concurrency = self.concurrency = max(1, concurrency)
+
+    def acquire(self, cost = 1):
+        """Wait for a free request slot and cost tokens from the bucket
+        """
+        cost = min(cost, self.max_rate)
+        waited = None
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.max_rate, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                if self.active < self.concurrency and self.tokens >= cost:
+                    self.tokens -= cost
+                    self.active += 1
+                    self.requests += cost
+                    break
+                if waited is None:
+                    waited = time.perf_counter()
+                if self.active < self.concurrency:
+                    # Wait for the bucket to refill
+                    self.condition.wait((cost - self.tokens) / self.rate)
+                else:
+                    self.condition.wait()
+        if waited is not None:
+            STATS.record('scheduler wait', time.perf_counter() - waited)
+
+    def release(self, error = None):
+        """Free a request slot, adapting the rate and concurrency to the
+        outcome of the request.
+        """
+        with self.condition:
+            self.active -= 1
+            self.adapt(error)
+
+    def adapt(self, error = None):
+        """Slow down if the given error means Drive is rate limiting us, or
+        speed up slowly if there was no error.
+        """
+        with self.condition:
+            if is_throttled(error):
+                self.throttles += 1
+                self.rate = max(1, self.rate / 2)
+                self.concurrency = max(1, self.concurrency // 2)
+            elif error is None:
+                self.rate = min(self.max_rate, self.rate * 1.05)
+                if self.concurrency < self.max_concurrency and random.random() < 0.1:
+                    self.concurrency += 1
+            self.condition.notify_all()
+
+    def backoff(self, attempt):
+        """Sleep before retrying, for a random time up to an exponentially
+        growing limit
+        """
+        with self.condition:
+            self.retries += 1
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        time.sleep(delay)
+        STATS.record('scheduler backoff', delay)
+
+    def call(self, function, *args, cost = 1, operation = None, **kwargs):
+        """Calls function(*args, **kwargs) within the rate and concurrency
+        limits, retrying it if it fails with a retryable error.
+        Each attempt is recorded in STATS as the named operation.
+        """
+        name = 'drive ' + (operation or getattr(function, '__name__', 'call'))
+        attempt = 0
+        while True:
+            self.acquire(cost)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                STATS.record(name, time.perf_counter() - start, error = e)
+                self.release(e)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                STATS.retry(name)
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            STATS.record(name, time.perf_counter() - start)
+            self.release()
+            return result
+
+    def execute(self, request, http = None):
+        """Executes a Drive API request, with the given HTTP transport if
+        supplied
+        """
+        operation = request_name(request)
+        if http is not None:
+            return self.call(request.execute, http = http, operation = operation)
+        return self.call(request.execute, operation = operation)
+
+    def summary(self):
+        """Returns a line describing the retries made, or None if there were none
+        """
+        if not self.retries:
+            return None
+        return f"Retried {self.retries} Drive request(s), throttled {self.throttles} time(s)" +\
+            f" out of {self.requests} request(s)."
+
+# Scheduler shared by every Drive call made by this process
+SCHEDULER = RequestScheduler()
@@ -0,0 +1,187 @@
+import functools
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds. The last bucket
+# holds everything slower.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+class Operation:
+    """Counters for one kind of operation: how many were run, how many
+    failed or were retried, the time they took and the bytes they moved.
+    """
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, bytes = 0, error = None):
+        self.count += 1
+        self.seconds += seconds
+        self.bytes += bytes
+        if error is not None:
+            self.errors += 1
+        bucket = 0
+        while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the histogram bucket holding the given
+        fraction of the operations, or None if it's the open-ended bucket.
+        """
+        target = fraction * self.count
+        total = 0
+        for bucket, count in enumerate(self.histogram):
+            total += count
+            if count and total >= target:
+                return BUCKETS[bucket] if bucket < len(BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        return { 'count': self.count, 'errors': self.errors, 'retries': self.retries,
+            'seconds': self.seconds, 'bytes': self.bytes,
+            'histogram': { (f"<={x}" if i < len(BUCKETS) else f">{BUCKETS[-1]}"): c
+                for i, (x, c) in enumerate(zip(BUCKETS + (None,), self.histogram)) if c } }
+
+class Stats:
+    """Instrumentation shared by the whole process.
+
+    Every Drive API call made through the scheduler, and every local phase of
+    a sync (scanning, hashing, listing Drive, planning, transfers) is recorded
+    as an Operation under its name, so the end of a command can show where
+    the time went.
+
+    If tracing is enabled, each of them is also kept as a span with its start
+    time, duration, thread and parent span, to be written out as JSON by
+    write_trace.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.spans = None
+        self.ids = itertools.count(1)
+        self.local = threading.local()
+        self.started = time.time()
+
+    def enable_trace(self):
+        """Start keeping a span for every recorded operation
+        """
+        self.spans = []
+
+    def get(self, name):
+        operation = self.operations.get(name)
+        if operation is None:
+            operation = self.operations[name] = Operation()
+        return operation
+
+    def record(self, name, seconds, bytes = 0, error = None, start = None, **attrs):
+        """Record an operation that took the given number of seconds, moved
+        the given number of bytes and failed with error, if not None.
+        """
+        with self.lock:
+            self.get(name).add(seconds, bytes, error)
+        if self.spans is not None:
+            self.add_span(next(self.ids), name, seconds, bytes, error, start, attrs)
+
+    def retry(self, name, count = 1):
+        """Count retries of the named operation
+        """
+        with self.lock:
+            self.get(name).retries += count
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Context manager recording the time taken by the code it wraps as
+        the named operation. It yields a dict in which 'bytes' and other
+        attributes of the span can be set.
+        """
+        span_id = next(self.ids)
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(span_id)
+        start = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            stack.pop()
+            seconds = time.perf_counter() - started
+            bytes = attrs.pop('bytes', 0)
+            with self.lock:
+                self.get(name).add(seconds, bytes, error)
+            if self.spans is not None:
+                self.add_span(span_id, name, seconds, bytes, error, start, attrs)
+
+    def add_span(self, span_id, name, seconds, bytes, error, start, attrs):
+        stack = self.local.__dict__.get('stack')
+        span = { 'id': span_id, 'parent': stack[-1] if stack else None, 'name': name,
+            'start': start if start is not None else time.time() - seconds, 'seconds': seconds,
+            'thread': threading.current_thread().name }
+        if bytes:
+            span['bytes'] = bytes
+        if error is not None:
+            span['error'] = type(error).__name__
+        span.update(attrs)
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Returns a table of the recorded operations, slowest in total first
+        """
+        # Imported here as functions imports this module through the scheduler
+        from .functions import format_size
+        with self.lock:
+            operations = sorted(self.operations.items(), key = lambda x: -x[1].seconds)
+        lines = [ f"Stats for {time.time() - self.started:.1f}s:",
+            f"  {'operation':<32} {'count':>7} {'errors':>6} {'retries':>7} {'total':>8}" +
+            f" {'p50':>7} {'p95':>7} {'bytes':>10}" ]
+        for name, operation in operations:
+            p50, p95 = [ operation.percentile(x) for x in (0.5, 0.95) ]
+            lines.append(f"  {name:<32} {operation.count:>7} {operation.errors:>6} " +
+                f"{operation.retries:>7} {operation.seconds:>7.2f}s {format_latency(p50):>7} " +
+                f"{format_latency(p95):>7} {format_size(operation.bytes) if operation.bytes else '':>10}")
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        """Write the recorded operations and spans to the given file as JSON
+        """
+        with self.lock:
+            trace = { 'started': self.started, 'seconds': time.time() - self.started,
+                'operations': { name: x.to_dict() for name, x in self.operations.items() },
+                'spans': sorted(self.spans or [], key = lambda x: x['start']) }
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file, indent = 1)
+
+def timed(name):
+    """Decorator recording every call of the decorated function in STATS as
+    the named operation
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with STATS.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_latency(seconds):
+    """Returns a histogram bucket bound as a human readable string
+    """
+    if seconds is None:
+        return f">{BUCKETS[-1]}s"
+    if seconds < 1:
+        return f"<={seconds * 1000:g}ms"
+    return f"<={seconds:g}s"
+
+# Statistics of everything done by this process
+STATS = Stats()
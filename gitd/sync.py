@@ -0,0 +1,1188 @@
+import os
+from .functions import *
+from .packs import changed_members, execute_pack_pull, execute_pack_push, execute_pack_removal,\
+    is_packed, pack_members, packed_folder, plan_pack_pull, plan_pack_push, plan_pack_removal,\
+    split_packed
+from .scanner import scan_tree, hash_tree
+
+class SyncPlan:
+    """Plan of the changes needed to sync a repository in one direction.
+    A push plan lists the files to upload, the files to copy from identical
+    files already on Drive, the folders to create on Drive and the Drive files
+    to delete. A pull plan lists the files to download, the
+    local folders to create, local files to move and local files to delete.
+    Both list the packs of packed folders to build or unpack.
+    All paths are relative to the repository.
+
+    Building a plan doesn't change anything on either side, so it can be
+    printed for a dry run, or confirmed once for the whole tree before it is
+    run by execute_push/execute_pull.
+    """
+    def __init__(self, direction, root_id = None, exports = None):
+        self.direction = direction
+        self.uploads = []
+        self.downloads = []
+        self.deletes = []
+        self.folders = []
+        self.moves = []
+        self.copies = []
+        self.conflicts = []
+        # Drive IDs of files and folders to record in the manifest
+        self.records = []
+        # Drive IDs of the folders in the repository, by relative path
+        self.folder_ids = { '': root_id }
+        # Extensions of the formats Google Docs files are exported in, by
+        # Google Docs type, or None for the defaults
+        self.exports = exports
+        # Packs to build or unpack, by packed folder
+        self.packs = []
+
+    def to_dict(self):
+        """Returns the plan as a dict that can be saved as JSON
+        """
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Returns the plan saved by to_dict
+        """
+        plan = cls(data['direction'])
+        plan.__dict__.update(data)
+        return plan
+
+    def top_deletes(self):
+        """Returns the deletions that aren't inside a folder being deleted
+        """
+        folders = set(x['path'] for x in self.deletes if x['folder'])
+        return [ x for x in self.deletes if not is_inside(x['path'], folders) ]
+
+    def is_empty(self):
+        """Returns True if the plan doesn't change anything
+        """
+        return not (self.uploads or self.downloads or self.deletes or self.folders or
+            self.moves or self.copies or self.packs)
+
+    def pack_files(self):
+        """Returns the packs to build or unpack and the files they hold
+        """
+        packs = [ x for op in self.packs for x in op.get('build', op.get('unpack', ())) ]
+        return packs, [ x for pack in packs for x in pack['files'] ]
+
+    def pack_bytes(self):
+        """Returns the number of bytes of the packs to upload or download
+        """
+        packs, files = self.pack_files()
+        if self.direction == 'push':
+            return sum(x[1] for x in files)
+        return sum(x['size'] for x in packs)
+
+    def upload_bytes(self):
+        """Returns the total number of bytes to upload, including packs
+        """
+        packed = self.pack_bytes() if self.direction == 'push' else 0
+        return sum(upload['size'] for upload in self.uploads) + packed
+
+    def download_bytes(self):
+        """Returns the total number of bytes to download, including packs
+        """
+        packed = self.pack_bytes() if self.direction == 'pull' else 0
+        return sum(int(download['file'].get('size') or 0) for download in self.downloads) + packed
+
+    def summary(self):
+        """Returns a one line summary of the plan
+        """
+        packed = self.pack_bytes()
+        if self.direction == 'push':
+            transfers = f"{len(self.uploads)} upload(s) ({format_size(self.upload_bytes() - packed)})"
+            if self.copies:
+                saved = sum(copy['size'] for copy in self.copies)
+                transfers += f", {len(self.copies)} copied on Drive ({format_size(saved)} saved)"
+        else:
+            transfers = f"{len(self.downloads)} download(s) " +\
+                f"({format_size(self.download_bytes() - packed)})"
+        packs, files = self.pack_files()
+        if packs:
+            transfers += f", {len(packs)} pack(s) of {len(files)} small file(s) " +\
+                f"({format_size(packed)})"
+        return f"{transfers}, {len(self.folders)} new folder(s), {len(self.moves)} move(s), " +\
+            f"{len(self.top_deletes())} deletion(s)"
+
+    def print_plan(self):
+        """Print every action in the plan, sorted by path, and a summary
+        """
+        if self.is_empty() and not self.conflicts:
+            print("Everything up-to-date.")
+            return
+
+        lines = []
+        for folder in self.folders:
+            lines.append((folder['path'], 'create', folder['path'] + '/'))
+        for upload in self.uploads:
+            action = 'update' if upload['file_id'] else 'upload'
+            lines.append((upload['path'], action,
+                f"{upload['path']} ({format_size(upload['size'])})"))
+        for copy in self.copies:
+            source = copy['source_path'] or copy['source']['name']
+            lines.append((copy['path'], 'copy', f"{copy['path']} (from {source})"))
+        for download in self.downloads:
+            if download.get('export'):
+                lines.append((download['path'], 'export', download['path']))
+                continue
+            size = int(download['file'].get('size') or 0)
+            lines.append((download['path'], 'download', f"{download['path']} ({format_size(size)})"))
+        for move in self.moves:
+            lines.append((move['to'], 'move', f"{move['from']} -> {move['to']}"))
+        for delete in self.top_deletes():
+            lines.append((delete['path'], 'delete',
+                delete['path'] + ('/' if delete['folder'] else '')))
+        for op in self.packs:
+            path = op['path'] + '/' if op['path'] else '/'
+            if op.get('remove'):
+                lines.append((op['path'], 'unpack', f"{path} (packs removed from Drive)"))
+                continue
+            packs = op.get('build', op.get('unpack'))
+            action = 'pack' if self.direction == 'push' else 'unpack'
+            lines.append((op['path'], action, f"{path} ({len(packs)} pack(s) of " +
+                f"{sum(len(x['files']) for x in packs)} file(s))"))
+        for conflict in self.conflicts:
+            lines.append((conflict['path'], 'skip',
+                f"{conflict['path']} (changed on Drive since the last sync)"))
+
+        for _, action, description in sorted(lines):
+            print(f" {action:<9}{description}")
+        print(self.summary())
+
+    def confirm(self, force = False):
+        """Ask the user once before anything in the plan is deleted.
+        Returns True if the plan should go ahead.
+        """
+        if self.conflicts:
+            print("The following files were changed on Drive since the last sync and will be " +
+                "skipped. Pull them first or push with --force to overwrite them.")
+            for conflict in sorted(self.conflicts, key = lambda x: x['path']):
+                print(f" {conflict['path']}")
+
+        if force or not self.deletes:
+            return True
+
+        # Keep the list and the question together when repositories are
+        # synced in parallel
+        with PROMPT_LOCK:
+            if self.direction == 'push':
+                print("The following files/folders are present and need to be deleted in order to push.")
+            else:
+                print("The following files/folders are present and need to be deleted in order to pull.")
+            for delete in sorted(self.top_deletes(), key = lambda x: x['path']):
+                if delete['folder']:
+                    print(f" {delete['path']}/...")
+                else:
+                    print(f" {delete['path']}")
+            return bool(prompt("Do you still wish to proceed (y/n)? "))
+
+def plan_push(container, tree, folder_id, manifest = None, checksum = False, after_time = None,
+    force = False, plan = None, prefix = '', local = None, ignore = None, exports = None,
+    packs = None):
+    """Returns a SyncPlan pushing the files inside the container folder to the
+    Drive folder folder_id, as described by the RemoteTree snapshot tree.
+    Existing files are uploaded if they were modified after after_time, unless
+    the manifest recorded them unchanged with Drive's checksum, or, if
+    checksum is set to True, if their contents differ from Drive. In either
+    mode, files that were changed on Drive since the manifest last recorded
+    them are listed as conflicts rather than uploaded, unless force is set.
+    local is the LocalTree snapshot of the container folder, which is scanned
+    if not supplied, leaving out files matched by the IgnoreRules ignore.
+    Google Docs files are matched with their exports, named as described by
+    the exports dict, and are never uploaded over or deleted.
+    packs is the dict of packed folders returned by load_packs. The small
+    files of a packed folder are pushed in packs, and folders that are no
+    longer packed have their packs removed.
+    """
+    container = to_path(container)
+    top = plan is None
+    if top:
+        plan = SyncPlan('push', folder_id, exports)
+    packed = {}
+    if local is None:
+        local = scan_tree(container, prefix, ignore)
+        if packs:
+            packed = split_packed(local, { x: y['threshold'] for x, y in packs.items() })
+        if checksum and manifest is not None:
+            hash_tree(container, local, manifest)
+
+    ffiles = { x.name: x for x in local.get_files(prefix) }
+    ffolders = set(x.name for x in local.get_folders(prefix))
+
+    efiles = {}
+    efolders = {}
+    if folder_id is not None:
+        for efile in tree.get_files(folder_id):
+            name = local_name(efile, plan.exports)
+            if name is not None and not is_repo_file(name):
+                efiles.setdefault(name, efile)
+        for efolder in tree.get_folders(folder_id):
+            efolders.setdefault(efolder['name'], efolder)
+
+    for name, efile in efiles.items():
+        if name not in ffiles and not is_google_doc(efile):
+            plan.deletes.append({ 'path': join_path(prefix, name), 'file': efile, 'folder': False })
+    for name, efolder in efolders.items():
+        if name not in ffolders:
+            plan.deletes.append({ 'path': join_path(prefix, name), 'file': efolder, 'folder': True })
+
+    for ffile in sorted(ffiles):
+        relpath = join_path(prefix, ffile)
+        stat = ffiles[ffile]
+        upload = { 'path': relpath, 'name': ffile, 'parent': prefix, 'file_id': None,
+            'size': stat.st_size, 'checksum': None }
+        efile = efiles.get(ffile)
+        if efile is None:
+            plan.uploads.append(upload)
+        elif is_google_doc(efile):
+            # Exported from a Google Docs file, which can't be replaced
+            continue
+        elif checksum:
+            if manifest is not None:
+                lmd5 = manifest.checksum(relpath, stat)
+            else:
+                lmd5 = get_md5_checksum(container + relpath)
+            rmd5 = efile.get('md5Checksum')
+            if lmd5 == rmd5:
+                plan.records.append(('file', relpath, efile['id'], rmd5))
+            elif not force and changed_on_drive(manifest, relpath, efile):
+                plan.conflicts.append({ 'path': relpath })
+            else:
+                upload.update(file_id = efile['id'], checksum = lmd5)
+                plan.uploads.append(upload)
+        elif after_time and stat.st_mtime_ns / 1e9 > after_time:
+            rmd5 = efile.get('md5Checksum')
+            if manifest is not None and manifest.is_unchanged(relpath, stat, rmd5):
+                # Downloaded since the last sync, e.g. by fetch, and unchanged
+                plan.records.append(('file', relpath, efile['id'], rmd5))
+            elif not force and changed_on_drive(manifest, relpath, efile):
+                plan.conflicts.append({ 'path': relpath })
+            else:
+                # File modified after the given after_time, upload it.
+                upload['file_id'] = efile['id']
+                plan.uploads.append(upload)
+
+    for ffolder in sorted(ffolders):
+        relpath = join_path(prefix, ffolder)
+        efolder = efolders.get(ffolder)
+        if efolder is None:
+            plan.folders.append({ 'path': relpath, 'name': ffolder, 'parent': prefix })
+            plan_push(container, tree, None, manifest, checksum, after_time, force, plan,
+                relpath, local)
+        else:
+            plan.folder_ids[relpath] = efolder['id']
+            plan.records.append(('folder', efolder['id'], relpath))
+            plan_push(container, tree, efolder['id'], manifest, checksum, after_time, force,
+                plan, relpath, local)
+
+    if top:
+        detect_push_moves(container, tree, plan, local, manifest, checksum, after_time, force)
+        detect_copies(container, tree, plan, local, manifest)
+        for packed_path, entries in packed.items():
+            plan_pack_push(plan, packs[packed_path],
+                pack_members(container, packed_path, entries, manifest), force, ignore)
+        for packed_path in sorted(packs or ()):
+            if packs[packed_path]['threshold'] is None:
+                plan_pack_removal(plan, packs[packed_path], manifest)
+    return plan
+
+def changed_on_drive(manifest, relpath, efile):
+    """Returns True if the Drive file efile was modified since the manifest
+    last recorded the checksum of the file at the given relative path.
+    The check uses the md5Checksum in the snapshot, so it costs no requests.
+    """
+    if manifest is None:
+        return False
+    entry = manifest.get(relpath)
+    return bool(entry and entry['remote_md5'] and entry['remote_md5'] != efile.get('md5Checksum'))
+
+def local_signature(container, local, prefix, wanted, manifest = None):
+    """Returns the set of (path, size, md5) tuples of the files beneath the
+    local folder at the relative path prefix, with paths relative to that
+    folder. Only the files whose (path, size) pair is in wanted are hashed
+    and returned, as no other file can match a Drive file.
+    """
+    start = len(prefix) + 1
+    signature = set()
+    for entry in local.walk(prefix):
+        if entry.is_dir or (entry.path[start:], entry.st_size) not in wanted:
+            continue
+        if manifest is not None:
+            checksum = manifest.checksum(entry.path, entry)
+        else:
+            checksum = get_md5_checksum(container + entry.path)
+        signature.add((entry.path[start:], entry.st_size, checksum))
+    return signature
+
+def remote_signature(tree, folder_id):
+    """Returns the set of (path, size, md5) tuples of the files beneath the
+    given Drive folder, with paths relative to that folder
+    """
+    return set((relpath, int(file.get('size') or 0), file.get('md5Checksum'))
+        for relpath, file in tree.walk(folder_id, '') if file['mimeType'] != FOLDER_MIME)
+
+def detect_push_moves(container, tree, plan, local, manifest = None, checksum = False,
+    after_time = None, force = False):
+    """Turns the uploads and deletions of a push plan that amount to a file or
+    folder being renamed or moved locally into moves of the existing Drive
+    files, so their contents aren't uploaded again and they keep their IDs
+    and revision history.
+    A new folder is matched with a deleted Drive folder when at least half
+    of the Drive folder's files are found at the same paths with the same
+    sizes and md5 checksums. The new folder's contents are then compared by
+    checksum with the moved folder, as their modification times say nothing
+    about the files on Drive. A new file is matched with a deleted Drive file
+    of the same size and md5 checksum.
+    """
+    # Deleted Drive folders, including those beneath other deleted folders
+    deleted_folders = []
+    for delete in plan.deletes:
+        if delete['folder']:
+            deleted_folders.append((delete['path'], delete['file']))
+            deleted_folders += [ x for x in tree.walk(delete['file']['id'], delete['path'])
+                if x[1]['mimeType'] == FOLDER_MIME ]
+
+    new_paths = set(x['path'] for x in plan.folders)
+    new_roots = [ x for x in plan.folders if x['parent'] not in new_paths ]
+    if deleted_folders and new_roots:
+        candidates = []
+        signatures = [ (path, folder, remote_signature(tree, folder['id']))
+            for path, folder in deleted_folders ]
+        wanted = set(x[:2] for _, _, remote in signatures for x in remote)
+        for new in new_roots:
+            signature = local_signature(container, local, new['path'], wanted, manifest)
+            for path, folder, remote in signatures:
+                common = len(signature & remote)
+                if common and common * 2 >= len(remote):
+                    candidates.append((common, new, path, folder))
+
+        moved = []
+        for common, new, path, folder in sorted(candidates, key = lambda x: -x[0]):
+            if any(new is x[0] or path == x[1] or is_inside(path, [x[1]]) or is_inside(x[1], [path])
+                for x in moved):
+                continue
+            moved.append((new, path, folder))
+
+        roots = set(x[0]['path'] for x in moved)
+        moved_paths = set(x[1] for x in moved)
+        plan.folders = [ x for x in plan.folders if x['path'] not in roots and
+            not is_inside(x['path'], roots) ]
+        plan.uploads = [ x for x in plan.uploads if not is_inside(x['path'], roots) ]
+        plan.deletes = [ x for x in plan.deletes if x['path'] not in moved_paths ]
+        for new, path, folder in moved:
+            plan.moves.append({ 'from': path, 'to': new['path'], 'name': new['name'],
+                'parent': new['parent'], 'file': folder, 'old_parent': tree.parents.get(folder['id']),
+                'folder': True })
+            plan.folder_ids[new['path']] = folder['id']
+            plan.records.append(('folder', folder['id'], new['path']))
+            plan_push(container, tree, folder['id'], manifest, True, after_time, force, plan,
+                new['path'], local)
+
+    # Deleted Drive files, leaving out those inside folders being moved
+    moved_ids = set(x['file']['id'] for x in plan.moves)
+    deleted_files = {}
+    for delete in plan.deletes:
+        if delete['folder']:
+            files = list(walk_unmoved(tree, delete['file']['id'], delete['path'], moved_ids))
+        else:
+            files = [ (delete['path'], delete['file']) ]
+        for path, file in files:
+            if file['mimeType'] != FOLDER_MIME and file.get('md5Checksum'):
+                deleted_files.setdefault(int(file.get('size') or 0), []).append((path, file))
+    if not deleted_files:
+        return
+
+    moved = set()
+    for upload in plan.uploads:
+        if upload['file_id'] or upload['size'] not in deleted_files:
+            continue
+        if manifest is not None:
+            lmd5 = manifest.checksum(upload['path'], local.get(upload['path']))
+        else:
+            lmd5 = get_md5_checksum(container + upload['path'])
+        matches = [ x for x in deleted_files[upload['size']] if x[1]['md5Checksum'] == lmd5 ]
+        if not matches:
+            continue
+        # Prefer a file with the same name
+        path, file = sorted(matches, key = lambda x: x[1]['name'] != upload['name'])[0]
+        deleted_files[upload['size']].remove((path, file))
+        moved.add(upload['path'])
+        plan.moves.append({ 'from': path, 'to': upload['path'], 'name': upload['name'],
+            'parent': upload['parent'], 'file': file, 'old_parent': tree.parents.get(file['id']),
+            'folder': False })
+        plan.records.append(('file', upload['path'], file['id'], lmd5))
+
+    moved_from = set(x['from'] for x in plan.moves)
+    plan.uploads = [ x for x in plan.uploads if x['path'] not in moved ]
+    plan.deletes = [ x for x in plan.deletes if x['path'] not in moved_from ]
+
+def detect_copies(container, tree, plan, local, manifest = None):
+    """Turns the uploads of new files in a push plan whose contents are
+    already on Drive into server-side copies, so the bytes aren't sent again.
+    Drive files are indexed by md5 checksum. A new file matching a file in
+    the snapshot is copied from it, and a new file matching another new file
+    of the plan is copied once that file has been uploaded. Only new files
+    with the same size as another file are hashed.
+    """
+    remote = {}
+    sizes = set()
+    for file in tree.by_id.values():
+        if file['mimeType'] != FOLDER_MIME and file.get('md5Checksum'):
+            remote.setdefault(file['md5Checksum'], file)
+            sizes.add(int(file.get('size') or 0))
+
+    new = [ x for x in plan.uploads if not x['file_id'] and x['size'] > 0 ]
+    new_sizes = {}
+    for upload in new:
+        new_sizes[upload['size']] = new_sizes.get(upload['size'], 0) + 1
+
+    uploaded = {}
+    copied = set()
+    for upload in new:
+        if upload['size'] not in sizes and new_sizes[upload['size']] < 2:
+            continue
+        if manifest is not None:
+            lmd5 = manifest.checksum(upload['path'], local.get(upload['path']))
+        else:
+            lmd5 = get_md5_checksum(container + upload['path'])
+        copy = { 'path': upload['path'], 'name': upload['name'], 'parent': upload['parent'],
+            'size': upload['size'], 'checksum': lmd5, 'source': remote.get(lmd5),
+            'source_path': None }
+        if copy['source'] is None:
+            if lmd5 not in uploaded or manifest is None:
+                # The first copy is uploaded, later ones are copied from it
+                uploaded[lmd5] = upload['path']
+                continue
+            copy['source_path'] = uploaded[lmd5]
+        copied.add(upload['path'])
+        plan.copies.append(copy)
+    plan.uploads = [ x for x in plan.uploads if x['path'] not in copied ]
+
+def walk_unmoved(tree, folder_id, prefix, moved_ids):
+    """Yields the (relative path, file) tuples of RemoteTree.walk, skipping
+    the folders with IDs in moved_ids and everything beneath them
+    """
+    for file in tree.children.get(folder_id, {}).values():
+        if file['id'] in moved_ids:
+            continue
+        relpath = join_path(prefix, file['name'])
+        yield relpath, file
+        if file['mimeType'] == FOLDER_MIME:
+            yield from walk_unmoved(tree, file['id'], relpath, moved_ids)
+
+def plan_paths(container, paths, manifest, root_id, moves = (), ignore = None, packs = None):
+    """Returns a SyncPlan pushing only the given relative paths, as reported
+    changed by a file watcher, to the Drive folder root_id. The manifest is
+    used in place of a snapshot of Drive, so nothing is listed and the rest
+    of the local tree isn't scanned.
+    Paths that no longer exist are deleted from Drive, new files are uploaded
+    along with any folders they need, and files whose contents differ from
+    the copy on Drive are updated. New folders are scanned to find what was
+    put in them. moves lists (old, new) pairs of paths renamed locally, which
+    are moved on Drive when the old path is in the manifest and uploaded as
+    new paths otherwise.
+    packs is the dict returned by load_packs of the packed folders the paths
+    are in. Their small files are repacked rather than uploaded.
+    """
+    container = to_path(container)
+    plan = SyncPlan('push', root_id)
+    thresholds = { x: y['threshold'] for x, y in (packs or {}).items() }
+    paths = set(paths)
+    created = set()
+    scanned = set()
+    handled = set()
+    # Old paths of the folders moved by the plan, by new path
+    renamed = {}
+
+    def is_ignored(relpath, is_dir):
+        if any(is_repo_file(x) for x in relpath.split('/')):
+            return True
+        return ignore is not None and ignore.match_path(relpath, is_dir)
+
+    def original(relpath):
+        # Path in the manifest of something that may be in a moved folder
+        for new, old in renamed.items():
+            if relpath == new or relpath.startswith(new + '/'):
+                return old + relpath[len(new):]
+        return relpath
+
+    def folder_id(relpath):
+        if relpath not in plan.folder_ids:
+            found = manifest.folder_id(original(relpath))
+            if found is None:
+                return None
+            plan.folder_ids[relpath] = found
+        return plan.folder_ids[relpath]
+
+    def add_folder(relpath):
+        # Create the folder, and any folders above it missing from Drive
+        if relpath in created or folder_id(relpath) is not None:
+            return
+        parent, _, name = relpath.rpartition('/')
+        add_folder(parent)
+        created.add(relpath)
+        plan.folders.append({ 'path': relpath, 'name': name, 'parent': parent })
+
+    def add_upload(relpath, stat, entry = None):
+        if entry and manifest.get_export(entry['path']):
+            # Exported from a Google Docs file, which can't be replaced
+            return
+        if is_packed(relpath, stat.st_size, thresholds):
+            if entry and entry['file_id']:
+                # Small enough to be packed now
+                plan.deletes.append({ 'path': relpath, 'file': { 'id': entry['file_id'] },
+                    'folder': False })
+            return
+        parent, _, name = relpath.rpartition('/')
+        upload = { 'path': relpath, 'name': name, 'parent': parent, 'file_id': None,
+            'size': stat.st_size, 'checksum': None }
+        if entry and entry['file_id']:
+            lmd5 = manifest.checksum(relpath, stat)
+            if lmd5 == entry['remote_md5']:
+                # Rewritten with the same contents, or just pulled
+                return
+            upload.update(file_id = entry['file_id'], checksum = lmd5)
+        else:
+            add_folder(parent)
+        plan.uploads.append(upload)
+
+    for old, new in moves:
+        source = original(old)
+        entry = manifest.get(source)
+        source_id = entry['file_id'] if entry else manifest.folder_id(source)
+        source_parent = source.rpartition('/')[0]
+        old_parent = manifest.folder_id(source_parent) if source_parent else root_id
+        try:
+            stat = os.stat(container + new)
+        except FileNotFoundError:
+            stat = None
+        if source_id is None or old_parent is None or stat is None or\
+            is_ignored(new, os.path.isdir(container + new)):
+            paths.update((old, new))
+            continue
+        is_folder = entry is None
+        parent, _, name = new.rpartition('/')
+        add_folder(parent)
+        plan.moves.append({ 'from': old, 'to': new, 'name': name, 'parent': parent,
+            'file': { 'id': source_id }, 'old_parent': old_parent, 'folder': is_folder })
+        handled.update((old, new))
+        if is_folder:
+            renamed[new] = source
+        elif (stat.st_size, stat.st_mtime_ns, stat.st_ino) !=\
+            (entry['size'], entry['mtime_ns'], entry['inode']):
+            # Changed as well as moved, upload the new contents over the moved file
+            add_upload(new, stat, entry)
+
+    deleted = set()
+    for relpath in sorted(paths - handled):
+        if is_inside(relpath, deleted) or is_inside(relpath, scanned):
+            continue
+        try:
+            stat = os.stat(container + relpath)
+        except FileNotFoundError:
+            entry = manifest.get(original(relpath))
+            if entry and manifest.get_export(entry['path']):
+                continue
+            if entry and entry['file_id']:
+                plan.deletes.append({ 'path': relpath, 'file': { 'id': entry['file_id'] },
+                    'folder': False })
+            elif relpath and folder_id(relpath) is not None:
+                plan.deletes.append({ 'path': relpath, 'file': { 'id': folder_id(relpath) },
+                    'folder': True })
+                deleted.add(relpath)
+            continue
+
+        if os.path.isdir(container + relpath):
+            if is_ignored(relpath, True) or folder_id(relpath) is not None:
+                continue
+            if packed_folder(relpath, thresholds) is None:
+                add_folder(relpath)
+            scanned.add(relpath)
+            for entry in scan_tree(container, relpath, ignore).walk(relpath):
+                if entry.path in handled or is_inside(entry.path, handled):
+                    continue
+                if entry.is_dir:
+                    if packed_folder(entry.path, thresholds) is None:
+                        add_folder(entry.path)
+                else:
+                    add_upload(entry.path, entry)
+        elif os.path.isfile(container + relpath) and not is_ignored(relpath, False):
+            add_upload(relpath, stat, manifest.get(original(relpath)))
+
+    changed = paths | set(x for move in moves for x in move)
+    for packed in (packs or {}).values():
+        members = changed_members(container, packed, changed, manifest, ignore)
+        if members is None:
+            local = scan_tree(container, packed['path'], ignore)
+            entries = split_packed(local, { packed['path']: packed['threshold'] })[packed['path']]
+            members = pack_members(container, packed['path'], entries, manifest)
+        add_folder(packed['path'])
+        plan_pack_push(plan, packed, members, force = True, ignore = ignore)
+    return plan
+
+def journal_marker(journal, kind, path):
+    """Returns a callback recording the operation of the given kind on path
+    as done in the journal, or None if there's no journal
+    """
+    if journal is None:
+        return None
+    return lambda: journal.done(kind, path)
+
+def execute_push(service, container, plan, manifest = None, pool = None, journal = None):
+    """Runs a push plan. Folder creations, moves and deletions are sent in
+    batch requests, in that order, so moved files reach their new folders
+    before their old ones are deleted. Folders are created a level at a time
+    so parents exist before their children, and uploads are scheduled on the
+    transfer pool once the folder they go into exists.
+    Each operation is recorded in the Journal journal, if given, as soon as
+    it's done, so an interrupted push can be resumed.
+    """
+    container = to_path(container)
+    def done(kind, path, result = None):
+        if journal is not None:
+            journal.done(kind, path, result)
+
+    # Create folders that don't exist on Drive yet
+    levels = {}
+    for folder in plan.folders:
+        levels.setdefault(folder['path'].count('/'), []).append(folder)
+    for depth in sorted(levels):
+        level = [ x for x in levels[depth] if x['parent'] in plan.folder_ids ]
+        requests = []
+        for folder in level:
+            body = {
+                'name': folder['name'],
+                'parents': [plan.folder_ids[folder['parent']]],
+                'mimeType': FOLDER_MIME
+            }
+            requests.append(service.files().create(body = body, fields = 'id'))
+        for folder, (result, error) in zip(level, batch_execute(service, requests)):
+            if error:
+                print(f"Failed to create folder {folder['path']}: {error}")
+                continue
+            plan.folder_ids[folder['path']] = result['id']
+            if manifest is not None:
+                manifest.set_folder(result['id'], folder['path'])
+            done('folder', folder['path'], result['id'])
+
+    # Move files that were renamed or moved locally, before their old
+    # folders are deleted
+    moves = [ x for x in plan.moves if x['parent'] in plan.folder_ids ]
+    requests = []
+    for move in moves:
+        parent_id = plan.folder_ids[move['parent']]
+        if parent_id == move['old_parent']:
+            requests.append(service.files().update(fileId = move['file']['id'],
+                body = { 'name': move['name'] }, fields = 'id'))
+        else:
+            requests.append(service.files().update(fileId = move['file']['id'],
+                body = { 'name': move['name'] }, addParents = parent_id,
+                removeParents = move['old_parent'], fields = 'id'))
+    for move, (_, error) in zip(moves, batch_execute(service, requests)):
+        if error:
+            print(f"Failed to move {move['from']} to {move['to']}: {error}")
+            continue
+        print(f"Moving {move['from']} to {move['to']}...")
+        if manifest is not None:
+            manifest.move(move['from'], move['to'])
+        done('move', move['to'])
+
+    # Pack small files, before the Drive files they replace are deleted
+    execute_pack_push(service, container, plan, manifest, pool, journal)
+
+    # Copy files whose contents are already on Drive, before their source
+    # may be deleted
+    copy_files(service, [ x for x in plan.copies if x['source'] ], plan, manifest, journal)
+
+    # Delete out-dated files on Google Drive
+    requests = [ service.files().delete(fileId = delete['file']['id']) for delete in plan.deletes ]
+    for delete, (_, error) in zip(plan.deletes, batch_execute(service, requests)):
+        if error:
+            print(f"Failed to delete {delete['path']}: {error}")
+            continue
+        if manifest is not None:
+            manifest.forget(delete['path'])
+        done('delete', delete['path'])
+
+    record_plan(plan, manifest)
+
+    # Upload files
+    for upload in plan.uploads:
+        file_path = container + upload['path']
+        if upload['file_id']:
+            print(f"Updating {upload['path']}...")
+            schedule_upload(service, pool, file_path, manifest, upload['path'],
+                file_id = upload['file_id'], checksum = upload['checksum'],
+                on_recorded = journal_marker(journal, 'upload', upload['path']))
+            continue
+        parent_id = plan.folder_ids.get(upload['parent'])
+        if parent_id is None:
+            # Parent folder couldn't be created, the error was reported above
+            continue
+        print(f"Uploading new file {upload['path']}...")
+        body = {
+            'name': upload['name'],
+            'parents': [parent_id]
+        }
+        schedule_upload(service, pool, file_path, manifest, upload['path'], body = body,
+            checksum = upload['checksum'],
+            on_recorded = journal_marker(journal, 'upload', upload['path']))
+
+    # Copy files from files uploaded above once they're on Drive
+    copies = [ x for x in plan.copies if x['source_path'] ]
+    if copies:
+        if pool is not None:
+            pool.wait()
+        for copy in copies:
+            entry = manifest.get(copy['source_path'])
+            copy['source'] = { 'id': entry['file_id'] } if entry and entry['file_id'] else None
+        copy_files(service, copies, plan, manifest, journal)
+
+    if plan.copies:
+        copied = [ x for x in plan.copies if x.get('copied') ]
+        print(f"Copied {len(copied)} file(s) on Drive instead of uploading " +
+            f"{format_size(sum(x['size'] for x in copied))}.")
+
+    # Remove the packs of folders no longer packed once their files are up
+    execute_pack_removal(service, plan, manifest, pool, journal)
+
+def copy_files(service, copies, plan, manifest = None, journal = None):
+    """Creates the given files of a push plan as server-side copies of their
+    source Drive file, in batch requests. Files that can't be copied are
+    reported and left for the next push.
+    """
+    copies = [ x for x in copies if x['source'] and plan.folder_ids.get(x['parent']) ]
+    requests = []
+    for copy in copies:
+        body = {
+            'name': copy['name'],
+            'parents': [plan.folder_ids[copy['parent']]]
+        }
+        requests.append(service.files().copy(fileId = copy['source']['id'], body = body,
+            fields = 'id, md5Checksum'))
+    for copy, (result, error) in zip(copies, batch_execute(service, requests)):
+        if error:
+            print(f"Failed to copy {copy['path']}: {error}")
+            continue
+        copy['copied'] = True
+        if manifest is not None:
+            manifest.set_file(copy['path'], result['id'], result.get('md5Checksum', copy['checksum']))
+        if journal is not None:
+            journal.done('copy', copy['path'])
+
+def record_plan(plan, manifest):
+    """Record the Drive IDs found while planning in the manifest
+    """
+    if manifest is None:
+        return
+    for record in plan.records:
+        if record[0] == 'folder':
+            manifest.set_folder(record[1], record[2])
+        else:
+            manifest.set_file(record[1], record[2], record[3])
+
+def is_up_to_date(container, relpath, file, manifest = None, local_path = None, stat = None):
+    """Returns True if the local file at relpath has the same contents as the
+    given Drive file. local_path can be given to check a file that hasn't
+    been moved to relpath yet, and stat to reuse a stat result of the file.
+    """
+    local_path = local_path or relpath
+    if stat is None:
+        if not os.path.isfile(container + local_path):
+            return False
+        stat = os.stat(container + local_path)
+    if file.get('size') is not None and stat.st_size != int(file['size']):
+        # Different sizes, no need to hash the file
+        return False
+    if manifest is not None:
+        emd5 = manifest.checksum(local_path, stat)
+    else:
+        emd5 = get_md5_checksum(container + local_path)
+    return emd5 == file['md5Checksum']
+
+def plan_pull(container, tree, folder_id, manifest = None, plan = None, prefix = '', local = None,
+    ignore = None, exports = None, packs = None):
+    """Returns a SyncPlan pulling the Drive folder folder_id, as described by
+    the RemoteTree snapshot tree, into the container folder.
+    Local files that are missing from Drive are planned for deletion, and
+    files whose contents differ from Drive are downloaded. Local folders
+    missing from Drive are deleted along with the entries of local beneath
+    them, and only once they're empty.
+    local is the LocalTree snapshot of the container folder, which is scanned
+    if not supplied, leaving out files matched by the IgnoreRules ignore so
+    they're never deleted.
+    Google Docs files are exported in the formats given by the exports dict,
+    unless the manifest shows the same version was exported already.
+    packs is the dict of packed folders returned by load_packs. The packs
+    holding small files that differ locally are unpacked.
+    """
+    container = to_path(container)
+    top = plan is None
+    if top:
+        plan = SyncPlan('pull', folder_id, exports)
+    packed = {}
+    if local is None:
+        local = scan_tree(container, prefix, ignore)
+        if packs:
+            packed = split_packed(local, { x: y['index']['threshold'] for x, y in packs.items()
+                if y['index'] is not None })
+        if manifest is not None:
+            hash_tree(container, local, manifest)
+
+    files = tree.get_files(folder_id) + tree.get_folders(folder_id)
+    names = set(local_name(x, plan.exports) for x in files)
+    for entry in sorted(local.children.get(prefix, []), key = lambda x: x.name):
+        if entry.name not in names:
+            if entry.is_dir:
+                plan.deletes += [ { 'path': x.path, 'folder': x.is_dir }
+                    for x in local.walk(entry.path) ]
+            plan.deletes.append({ 'path': entry.path, 'folder': entry.is_dir })
+
+    for file in files:
+        name = local_name(file, plan.exports)
+        if name is None or is_repo_file(name):
+            continue
+        relpath = join_path(prefix, name)
+        entry = local.get(relpath)
+        if(file['mimeType'] == FOLDER_MIME):
+            plan.folder_ids[relpath] = file['id']
+            plan.records.append(('folder', file['id'], relpath))
+            if entry is None or not entry.is_dir:
+                plan.folders.append({ 'path': relpath, 'name': file['name'], 'parent': prefix })
+            plan_pull(container, tree, file['id'], manifest, plan, relpath, local)
+        elif is_google_doc(file):
+            plan.records.append(('file', relpath, file['id'], None))
+            if entry is None or entry.is_dir or not is_export_current(relpath, file, plan, manifest):
+                plan_download(plan, relpath, file)
+        else:
+            plan.records.append(('file', relpath, file['id'], file['md5Checksum']))
+            if entry is None or entry.is_dir or\
+                not is_up_to_date(container, relpath, file, manifest, stat = entry):
+                plan_download(plan, relpath, file)
+
+    if top:
+        detect_pull_moves(container, plan, local, manifest)
+        for packed_path, entries in packed.items():
+            plan_pack_pull(container, plan, manifest, packs[packed_path], entries, ignore)
+        order_deletes(plan)
+    return plan
+
+def order_deletes(plan):
+    """Removes duplicate deletions from a pull plan, along with deletions of
+    paths it moves elsewhere, and orders the rest so the contents of a folder
+    are deleted before the folder itself
+    """
+    moved_from = set(x['from'] for x in plan.moves)
+    deletes = { x['path']: x for x in plan.deletes
+        if x['path'] not in moved_from and not is_inside(x['path'], moved_from) }
+    plan.deletes = sorted(deletes.values(), key = lambda x: x['path'], reverse = True)
+
+def is_export_current(relpath, file, plan, manifest = None):
+    """Returns True if the manifest shows the local file at relpath was
+    exported from the current version of the given Google Docs file, in the
+    format the plan exports it in
+    """
+    export = manifest.get_export(relpath) if manifest is not None else None
+    return export is not None and export['file_id'] == file['id'] and\
+        export['version'] == int(file.get('version') or 0) and\
+        export['format'] == export_format(file, plan.exports)
+
+def plan_download(plan, relpath, file):
+    """Add the download of a Drive file to relpath to a pull plan, exporting
+    it if it's a Google Docs file
+    """
+    download = { 'path': relpath, 'file': file }
+    if is_google_doc(file):
+        download['export'] = export_format(file, plan.exports)
+    plan.downloads.append(download)
+
+def detect_pull_moves(container, plan, local, manifest = None):
+    """Turns the downloads and deletions of a pull plan that amount to a file
+    being renamed or moved on Drive into local moves, so its contents aren't
+    downloaded again. A new Drive file is matched with a local file that
+    would be deleted if it has the same size and md5 checksum.
+    Folders moved on Drive are normally picked up from the changes feed, so
+    only files are matched here.
+    """
+    deleted_files = {}
+    for delete in plan.deletes:
+        entry = local.get(delete['path'])
+        if entry is not None and not entry.is_dir:
+            deleted_files.setdefault(entry.st_size, []).append(entry)
+    if not deleted_files:
+        return
+
+    moved = set()
+    for download in plan.downloads:
+        file = download['file']
+        size = int(file.get('size') or 0)
+        if local.get(download['path']) is not None or size not in deleted_files or\
+            download.get('export'):
+            continue
+        matches = []
+        for entry in deleted_files[size]:
+            if manifest is not None:
+                emd5 = manifest.checksum(entry.path, entry)
+            else:
+                emd5 = get_md5_checksum(container + entry.path)
+            if emd5 == file['md5Checksum']:
+                matches.append(entry)
+        if not matches:
+            continue
+        # Prefer a file with the same name
+        entry = sorted(matches, key = lambda x: x.name != file['name'])[0]
+        deleted_files[size].remove(entry)
+        moved.add(download['path'])
+        plan.moves.append({ 'from': entry.path, 'to': download['path'], 'folder': False })
+
+    moved_from = set(x['from'] for x in plan.moves)
+    plan.downloads = [ x for x in plan.downloads if x['path'] not in moved ]
+    plan.deletes = [ x for x in plan.deletes if x['path'] not in moved_from ]
+
+def plan_changes(service, container, changes, manifest, ignore = None, exports = None,
+    packs = None):
+    """Returns a SyncPlan applying the changes returned by get_changes to the
+    repository in the container folder, using the manifest to locate files
+    inside the repository. Only files that were added, modified, moved or
+    trashed are included. Folders that were created or moved into the
+    repository are listed in full, as their contents don't show up as changes.
+    Changes to paths matched by the IgnoreRules ignore are skipped, and
+    ignored local files are never deleted. Google Docs files are exported as
+    described by the exports dict. The packed folders in the dict returned by
+    load_packs are checked when their index changed or something in them was
+    moved or deleted.
+    """
+    container = to_path(container)
+    plan = SyncPlan('pull', exports = exports)
+    latest = {}
+    for change in changes:
+        latest[change['fileId']] = change
+
+    # New paths of the folders changed in this batch, by ID
+    folder_paths = {}
+    folder_moves = []
+
+    def moved_path(path):
+        # Returns where a path recorded in the manifest ends up once the
+        # planned folder moves have been made
+        for move in folder_moves:
+            if path == move['from'] or path.startswith(move['from'] + '/'):
+                path = move['to'] + path[len(move['from']):]
+        return path
+
+    def folder_path(folder_id):
+        if folder_id in folder_paths:
+            return folder_paths[folder_id]
+        path = manifest.folder_path(folder_id)
+        return moved_path(path) if path is not None else None
+
+    def is_ignored(relpath, is_dir):
+        return ignore is not None and ignore.match_path(relpath, is_dir)
+
+    def remote_path(change):
+        # Returns the new relative path of a changed file, or None if the file
+        # is no longer inside the repository or is ignored
+        file = change.get('file')
+        if change.get('removed') or not file or file.get('trashed'):
+            return None
+        name = local_name(file, plan.exports)
+        if name is None:
+            return None
+        for parent in file.get('parents', []):
+            parent_path = folder_path(parent)
+            if parent_path is not None:
+                relpath = join_path(parent_path, name)
+                if is_ignored(relpath, file['mimeType'] == FOLDER_MIME):
+                    return None
+                return relpath
+        return None
+
+    def is_current(relpath, file, local_path = None):
+        # Returns True if the local copy of a changed file is up-to-date
+        if is_google_doc(file):
+            return os.path.isfile(container + (local_path or relpath)) and\
+                is_export_current(local_path or relpath, file, plan, manifest)
+        return is_up_to_date(container, relpath, file, manifest, local_path)
+
+    def plan_delete(old_path):
+        is_dir = os.path.isdir(container + old_path) and not os.path.islink(container + old_path)
+        if is_ignored(old_path, is_dir):
+            return
+        if is_dir:
+            # Only the entries that aren't ignored are deleted, so ignored
+            # files are kept along with the folders holding them
+            plan.deletes += [ { 'path': moved_path(x.path), 'folder': x.is_dir }
+                for x in scan_tree(container, old_path, ignore).walk(old_path) ]
+        if os.path.lexists(container + old_path):
+            plan.deletes.append({ 'path': moved_path(old_path), 'folder': is_dir })
+
+    # Resolve folders first, parents before children, so files can be placed
+    # inside folders that were created or moved in the same batch of changes
+    folders = [ c for c in latest.values() if c.get('file') and
+        c['file']['mimeType'] == FOLDER_MIME ]
+    to_walk = []
+    walk_roots = set()
+    progress = True
+    while progress:
+        progress = False
+        unresolved = []
+        for change in folders:
+            relpath = remote_path(change)
+            if relpath is None:
+                unresolved.append(change)
+                continue
+            progress = True
+            old_path = manifest.folder_path(change['fileId'])
+            if old_path is None or not os.path.isdir(container + old_path):
+                # Folder created or moved in from outside the repository, its
+                # contents won't show up as changes so walk it in full
+                if not is_inside(relpath, walk_roots):
+                    to_walk.append((change['fileId'], relpath))
+                    walk_roots.add(relpath)
+            elif moved_path(old_path) != relpath:
+                move = { 'from': moved_path(old_path), 'to': relpath, 'folder': True }
+                plan.moves.append(move)
+                folder_moves.append(move)
+            folder_paths[change['fileId']] = relpath
+            plan.records.append(('folder', change['fileId'], relpath))
+        folders = unresolved
+
+    # Anything left over was trashed, removed or moved out of the repository
+    removed = [ c['fileId'] for c in folders ] +\
+        [ c['fileId'] for c in latest.values() if not c.get('file') ]
+    for file_id in removed:
+        old_path = manifest.folder_path(file_id)
+        if old_path is not None:
+            plan_delete(old_path)
+
+    for change in latest.values():
+        file = change.get('file')
+        if file and file['mimeType'] == FOLDER_MIME:
+            continue
+        relpath = remote_path(change)
+        old_path = manifest.file_path(change['fileId'])
+        if relpath is None:
+            if old_path is not None:
+                plan_delete(old_path)
+            continue
+        if is_inside(relpath, walk_roots) or is_repo_file(os.path.basename(relpath)):
+            continue
+        plan.records.append(('file', relpath, file['id'], file.get('md5Checksum')))
+        if old_path is not None and moved_path(old_path) != relpath and\
+            os.path.isfile(container + old_path):
+            # Moved or renamed on Drive, move the local copy instead of
+            # downloading it again
+            plan.moves.append({ 'from': moved_path(old_path), 'to': relpath, 'folder': False })
+            if not is_current(relpath, file, old_path):
+                plan_download(plan, relpath, file)
+        elif not is_current(relpath, file):
+            plan_download(plan, relpath, file)
+
+    for folder_id, relpath in to_walk:
+        tree = get_remote_tree(service, folder_id, ignore = ignore, prefix = relpath)
+        if tree.missing:
+            continue
+        if not os.path.isdir(container + relpath):
+            plan.folders.append({ 'path': relpath, 'name': os.path.basename(relpath),
+                'parent': os.path.dirname(relpath) })
+        plan_pull(container, tree, folder_id, manifest, plan, relpath, ignore = ignore)
+
+    changed = [ x['path'] for x in plan.deletes ] + [ x['from'] for x in plan.moves ]
+    for packed in (packs or {}).values():
+        if packed['index'] is None:
+            continue
+        folder = packed['path']
+        touched = any(x == folder or packed_folder(x, { folder: None }) is not None or
+            folder.startswith(x + '/') for x in changed)
+        if packed['index_md5'] == packed['synced'] and not touched:
+            continue
+        local = scan_tree(container, packed['path'], ignore)
+        entries = split_packed(local, { packed['path']: packed['index']['threshold'] })
+        plan_pack_pull(container, plan, manifest, packed, entries[packed['path']], ignore)
+    order_deletes(plan)
+    return plan
+
+def discard_partial_downloads(container, plan, manifest):
+    """Removes the partial downloads left by earlier pulls that the pull plan
+    doesn't continue, as the Drive file they belong to was deleted, changed
+    or moved since
+    """
+    container = to_path(container)
+    downloads = { x['path']: x['file'] for x in plan.downloads }
+    for partial in manifest.get_downloads():
+        file = downloads.get(partial['path'])
+        if file is not None and file['id'] == partial['file_id'] and\
+            file.get('md5Checksum') == partial['md5']:
+            continue
+        path = partial_path(container + partial['path'], partial['file_id'])
+        if os.path.isfile(path):
+            os.remove(path)
+        manifest.clear_download(partial['path'])
+
+def execute_pull(service, container, plan, manifest = None, pool = None, journal = None):
+    """Runs a pull plan. Local moves and deletions are made first, then local
+    folders are created and downloads are scheduled on the transfer pool.
+    Each operation is recorded in the Journal journal, if given, as soon as
+    it's done, so an interrupted pull can be resumed.
+    """
+    container = to_path(container)
+    def done(kind, path):
+        if journal is not None:
+            journal.done(kind, path)
+
+    for move in plan.moves:
+        source = container + move['from']
+        destination = container + move['to']
+        if os.path.lexists(source):
+            print(f"Moving '{move['from']}' to '{move['to']}'...")
+            safe_create_folder(os.path.dirname(destination))
+            if move['folder']:
+                os.rename(source, destination)
+            else:
+                os.replace(source, destination)
+        if manifest is not None:
+            manifest.move(move['from'], move['to'])
+        done('move', move['to'])
+
+    # Delete files that didn't exist on the Google Drive. Folders come after
+    # their contents, and are kept if anything the plan left out, such as an
+    # ignored file, is still inside
+    for delete in plan.deletes:
+        path = container + delete['path']
+        if os.path.isdir(path) and not os.path.islink(path):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        elif os.path.lexists(path):
+            # Delete the file
+            os.remove(path)
+        if manifest is not None:
+            manifest.forget(delete['path'])
+        done('delete', delete['path'])
+
+    for folder in plan.folders:
+        safe_create_folder(container + folder['path'])
+        done('folder', folder['path'])
+
+    record_plan(plan, manifest)
+
+    # Download files from Drive
+    for download in plan.downloads:
+        file_path = container + download['path']
+        if download.get('export'):
+            print(f"Exporting '{download['file']['name']}' as {download['export']} into " +
+                f"{os.path.dirname(file_path)}...")
+            schedule_export(service, pool, download['file'], file_path, download['export'],
+                manifest, download['path'],
+                on_recorded = journal_marker(journal, 'download', download['path']))
+            continue
+        print(f"Pulling file '{download['file']['name']}' into {os.path.dirname(file_path)}...")
+        schedule_download(service, pool, download['file'], file_path, manifest, download['path'],
+            on_recorded = journal_marker(journal, 'download', download['path']))
+
+    # Download and unpack the packs of small files that changed
+    execute_pack_pull(service, container, plan, manifest, pool, journal)
@@ -0,0 +1,135 @@
+import copy
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class TransferPool:
+    """Bounded pool of workers used to upload and download files in parallel.
+
+    Transfers are submitted from the thread walking the repository and run on
+    up to `jobs` worker threads. Each worker builds its own HTTP transport
+    with http_factory, as httplib2.Http objects can't be shared between
+    threads. With a single job, transfers run immediately on the calling
+    thread using the service's own transport.
+
+    Completion callbacks are always run on the submitting thread, in the
+    order the transfers were submitted, so output and manifest updates stay
+    deterministic. Failed transfers are collected and reported by report()
+    rather than aborting the sync.
+
+    chunk_size sets the size of the chunks large files are uploaded in, and
+    download_chunk_size the size of each ranged request when downloading.
+
+    Several repositories can be synced at once on the same workers through
+    the pools returned by share(), each of which keeps its own pending
+    transfers and failures.
+    """
+    def __init__(self, http_factory = None, jobs = 1, chunk_size = 8 * 1024 * 1024,
+        download_chunk_size = 64 * 1024 * 1024):
+        self.http_factory = http_factory
+        self.jobs = max(1, jobs)
+        self.chunk_size = chunk_size
+        self.download_chunk_size = download_chunk_size
+        self.local = threading.local()
+        self.pending = deque()
+        self.failures = []
+        self.failed = 0
+        self.shared = False
+        if self.jobs > 1:
+            self.executor = ThreadPoolExecutor(max_workers = self.jobs)
+        else:
+            self.executor = None
+
+    def share(self):
+        """Returns a pool running its transfers on this pool's workers, with
+        its own pending transfers and failures, for use by another thread.
+        Closing it only waits for its own transfers.
+        """
+        pool = copy.copy(self)
+        pool.pending = deque()
+        pool.failures = []
+        pool.failed = 0
+        pool.shared = True
+        return pool
+
+    def is_parallel(self):
+        """Returns True if transfers run on worker threads
+        """
+        return self.executor is not None
+
+    def get_http(self):
+        """Returns the HTTP transport for the current worker thread, or None to
+        use the service's own transport.
+        """
+        if self.executor is None or self.http_factory is None:
+            return None
+        if not hasattr(self.local, 'http'):
+            self.local.http = self.http_factory()
+        return self.local.http
+
+    def run(self, function, args):
+        """Run a transfer function with the current worker's HTTP transport
+        """
+        return function(self.get_http(), *args)
+
+    def submit(self, label, function, *args, on_done = None):
+        """Schedule function(http, *args) to run on a worker.
+        label describes the transfer in failure reports. If on_done is given,
+        it is called with the function's result once the transfer succeeds.
+        """
+        if self.executor is None:
+            try:
+                result = self.run(function, args)
+            except Exception as e:
+                self.failures.append((label, e))
+                return
+            if on_done:
+                on_done(result)
+            return
+
+        # Keep the number of queued transfers bounded
+        while len(self.pending) >= self.jobs * 4:
+            self.finish_next()
+        future = self.executor.submit(self.run, function, args)
+        self.pending.append((label, future, on_done))
+
+    def finish_next(self):
+        """Wait for the oldest pending transfer and run its callback
+        """
+        label, future, on_done = self.pending.popleft()
+        try:
+            result = future.result()
+        except Exception as e:
+            self.failures.append((label, e))
+            return
+        if on_done:
+            on_done(result)
+
+    def wait(self):
+        """Wait for every pending transfer to finish
+        """
+        while self.pending:
+            self.finish_next()
+
+    def close(self):
+        """Wait for pending transfers and stop the worker threads
+        """
+        self.wait()
+        if self.executor is not None and not self.shared:
+            self.executor.shutdown()
+            self.executor = None
+
+    def report(self):
+        """Print the transfers that failed, returning True if there were none.
+        The list of failures is cleared afterwards, and their number added to
+        the failed count.
+        """
+        self.wait()
+        failures = self.failures
+        self.failures = []
+        self.failed += len(failures)
+        if failures:
+            print(f"{len(failures)} transfer(s) failed:")
+            for label, error in failures:
+                print(f" {label}: {error}")
+        return not failures
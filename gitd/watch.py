@@ -0,0 +1,242 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+from .functions import is_repo_file, join_path, to_path
+
+# inotify event flags, from <sys/inotify.h>
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |\
+    IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+    """Recursive watch of the folders beneath a root folder using Linux's
+    inotify API, called through ctypes so no extra package is needed.
+    inotify watches single folders, so a watch is added to every folder in
+    the tree, and to new folders as they appear. Watches are kept by relative
+    path so events can be reported with the relative path they happened at.
+    """
+    def __init__(self, root):
+        self.root = to_path(root)
+        library = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(library, use_errno = True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify isn't available on this system")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+        self.watches = {}
+
+    def add(self, relpath):
+        """Watch the folder at the given relative path, returning False if it
+        no longer exists
+        """
+        path = (self.root + relpath if relpath else self.root).encode()
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            if code == errno.ENOSPC:
+                raise OSError(code, "too many folders to watch, raise the " +
+                    "fs.inotify.max_user_watches limit with sysctl")
+            raise OSError(code, f"Unable to watch {relpath or self.root}: {os.strerror(code)}")
+        self.paths[wd] = relpath
+        self.watches[relpath] = wd
+        return True
+
+    def remove(self, relpath):
+        """Stop watching the folder at the given relative path and the
+        folders beneath it
+        """
+        for path in [ x for x in self.watches if x == relpath or x.startswith(relpath + '/') ]:
+            wd = self.watches.pop(path)
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def rename(self, old, new):
+        """Update the watches of a folder moved from old to new, and of the
+        folders beneath it
+        """
+        for path in [ x for x in self.watches if x == old or x.startswith(old + '/') ]:
+            wd = self.watches.pop(path)
+            self.watches[new + path[len(old):]] = wd
+            self.paths[wd] = new + path[len(old):]
+
+    def read(self, timeout):
+        """Wait up to timeout seconds for events, yielding (mask, cookie,
+        relpath) tuples. Paths are resolved as each event is yielded, so
+        folders renamed by the caller while handling earlier events are
+        reported under their new path.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors = 'surrogateescape')
+            offset += length
+            if mask & IN_IGNORED:
+                relpath = self.paths.pop(wd, None)
+                if relpath is not None and self.watches.get(relpath) == wd:
+                    del self.watches[relpath]
+                continue
+            if mask & IN_Q_OVERFLOW:
+                yield mask, cookie, None
+                continue
+            folder = self.paths.get(wd)
+            if folder is None:
+                continue
+            yield mask, cookie, join_path(folder, name) if name else folder
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    """Collects the changes made inside a local repository, as reported by
+    inotify, until they can be pushed.
+
+    Bursts of events are coalesced: each path is kept once however many
+    times it was written, and a change is only considered ready once no new
+    events arrived for `delay` seconds, or `max_delay` seconds after the
+    first pending event, so a file being written in many small steps is
+    pushed once. Renames within the repository are paired up by their
+    inotify cookie and reported as moves.
+
+    If the kernel's event queue overflows, events were lost and the whole
+    repository has to be checked; overflowed is set until the next take().
+    """
+    def __init__(self, container, ignore = None, delay = 1, max_delay = 10):
+        self.container = to_path(container)
+        self.ignore = ignore
+        self.delay = delay
+        self.max_delay = max_delay
+        self.inotify = Inotify(self.container)
+        self.paths = set()
+        self.moves = []
+        self.moved_from = {}
+        self.overflowed = False
+        self.first_event = None
+        self.last_event = None
+        self.add_tree('')
+
+    def is_ignored(self, relpath, is_dir):
+        if any(is_repo_file(x) for x in relpath.split('/')):
+            return True
+        return self.ignore is not None and self.ignore.match_path(relpath, is_dir)
+
+    def add_tree(self, relpath):
+        """Watch the folder at the given relative path and every folder
+        beneath it that isn't ignored
+        """
+        stack = [relpath]
+        while stack:
+            folder = stack.pop()
+            if not self.inotify.add(folder):
+                continue
+            try:
+                scan = os.scandir(self.container + folder if folder else self.container)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with scan:
+                for entry in scan:
+                    path = join_path(folder, entry.name)
+                    if entry.is_dir(follow_symlinks = False) and not self.is_ignored(path, True):
+                        stack.append(path)
+
+    def read(self, timeout):
+        """Wait up to timeout seconds for events and record the changes they
+        report
+        """
+        for mask, cookie, relpath in self.inotify.read(timeout):
+            now = time.monotonic()
+            if relpath is None:
+                self.overflowed = True
+            else:
+                is_dir = bool(mask & IN_ISDIR)
+                if self.is_ignored(relpath, is_dir):
+                    continue
+                if mask & IN_MOVED_FROM:
+                    self.moved_from[cookie] = (relpath, is_dir)
+                elif mask & IN_MOVED_TO and cookie in self.moved_from:
+                    self.add_move(self.moved_from.pop(cookie)[0], relpath, is_dir)
+                else:
+                    if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                        # Watch new folders, including what was put in them
+                        # before the watch was added
+                        self.add_tree(relpath)
+                    elif mask & IN_DELETE_SELF:
+                        self.inotify.remove(relpath)
+                    self.paths.add(relpath)
+            self.first_event = self.first_event or now
+            self.last_event = now
+
+    def add_move(self, old, new, is_dir):
+        if is_dir:
+            self.inotify.rename(old, new)
+            # Pending paths inside the folder now live under its new path
+            for path in [ x for x in self.paths if x.startswith(old + '/') ]:
+                self.paths.remove(path)
+                self.paths.add(new + path[len(old):])
+        for i, (source, destination) in enumerate(self.moves):
+            if destination == old:
+                # Moved again before being pushed, move from the first path
+                self.moves[i] = (source, new)
+                return
+        # The old path no longer exists, the move covers it
+        self.paths.discard(old)
+        self.moves.append((old, new))
+
+    def timeout(self):
+        """Returns how long to wait for events before the pending changes
+        are ready, or None if there are none
+        """
+        if self.first_event is None:
+            return None
+        now = time.monotonic()
+        return max(0, min(self.last_event + self.delay, self.first_event + self.max_delay) - now)
+
+    def is_ready(self):
+        """Returns True if there are pending changes and the burst of events
+        that made them is over
+        """
+        return self.first_event is not None and self.timeout() == 0
+
+    def take(self):
+        """Returns the pending changed paths and moves, and forgets them.
+        Folders moved out of the repository are reported as deleted.
+        """
+        for relpath, is_dir in self.moved_from.values():
+            if is_dir:
+                self.inotify.remove(relpath)
+            self.paths.add(relpath)
+        paths, moves = self.paths, self.moves
+        self.paths, self.moves, self.moved_from = set(), [], {}
+        self.first_event = self.last_event = None
+        self.overflowed = False
+        return paths, moves
+
+    def close(self):
+        self.inotify.close()
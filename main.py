@@ -1,12 +1,14 @@
 from __future__ import print_function
-from googleapiclient.http import MediaFileUpload
-from googleapiclient.discovery import build
-from httplib2 import Http, ServerNotFoundError
-from oauth2client import file, client, tools
 from sys import argv
+import json
 import os
+import threading
+import time
 from gitd.client import *
-from gitd.functions import to_path
+from gitd.folder_cache import FolderCache, get_cache_dir
+from gitd.functions import parse_export_formats, to_path
+from gitd.scheduler import SCHEDULER
+from gitd.stats import STATS
 
 PROGRAM_DIR = argv[0][:-7]
 WORKING_DIR = os.getcwd()
@@ -17,7 +19,15 @@ SCOPES = ['https://www.googleapis.com/auth/drive',\
     'https://www.googleapis.com/auth/drive.appdata',\
     'https://www.googleapis.com/auth/drive.metadata']
 
-def get_service():
+# The cached Drive discovery document is fetched again after a week
+DISCOVERY_MAX_AGE = 7 * 24 * 60 * 60
+
+# Command line options that take a value, e.g. '--jobs 8'
+VALUE_OPTIONS = ['jobs', 'chunk-size', 'download-chunk-size', 'trace', 'delay', 'interval', 'export',
+    'include', 'exclude', 'repo-jobs', 'threshold']
+
+def get_credentials():
+    from oauth2client import file, client, tools
     global PROGRAM_DIR
     PROGRAM_DIR = to_path(PROGRAM_DIR)
     store = file.Storage(PROGRAM_DIR+"token.json")
@@ -25,56 +35,239 @@ def get_service():
     if not creds or creds.invalid:
         flow = client.flow_from_clientsecrets(f"{PROGRAM_DIR}./credentials.json", SCOPES)
         creds = tools.run_flow(flow, store)
+    return creds
+
+def get_service(creds):
+    """Returns the Drive v3 service, built from a copy of its discovery
+    document kept in the user's cache folder. The document is only fetched
+    when there's no copy or it's more than DISCOVERY_MAX_AGE seconds old.
+    """
+    from googleapiclient.discovery import build, build_from_document
+    from httplib2 import Http
+    http = ThreadLocalHttp(lambda: creds.authorize(Http()))
+    path = os.path.join(get_cache_dir(), 'drive-v3.json')
+    try:
+        if time.time() - os.path.getmtime(path) < DISCOVERY_MAX_AGE:
+            with open(path, 'rb') as discovery_file:
+                return build_from_document(discovery_file.read().decode(), http = http)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    service = build('drive', 'v3', http = http, cache_discovery = False)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path + '.tmp', 'w') as discovery_file:
+            json.dump(service._rootDesc, discovery_file)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+    return service
+
+class ThreadLocalHttp:
+    """HTTP transport giving each thread its own authorized Http object, made
+    by factory, so one service can be used by the threads of repositories
+    synced in parallel: Http objects aren't thread-safe
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.local = threading.local()
+
+    def get(self):
+        if not hasattr(self.local, 'http'):
+            self.local.http = self.factory()
+        return self.local.http
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+class LazyService:
+    """Stands in for the Drive service until it's first used, so commands
+    that fail early or never reach Drive don't pay for importing the Google
+    API client, loading credentials and building the service.
+    """
+    def __init__(self):
+        self.creds = None
+        self.service = None
+        # Repositories synced in parallel may all make their first call at once
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Returns the Drive service, building it on first use. Only one
+        thread loads the credentials and builds the service.
+        """
+        if self.service is None:
+            with self.lock:
+                if self.service is None:
+                    self.creds = get_credentials()
+                    self.service = get_service(self.creds)
+        return self.service
+
+    def new_http(self):
+        """Returns a new authorized HTTP transport, as each transfer worker
+        needs its own: Http objects aren't thread-safe
+        """
+        from httplib2 import Http
+        self.get()
+        return self.creds.authorize(Http())
 
-    return build('drive', 'v3', http=creds.authorize(Http()))
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+def parse_args(arguments):
+    """Splits the command line arguments into a list of positional arguments
+    and a dict of options. Options are given as '--name', or as '--name value'
+    for the options listed in VALUE_OPTIONS.
+    """
+    args = []
+    options = {}
+    arguments = list(arguments)
+    while arguments:
+        arg = arguments.pop(0)
+        if arg.startswith('--'):
+            name = arg[2:]
+            if name in VALUE_OPTIONS and arguments:
+                options[name] = arguments.pop(0)
+            else:
+                options[name] = True
+        else:
+            args.append(arg)
+    return args, options
 
 def main():
     """Main function
     """
-    # Connect to Google Drive API
+    args, options = parse_args(argv)
+    missing = [ x for x in VALUE_OPTIONS if options.get(x) is True ]
+    if missing:
+        print(f"Error: --{missing[0]} must be followed by a value")
+        return
+
+    try:
+        jobs = int(options.get('jobs', 1))
+        # Chunk size is given in MB, keeping it a multiple of 256 KB
+        chunk_size = int(options.get('chunk-size', 8)) * 1024 * 1024
+        download_chunk_size = int(options.get('download-chunk-size', 64)) * 1024 * 1024
+        delay = float(options.get('delay', 1))
+        interval = float(options.get('interval', 30))
+        repo_jobs = int(options.get('repo-jobs', 4))
+        # Pack threshold is given in KB
+        threshold = int(options['threshold']) * 1024 if 'threshold' in options else None
+    except ValueError:
+        print("Error: --jobs, --chunk-size, --download-chunk-size, --delay, --interval, " +
+            "--repo-jobs and --threshold must be numbers")
+        return
+    if not min(jobs, chunk_size, download_chunk_size, interval, repo_jobs,
+        1 if threshold is None else threshold) >= 1 or not delay >= 0:
+        print("Error: --jobs, --chunk-size, --download-chunk-size, --interval, --repo-jobs and " +
+            "--threshold must be at least 1, and --delay can't be negative")
+        return
+
+    exports = None
+    if 'export' in options:
+        try:
+            exports = parse_export_formats(str(options['export']))
+        except ValueError as e:
+            print(f"Error: --export {e}")
+            return
+
+    if 'trace' in options:
+        STATS.enable_trace()
+
+    # Connect to Google Drive API the first time a command needs it
+    service = LazyService()
+    client = Client(service, http_factory = service.new_http, jobs = jobs,
+        folder_cache = FolderCache(), chunk_size = chunk_size,
+        download_chunk_size = download_chunk_size)
+
     try:
-        service = get_service()
-    except ServerNotFoundError:
+        run_command(client, args, options, delay, interval, exports, repo_jobs, threshold)
+    except Exception as e:
+        # httplib2 has been imported if a connection was attempted
+        from httplib2 import ServerNotFoundError
+        if not isinstance(e, ServerNotFoundError):
+            raise
         print("Error: couldn't connect to Google's servers")
         return
 
-    client = Client(service)
+    client.folder_cache.save()
+    summary = SCHEDULER.summary()
+    if summary:
+        print(summary)
+    if 'stats' in options:
+        print(STATS.summary())
+    if 'trace' in options:
+        STATS.write_trace(options['trace'])
 
-    # Check command arguments
-    if(len(argv) < 2):
+def run_command(client, args, options, delay, interval, exports = None, repo_jobs = 4,
+    threshold = None):
+    """Runs the command given by the positional arguments
+    """
+    if(len(args) < 2):
         print("Action must be provided")
-    elif(argv[1] == "clone"):
-        if(len(argv) < 3):
+    elif(args[1] == "clone"):
+        include = None
+        if 'include' in options:
+            include = [ x for x in str(options['include']).split(',') if x ]
+        exclude = [ x for x in str(options.get('exclude', '')).split(',') if x ]
+        metadata_only = 'metadata-only' in options
+        if(len(args) < 3):
             # No file or folder name provided, cloning root
-            client.clone(WORKING_DIR, "/")
+            client.clone(WORKING_DIR, "/", exports = exports, include = include, exclude = exclude,
+                metadata_only = metadata_only)
         else:
-            path = argv[2]
-            client.clone(WORKING_DIR, path)
-    elif(argv[1] == "pull"):
-        if(len(argv) < 3):
+            path = args[2]
+            client.clone(WORKING_DIR, path, exports = exports, include = include,
+                exclude = exclude, metadata_only = metadata_only)
+    elif(args[1] == "pull"):
+        force = 'force' in options
+        dry_run = 'dry-run' in options
+        if 'all' in options:
+            # Pull every repository beneath the current folder
+            client.pull_all(WORKING_DIR, force = force, dry_run = dry_run, repo_jobs = repo_jobs,
+                exports = exports)
+        elif(len(args) < 3):
             # No file or folder name provided, pulling root
-            client.pull(WORKING_DIR)
+            client.pull(WORKING_DIR, force = force, dry_run = dry_run, exports = exports)
         else:
-            path = argv[2]
-            client.pull(WORKING_DIR, path)
-    elif(argv[1] == "push"):
-        if(len(argv) < 3):
+            path = args[2]
+            client.pull(WORKING_DIR, path, force = force, dry_run = dry_run, exports = exports)
+    elif(args[1] == "push"):
+        checksum = 'checksum' in options
+        force = 'force' in options
+        dry_run = 'dry-run' in options
+        if 'all' in options:
+            # Push every repository beneath the current folder
+            client.push_all(WORKING_DIR, checksum = checksum, force = force, dry_run = dry_run,
+                repo_jobs = repo_jobs)
+        elif(len(args) < 3):
             # No file or folder name provided, pushing to everything
-            client.push(WORKING_DIR)
+            client.push(WORKING_DIR, checksum = checksum, force = force, dry_run = dry_run)
+        else:
+            path = args[2]
+            client.push(WORKING_DIR, path, checksum = checksum, force = force, dry_run = dry_run)
+    elif(args[1] == "fetch"):
+        path = args[2] if len(args) > 2 else None
+        client.fetch(WORKING_DIR, path, force = 'force' in options)
+    elif(args[1] == "pack"):
+        if(len(args) < 3):
+            print("Error: a folder must be specified, use '/' to pack the whole repository")
         else:
-            path = argv[2]
-            client.push(WORKING_DIR, path)
-    elif(argv[1] == "init"):
-        if(len(argv) < 3):
+            client.pack(WORKING_DIR, args[2], threshold = threshold, off = 'off' in options)
+    elif(args[1] == "watch"):
+        client.watch(WORKING_DIR, delay = delay, interval = interval, force = 'force' in options)
+    elif(args[1] == "status"):
+        client.status(WORKING_DIR, checksum = 'checksum' in options)
+    elif(args[1] == "init"):
+        if(len(args) < 3):
             print("Error: a repository name must be specified when initialising a new repository")
         else:
-            path = argv[2]
+            path = args[2]
             client.init(WORKING_DIR, path)
-    elif(argv[1] == "list"):
-        if(len(argv) < 3):
+    elif(args[1] == "list"):
+        if(len(args) < 3):
             client.list_repos()
         else:
-            path = argv[2]
+            path = args[2]
             client.list_repos(path)
 
 if __name__ == '__main__':
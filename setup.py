@@ -69,7 +69,7 @@ else:
             print("Error: Insufficient permissions.")
             exit()
 
-        run_command = 'python3 ' + getcwd() + '/main.py $1 $2 $3\n'
+        run_command = 'python3 ' + getcwd() + '/main.py "$@"\n'
         file.write('#!/bin/bash\n'.encode())
         file.write(run_command.encode())
         file.close()
@@ -0,0 +1,69 @@
+"""Shared fixtures for tests that sync repositories against the in-memory
+fake Drive of the benchmarks.
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'benchmarks'))
+from fake_drive import FakeDrive
+from gitd.client import Client
+
+class DriveTestCase(unittest.TestCase):
+    """Test case with a FakeDrive, a Client using it and a temporary folder
+    holding a source repository and its clones
+    """
+    def setUp(self):
+        self.drive = FakeDrive()
+        self.client = Client(self.drive)
+        self.work = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, self.work)
+        self.source = os.path.join(self.work, 'source')
+        self.clones = os.path.join(self.work, 'clones')
+        os.mkdir(self.source)
+        os.mkdir(self.clones)
+
+    def quiet(self, function, *args, **kwargs):
+        """Runs function without printing anything, returning its result"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+
+    def write(self, root, relpath, text = ''):
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def push_source(self, files):
+        """Initialises the source repository with the given dict of file
+        contents by relative path and pushes it
+        """
+        for relpath, text in files.items():
+            self.write(self.source, relpath, text)
+        self.quiet(self.client.init, self.source, 'repo')
+        self.quiet(self.client.push, self.source, force = True)
+
+    def clone(self):
+        """Clones the source repository, returning the clone's folder"""
+        self.quiet(self.client.clone, self.clones, 'repo')
+        return os.path.join(self.clones, 'repo')
+
+    def drive_id(self, name):
+        """Returns the ID of the only Drive file with the given name"""
+        ids = [ x['id'] for x in self.drive.files_.values() if x['name'] == name ]
+        self.assertEqual(len(ids), 1)
+        return ids[0]
+
+    def forget_changes_token(self, container):
+        """Makes the next pull of a repository walk the whole Drive folder"""
+        path = os.path.join(container, '.gitd')
+        with open(path) as f:
+            data = json.load(f)
+        data['changes_token'] = None
+        with open(path, 'w') as f:
+            json.dump(data, f)
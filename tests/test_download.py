@@ -0,0 +1,75 @@
+import hashlib
+import os
+from unittest import mock
+from gitd import functions
+from gitd.functions import download_range, partial_path
+from gitd.repository import get_repo_in_folder
+from .support import DriveTestCase
+
+KB = 1024
+
+class PartialDownloadTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.download_chunk_size = 100 * KB
+        self.push_source({ 'big.bin': 'a' * (300 * KB) })
+        self.container = self.clone()
+        self.data = b'b' * (300 * KB)
+        with open(os.path.join(self.source, 'big.bin'), 'wb') as f:
+            f.write(self.data)
+        self.quiet(self.client.push, self.source, force = True)
+        self.file_id = self.drive_id('big.bin')
+        self.part = partial_path(os.path.join(self.container, 'big.bin'), self.file_id)
+
+    def leave_partial(self, data, md5):
+        """Leaves a partial download of big.bin in the clone"""
+        with open(self.part, 'wb') as f:
+            f.write(data)
+        repo = get_repo_in_folder(self.drive, self.container)
+        repo.manifest.set_download('big.bin', self.file_id, md5)
+        return repo.manifest
+
+    def read(self):
+        with open(os.path.join(self.container, 'big.bin'), 'rb') as f:
+            return f.read()
+
+    def test_resumes_with_a_ranged_request(self):
+        self.leave_partial(self.data[:100 * KB], hashlib.md5(self.data).hexdigest())
+        self.drive.reset_stats()
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(self.drive.stats['bytes_down'], 200 * KB)
+        self.assertFalse(os.path.exists(self.part))
+
+    def test_restarts_partial_download_of_another_version(self):
+        self.leave_partial(b'a' * (100 * KB), 'stale')
+        self.drive.reset_stats()
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(self.drive.stats['bytes_down'], 300 * KB)
+
+    def test_removes_partial_download_of_deleted_file(self):
+        os.remove(os.path.join(self.source, 'big.bin'))
+        self.quiet(self.client.push, self.source, force = True)
+        self.leave_partial(self.data[:100 * KB], hashlib.md5(self.data).hexdigest())
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertFalse(os.path.exists(self.part))
+        repo = get_repo_in_folder(self.drive, self.container)
+        self.assertEqual(repo.manifest.get_downloads(), [])
+
+    def test_interrupted_download_is_resumed(self):
+        calls = []
+        def interrupted(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError('interrupted')
+            return download_range(*args, **kwargs)
+        with mock.patch.object(functions, 'download_range', interrupted):
+            self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(os.path.getsize(self.part), 100 * KB)
+
+        self.drive.reset_stats()
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(self.drive.stats['bytes_down'], 200 * KB)
+        self.assertFalse(os.path.exists(self.part))
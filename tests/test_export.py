@@ -0,0 +1,40 @@
+import os
+from .support import DriveTestCase
+
+DOCUMENT_MIME = 'application/vnd.google-apps.document'
+
+class ExportTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.push_source({ 'file.txt': 'text' })
+        self.doc = self.drive.create({ 'name': 'Notes', 'mimeType': DOCUMENT_MIME,
+            'parents': [self.drive_id('repo')] }, b'first version')
+        self.container = self.clone()
+
+    def read(self, relpath):
+        with open(os.path.join(self.container, relpath), 'rb') as f:
+            return f.read()
+
+    def test_clone_exports_documents(self):
+        self.assertEqual(self.read('Notes.docx'), b'first version')
+        self.assertEqual(self.read('file.txt'), b'text')
+
+    def test_unchanged_documents_arent_exported_again(self):
+        self.forget_changes_token(self.container)
+        self.drive.reset_stats()
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(self.drive.calls['files.export_media.chunk'], 0)
+
+    def test_new_versions_are_exported_again(self):
+        self.drive.update(self.doc['id'], data = b'second version')
+        self.drive.reset_stats()
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(self.read('Notes.docx'), b'second version')
+        self.assertEqual(self.drive.calls['files.export_media.chunk'], 1)
+
+    def test_exports_arent_pushed_back(self):
+        self.drive.reset_stats()
+        self.quiet(self.client.push, self.container, force = True)
+        self.assertEqual(self.drive.calls['files.create'], 0)
+        self.assertEqual(self.drive.calls['files.delete'], 0)
+        self.assertEqual(self.drive.calls['files.update'], 0)
@@ -0,0 +1,50 @@
+import os
+from unittest import mock
+from gitd.folder_cache import FolderCache
+from gitd.functions import FOLDER_MIME, find_folder_id
+from .support import DriveTestCase
+
+class ResolvePathTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = FolderCache(os.path.join(self.work, 'folders.json'))
+        self.client.folder_cache = self.cache
+        self.quiet(self.client.init, self.source, 'projects/repo')
+
+    def test_cached_path_makes_no_requests(self):
+        self.assertIsNotNone(self.cache.get('projects/repo'))
+        self.drive.reset_stats()
+        self.assertEqual(find_folder_id(self.drive, 'projects/repo', cache = self.cache),
+            self.cache.get('projects/repo'))
+        self.assertEqual(self.drive.stats['round_trips'], 0)
+
+    def test_clone_evicts_stale_cached_folder(self):
+        stale_id = self.cache.get('projects/repo')
+        self.drive.delete(self.drive_id('projects'))
+        parent = self.drive.create({ 'name': 'projects', 'mimeType': FOLDER_MIME })
+        folder = self.drive.create({ 'name': 'repo', 'mimeType': FOLDER_MIME,
+            'parents': [parent['id']] })
+        self.drive.create({ 'name': 'file.txt', 'parents': [folder['id']] }, b'data')
+        self.assertEqual(self.cache.get('projects/repo'), stale_id)
+
+        self.quiet(self.client.clone, self.clones, 'projects/repo')
+        self.assertEqual(self.cache.get('projects/repo'), folder['id'])
+        with open(os.path.join(self.clones, 'repo', 'file.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+
+    def test_lookup_is_limited_to_the_start_folder(self):
+        # Folders with the same names elsewhere on Drive are never listed
+        elsewhere = self.drive.create({ 'name': 'archive', 'mimeType': FOLDER_MIME })
+        decoy = self.drive.create({ 'name': 'projects', 'mimeType': FOLDER_MIME,
+            'parents': [elsewhere['id']] })
+        self.drive.create({ 'name': 'repo', 'mimeType': FOLDER_MIME, 'parents': [decoy['id']] })
+        queries = []
+        query = self.drive.query
+        def spy(q):
+            queries.append(q)
+            return query(q)
+        with mock.patch.object(self.drive, 'query', spy):
+            folder_id = find_folder_id(self.drive, 'projects/repo')
+        self.assertEqual(folder_id, self.cache.get('projects/repo'))
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(' in parents' in x for x in queries))
@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+import httplib2
+from googleapiclient.errors import HttpError
+from gitd import functions
+from gitd.functions import batch_execute
+from gitd.scheduler import SCHEDULER
+
+class StubBatch:
+    """Batch request that answers each request with the result of calling it,
+    in reverse order as Drive doesn't guarantee the order of the parts
+    """
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batches.append(len(self.requests))
+        for request_id, request in reversed(self.requests):
+            try:
+                self.callback(request_id, request(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+class StubService:
+    def __init__(self):
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return StubBatch(self, callback)
+
+class BatchExecuteTest(unittest.TestCase):
+    @mock.patch.object(functions, 'BATCH_SIZE', 4)
+    def test_results_keep_request_order(self):
+        service = StubService()
+        requests = [ (lambda i = i: { 'id': i }) for i in range(10) ]
+        results = batch_execute(service, requests)
+        self.assertEqual([ x[0]['id'] for x in results ], list(range(10)))
+        self.assertEqual(service.batches, [4, 4, 2])
+
+    def test_errors_are_returned_per_request(self):
+        def missing():
+            raise LookupError('not found')
+        results = batch_execute(StubService(), [lambda: 'a', missing, lambda: 'c'])
+        self.assertEqual([ x[0] for x in results ], ['a', None, 'c'])
+        self.assertIsNone(results[0][1])
+        self.assertIsInstance(results[1][1], LookupError)
+
+    @mock.patch.object(SCHEDULER, 'backoff')
+    def test_retries_only_failed_requests(self, backoff):
+        attempts = []
+        def flaky(status, failures):
+            def request():
+                attempts.append(status)
+                if attempts.count(status) <= failures:
+                    raise HttpError(httplib2.Response({ 'status': status }), b'')
+                return status
+            return request
+        service = StubService()
+        results = batch_execute(service,
+            [lambda: 'ok', flaky(503, 2), flaky(429, 1), flaky(404, 1)])
+        self.assertEqual([ x[0] for x in results ], ['ok', 503, 429, None])
+        self.assertEqual(results[3][1].resp.status, 404)
+        # Only the requests that can be retried are sent again
+        self.assertEqual(service.batches, [4, 2, 1])
+        self.assertEqual(backoff.call_count, 2)
+
+class IsInsideTest(unittest.TestCase):
+    def test_looks_up_each_parent_folder(self):
+        roots = { 'a', 'b/c' }
+        self.assertTrue(functions.is_inside('a/x', roots))
+        self.assertTrue(functions.is_inside('b/c/d/e', roots))
+        self.assertFalse(functions.is_inside('a', roots))
+        self.assertFalse(functions.is_inside('ab/x', roots))
+        self.assertFalse(functions.is_inside('b/x', roots))
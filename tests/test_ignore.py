@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+from gitd.ignore import IgnoreRules, SparseRules, load_ignore
+from gitd.scanner import scan_tree
+
+class IgnoreRulesTest(unittest.TestCase):
+    def test_names_match_at_any_depth(self):
+        rules = IgnoreRules(['*.log', 'build'])
+        self.assertTrue(rules.match('debug.log'))
+        self.assertTrue(rules.match('a/b/debug.log'))
+        self.assertTrue(rules.match('src/build', True))
+        self.assertFalse(rules.match('debug.log.txt'))
+        self.assertFalse(rules.match('src/builder'))
+
+    def test_patterns_with_a_slash_are_anchored(self):
+        rules = IgnoreRules(['docs/*.tmp', '/top.txt'])
+        self.assertTrue(rules.match('docs/a.tmp'))
+        self.assertFalse(rules.match('other/docs/a.tmp'))
+        self.assertFalse(rules.match('docs/sub/a.tmp'))
+        self.assertTrue(rules.match('top.txt'))
+        self.assertFalse(rules.match('sub/top.txt'))
+
+    def test_double_star_crosses_folders(self):
+        rules = IgnoreRules(['**/cache', 'logs/**/*.gz'])
+        self.assertTrue(rules.match('cache', True))
+        self.assertTrue(rules.match('a/b/cache', True))
+        self.assertTrue(rules.match('logs/old.gz'))
+        self.assertTrue(rules.match('logs/2020/01/old.gz'))
+
+    def test_trailing_slash_only_matches_folders(self):
+        rules = IgnoreRules(['tmp/'])
+        self.assertTrue(rules.match('tmp', True))
+        self.assertTrue(rules.match('a/tmp', True))
+        self.assertFalse(rules.match('tmp'))
+
+    def test_last_matching_pattern_wins(self):
+        rules = IgnoreRules(['*.log', '!keep.log', 'old/keep.log'])
+        self.assertTrue(rules.match('debug.log'))
+        self.assertFalse(rules.match('keep.log'))
+        self.assertFalse(rules.match('a/keep.log'))
+        self.assertTrue(rules.match('old/keep.log'))
+
+    def test_comments_blanks_and_escapes(self):
+        rules = IgnoreRules(['# comment\n', '\n', '\\#hash\n', '\\!bang\n', 'space\\ \n'])
+        self.assertTrue(rules.match('#hash'))
+        self.assertTrue(rules.match('!bang'))
+        self.assertTrue(rules.match('space '))
+        self.assertFalse(rules.match('comment'))
+        self.assertFalse(IgnoreRules(['# only a comment', '']))
+
+    def test_character_classes(self):
+        rules = IgnoreRules(['file[0-9].txt', 'x[!a].txt'])
+        self.assertTrue(rules.match('file7.txt'))
+        self.assertFalse(rules.match('filex.txt'))
+        self.assertTrue(rules.match('xb.txt'))
+        self.assertFalse(rules.match('xa.txt'))
+
+    def test_match_path_checks_parent_folders(self):
+        rules = IgnoreRules(['build/'])
+        self.assertFalse(rules.match('build/out.o'))
+        self.assertTrue(rules.match_path('build/out.o'))
+        self.assertTrue(rules.match_path('src/build/sub/out.o'))
+        self.assertFalse(rules.match_path('src/out.o'))
+
+class SparseRulesTest(unittest.TestCase):
+    def test_only_included_paths_and_their_parents_are_kept(self):
+        rules = SparseRules(['docs/guide', 'src/main.c'])
+        self.assertFalse(rules.match('docs', True))
+        self.assertFalse(rules.match('docs/guide', True))
+        self.assertFalse(rules.match('docs/guide/intro.md'))
+        self.assertFalse(rules.match('src/main.c'))
+        self.assertTrue(rules.match('docs/other.md'))
+        self.assertTrue(rules.match('docs/guides', True))
+        self.assertTrue(rules.match('src/util.c'))
+        self.assertTrue(rules.match('readme.md'))
+        # Parent folders are walked, but files with their names aren't kept
+        self.assertTrue(rules.match('docs'))
+
+    def test_exclude_and_ignore_rules_apply_inside_included_paths(self):
+        rules = SparseRules(['docs'], ['*.pdf'], IgnoreRules(['drafts/']))
+        self.assertTrue(rules.match('docs/manual.pdf'))
+        self.assertTrue(rules.match('docs/drafts', True))
+        self.assertTrue(rules.match_path('docs/drafts/a.md'))
+        self.assertFalse(rules.match_path('docs/final/a.md'))
+
+    def test_whole_repository(self):
+        rules = SparseRules(None, ['build/'])
+        self.assertTrue(rules)
+        self.assertFalse(rules.match('any/path.txt'))
+        self.assertTrue(rules.match_path('a/build/out.o'))
+        self.assertFalse(SparseRules(['']).match('any/path.txt'))
+
+class LoadIgnoreTest(unittest.TestCase):
+    def setUp(self):
+        self.container = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, self.container)
+
+    def write(self, relpath, text = ''):
+        path = os.path.join(self.container, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_missing_or_empty_file(self):
+        self.assertIsNone(load_ignore(self.container))
+        self.write('.gitdignore', '# nothing ignored\n')
+        self.assertIsNone(load_ignore(self.container))
+        rules = load_ignore(self.container, { 'include': ['docs'] })
+        self.assertIsInstance(rules, SparseRules)
+        self.assertIsNone(rules.ignore)
+
+    def test_scan_prunes_ignored_folders(self):
+        self.write('.gitdignore', 'build/\n*.log\n')
+        self.write('build/out.o')
+        self.write('src/build/out.o')
+        self.write('src/main.c')
+        self.write('src/debug.log')
+        local = scan_tree(self.container, '', load_ignore(self.container))
+        self.assertEqual(sorted(x.path for x in local.walk('')),
+            ['.gitdignore', 'src', 'src/main.c'])
@@ -0,0 +1,112 @@
+import contextlib
+import io
+import os
+from unittest import mock
+from gitd.journal import Journal
+from gitd.manifest import Manifest
+from gitd.repository import get_repo_in_folder
+from gitd.sync import SyncPlan
+from .support import DriveTestCase
+
+class JournalTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manifest = Manifest(self.source)
+        self.addCleanup(self.manifest.db.close)
+        self.journal = Journal(self.manifest)
+
+    def test_finished_operations_are_left_out_when_resumed(self):
+        plan = SyncPlan('push')
+        plan.folders = [ { 'path': 'docs', 'parent': '' } ]
+        plan.uploads = [ { 'path': 'docs/a.txt' }, { 'path': 'docs/b.txt' } ]
+        self.journal.begin(plan, started = 12.5)
+        self.journal.done('folder', 'docs', 'folder-id')
+        self.journal.done('upload', 'docs/a.txt')
+        self.assertEqual(self.journal.load('pull'), (None, None))
+        resumed, state = Journal(Manifest(self.source)).load('push')
+        self.assertEqual(state, { 'started': 12.5 })
+        self.assertEqual(resumed.folders, [])
+        self.assertEqual(resumed.folder_ids['docs'], 'folder-id')
+        self.assertEqual(resumed.uploads, [ { 'path': 'docs/b.txt' } ])
+        self.journal.finish()
+        self.assertIsNone(self.journal.pending())
+
+class InterruptedPushTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            self.write(self.source, name, name)
+        self.quiet(self.client.init, self.source, 'repo')
+        # Kill the push as soon as the second upload has been recorded
+        record = Journal.done
+        def interrupt(journal, kind, path, result = None):
+            record(journal, kind, path, result)
+            if path == 'b.txt':
+                raise KeyboardInterrupt()
+        with mock.patch.object(Journal, 'done', interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.quiet(self.client.push, self.source, force = True)
+        self.drive.reset_stats()
+
+    def test_push_resumes_without_repeating_uploads(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.client.push(self.source, force = True)
+        self.assertIn("Resuming the interrupted push...", output.getvalue())
+        self.assertEqual(sorted(x['name'] for x in self.drive.files_.values()
+            if x['name'].endswith('.txt')), ['a.txt', 'b.txt', 'c.txt'])
+        self.assertEqual(self.drive.calls['files.list'], 0)
+        self.assertIn("Uploaded c.txt", output.getvalue())
+        self.assertNotIn("Uploaded a.txt", output.getvalue())
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.client.push(self.source, dry_run = True)
+        self.assertIn("Everything up-to-date", output.getvalue())
+
+class JournalDirectionTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.push_source({ 'a.txt': 'a' })
+        self.container = self.clone()
+        self.write(self.source, 'b.txt', 'b')
+        self.quiet(self.client.push, self.source, force = True)
+
+    def interrupt(self, direction):
+        """Leaves the journal of an interrupted sync in the clone"""
+        repo = get_repo_in_folder(self.drive, self.container)
+        if direction == 'pull':
+            plan, token, incremental = repo.plan_pull()
+            Journal(repo.manifest).begin(plan, token = token, incremental = incremental)
+        else:
+            plan = repo.push(dry_run = True)
+            Journal(repo.manifest).begin(plan, started = 0)
+        repo.manifest.commit()
+
+    def pending(self):
+        repo = get_repo_in_folder(self.drive, self.container)
+        return Journal(repo.manifest).pending()
+
+    def test_push_keeps_interrupted_pull(self):
+        self.interrupt('pull')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.client.push(self.container, force = True)
+        self.assertIn("a pull was interrupted", output.getvalue())
+        self.assertEqual(self.pending(), 'pull')
+
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertIsNone(self.pending())
+        self.assertTrue(os.path.isfile(os.path.join(self.container, 'b.txt')))
+
+    def test_pull_keeps_interrupted_push(self):
+        self.write(self.container, 'c.txt', 'c')
+        self.interrupt('push')
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertEqual(self.pending(), 'push')
+        self.assertFalse(os.path.exists(os.path.join(self.container, 'b.txt')))
+
+    def test_begin_refuses_other_direction(self):
+        self.interrupt('pull')
+        repo = get_repo_in_folder(self.drive, self.container)
+        with self.assertRaises(ValueError):
+            Journal(repo.manifest).begin(SyncPlan('push'), started = 0)
@@ -0,0 +1,42 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+from unittest import mock
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+class OptionsTest(unittest.TestCase):
+    def run_main(self, *arguments):
+        output = io.StringIO()
+        with mock.patch.object(main, 'argv', ['main.py'] + list(arguments)),\
+            mock.patch.object(main, 'LazyService', side_effect = AssertionError('connected')),\
+            contextlib.redirect_stdout(output):
+            main.main()
+        return output.getvalue()
+
+    def test_rejects_values_below_one(self):
+        for option in ('jobs', 'chunk-size', 'download-chunk-size', 'interval', 'repo-jobs',
+            'threshold'):
+            for value in ('0', '-2'):
+                self.assertIn("must be at least 1", self.run_main('push', f"--{option}", value))
+
+    def test_rejects_negative_or_invalid_delays(self):
+        for value in ('-1', 'nan'):
+            self.assertIn("--delay can't be negative", self.run_main('watch', '--delay', value))
+
+    def test_rejects_non_numbers(self):
+        self.assertIn("must be numbers", self.run_main('push', '--jobs', 'many'))
+
+    def test_rejects_missing_values(self):
+        self.assertIn("--trace must be followed by a value", self.run_main('push', '--trace'))
+
+class ImportTest(unittest.TestCase):
+    def test_google_api_client_isnt_imported_up_front(self):
+        code = "import sys, main; print(sorted(x for x in sys.modules " +\
+            "if x.split('.')[0] in ('googleapiclient', 'httplib2', 'oauth2client')))"
+        output = subprocess.check_output([sys.executable, '-c', code],
+            cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(output.decode().strip(), '[]')
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+import unittest
+from gitd.manifest import Manifest
+
+class ManifestTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.container = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, self.container)
+        self.manifest = Manifest(self.container)
+        self.stat = os.stat(self.container)
+        self.manifest.set_folder('folder-a', 'a')
+        self.manifest.set_file('a/big.bin', 'file-big', 'md5')
+        self.manifest.set_upload('a/big.bin', 'file-big', 'https://upload/session', 1024, self.stat)
+        self.manifest.set_file('ab.txt', 'file-ab', 'md5')
+
+    def test_move_carries_every_entry(self):
+        self.manifest.move('a', 'b')
+        self.assertIsNone(self.manifest.get('a/big.bin'))
+        self.assertIsNone(self.manifest.get_upload('a/big.bin'))
+        self.assertEqual(self.manifest.get('b/big.bin')['file_id'], 'file-big')
+        self.assertEqual(self.manifest.get_upload('b/big.bin')['offset'], 1024)
+        self.assertEqual(self.manifest.folder_path('folder-a'), 'b')
+        # Siblings sharing the prefix aren't moved
+        self.assertEqual(self.manifest.get('ab.txt')['file_id'], 'file-ab')
+
+    def test_forget_removes_every_entry(self):
+        self.manifest.forget('a')
+        self.assertIsNone(self.manifest.get('a/big.bin'))
+        self.assertIsNone(self.manifest.get_upload('a/big.bin'))
+        self.assertIsNone(self.manifest.folder_path('folder-a'))
+        self.assertIsNotNone(self.manifest.get('ab.txt'))
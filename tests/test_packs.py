@@ -0,0 +1,99 @@
+import os
+import unittest
+from unittest import mock
+from gitd import packs
+from gitd.packs import PACK_INDEX, PACK_PREFIX, is_packed, packed_folder
+from .support import Client, DriveTestCase
+
+class PackedFolderTest(unittest.TestCase):
+    def test_paths_inside_packed_folders(self):
+        thresholds = { 'data': 1024, 'old': None }
+        self.assertEqual(packed_folder('data/a/b.txt', thresholds), 'data')
+        self.assertIsNone(packed_folder('database/b.txt', thresholds))
+        self.assertEqual(packed_folder('anything', { '': 1024 }), '')
+        self.assertTrue(is_packed('data/b.txt', 1023, thresholds))
+        self.assertFalse(is_packed('data/b.txt', 1024, thresholds))
+        self.assertFalse(is_packed('old/b.txt', 1, thresholds))
+
+class PackSyncTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = { f"data/{x // 10}/file{x}.txt": f"small file {x}" for x in range(30) }
+        self.files['data/large.bin'] = 'x' * 4096
+        for relpath, text in self.files.items():
+            self.write(self.source, relpath, text)
+        self.quiet(self.client.init, self.source, 'repo')
+        self.quiet(self.client.pack, self.source, 'data', threshold = 1024)
+        self.quiet(self.client.push, self.source, force = True)
+
+    def drive_names(self):
+        return [ x['name'] for x in self.drive.files_.values() if not x['trashed'] ]
+
+    def read(self, root, relpath):
+        with open(os.path.join(root, relpath)) as f:
+            return f.read()
+
+    def test_small_files_are_stored_in_packs(self):
+        names = self.drive_names()
+        self.assertIn(PACK_INDEX, names)
+        self.assertIn('large.bin', names)
+        self.assertTrue(any(x.startswith(PACK_PREFIX) for x in names))
+        self.assertFalse(any(x.startswith('file') for x in names))
+        # Subfolders holding nothing but packed files aren't created on Drive
+        self.assertNotIn('0', names)
+
+    def test_clone_and_pull_unpack_changed_files(self):
+        container = self.clone()
+        for relpath, text in self.files.items():
+            self.assertEqual(self.read(container, relpath), text)
+        self.write(self.source, 'data/1/file12.txt', 'changed')
+        self.quiet(self.client.push, self.source, force = True)
+        self.drive.reset_stats()
+        self.quiet(self.client.pull, container, force = True)
+        self.assertEqual(self.read(container, 'data/1/file12.txt'), 'changed')
+        self.assertEqual(self.read(container, 'data/2/file25.txt'), 'small file 25')
+        # The index and the one pack that changed, nothing listed
+        self.assertEqual(self.drive.calls['files.get_media.chunk'], 2)
+        self.assertEqual(self.drive.calls['files.list'], 0)
+
+    def test_unpacking_uploads_files_and_removes_packs(self):
+        self.quiet(self.client.pack, self.source, 'data', off = True)
+        self.quiet(self.client.push, self.source, force = True)
+        names = self.drive_names()
+        self.assertNotIn(PACK_INDEX, names)
+        self.assertFalse(any(x.startswith(PACK_PREFIX) for x in names))
+        self.assertEqual(sum(x.startswith('file') for x in names), 30)
+
+class SameKeyPacksTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client(self.drive, jobs = 4)
+
+    def test_packs_with_the_same_key_in_different_folders(self):
+        # Both folders hold the same files, so their packs have the same key
+        files = { f"{folder}/file{i}.txt": f"contents {i}" for folder in ('a', 'b')
+            for i in range(5) }
+        for relpath, text in files.items():
+            self.write(self.source, relpath, text)
+        self.quiet(self.client.init, self.source, 'repo')
+        self.quiet(self.client.pack, self.source, 'a')
+        self.quiet(self.client.pack, self.source, 'b')
+
+        paths = []
+        def recorded(function, index):
+            # Records the path function writes to or reads from
+            def wrapper(http, service, *args, **kwargs):
+                paths.append(args[index])
+                return function(http, service, *args, **kwargs)
+            return wrapper
+        with mock.patch.object(packs, 'upload_file', recorded(packs.upload_file, 0)),\
+            mock.patch.object(packs, 'fetch_file', recorded(packs.fetch_file, 1)):
+            self.quiet(self.client.push, self.source, force = True)
+            container = self.clone()
+
+        pack_paths = [ x for x in paths if os.path.basename(x).startswith(packs.PACK_PREFIX) ]
+        self.assertEqual(len(pack_paths), 4)
+        self.assertEqual(len(set(pack_paths)), len(pack_paths))
+        for relpath, text in files.items():
+            with open(os.path.join(container, relpath)) as f:
+                self.assertEqual(f.read(), text)
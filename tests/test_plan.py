@@ -0,0 +1,223 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from gitd.functions import FOLDER_MIME, RemoteTree
+from gitd.ignore import IgnoreRules
+from gitd.manifest import Manifest
+from gitd.sync import copy_files, plan_pull, plan_push
+from .test_functions import StubService
+
+def md5(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+class PlanTest(unittest.TestCase):
+    """Plans built from a local folder and a synthetic snapshot of Drive"""
+    def setUp(self):
+        self.container = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, self.container)
+        self.manifest = Manifest(self.container)
+        self.tree = RemoteTree('root')
+        self.count = 0
+
+    def write(self, relpath, text):
+        path = os.path.join(self.container, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def remote(self, name, text = None, parent = 'root'):
+        """Adds a file, or a folder if text is None, to the snapshot of Drive"""
+        self.count += 1
+        file = { 'id': f"id{self.count}", 'name': name }
+        if text is None:
+            file['mimeType'] = FOLDER_MIME
+        else:
+            file.update(mimeType = 'text/plain', md5Checksum = md5(text), size = str(len(text)))
+        self.tree.add(parent, file)
+        return file
+
+    def synced(self, relpath, text, remote_text = None):
+        """Records a file as synced with Drive, which now holds remote_text"""
+        self.write(relpath, text)
+        file = self.remote(relpath, text if remote_text is None else remote_text)
+        self.manifest.set_file(relpath, file['id'], md5(text))
+        return file
+
+    def push(self, **kwargs):
+        return plan_push(self.container, self.tree, 'root', self.manifest, **kwargs)
+
+class PlanPushTest(PlanTest):
+    def test_mtime_push_skips_files_changed_on_drive(self):
+        self.synced('ours.txt', 'local edit', remote_text = 'original')
+        self.manifest.set_file('ours.txt', 'id1', md5('original'))
+        self.synced('theirs.txt', 'local edit', remote_text = 'remote edit')
+        self.manifest.set_file('theirs.txt', 'id2', md5('original'))
+        plan = self.push(after_time = time.time() - 60)
+        self.assertEqual([ x['path'] for x in plan.uploads ], ['ours.txt'])
+        self.assertEqual([ x['path'] for x in plan.conflicts ], ['theirs.txt'])
+
+        plan = self.push(after_time = time.time() - 60, force = True)
+        self.assertEqual([ x['path'] for x in plan.uploads ], ['ours.txt', 'theirs.txt'])
+        self.assertEqual(plan.conflicts, [])
+
+    def test_checksum_push_compares_contents(self):
+        self.synced('same.txt', 'same')
+        self.synced('edited.txt', 'local edit', remote_text = 'original')
+        self.manifest.set_file('edited.txt', 'id2', md5('original'))
+        self.synced('theirs.txt', 'local edit', remote_text = 'remote edit')
+        self.manifest.set_file('theirs.txt', 'id3', md5('original'))
+        # Modification times don't matter in checksum mode
+        plan = self.push(checksum = True, after_time = time.time() + 60)
+        self.assertEqual([ x['path'] for x in plan.uploads ], ['edited.txt'])
+        self.assertEqual([ x['path'] for x in plan.conflicts ], ['theirs.txt'])
+
+    def test_new_and_removed_paths(self):
+        self.write('sub/new.txt', 'new')
+        gone = self.remote('gone.txt', 'gone')
+        plan = self.push()
+        self.assertEqual([ x['path'] for x in plan.folders ], ['sub'])
+        self.assertEqual([ x['path'] for x in plan.uploads ], ['sub/new.txt'])
+        self.assertEqual([ x['file']['id'] for x in plan.deletes ], [gone['id']])
+
+class PlanPullTest(PlanTest):
+    def test_downloads_changed_files_and_deletes_missing_ones(self):
+        self.synced('same.txt', 'same')
+        self.synced('changed.txt', 'old', remote_text = 'new')
+        self.write('local.txt', 'local')
+        folder = self.remote('docs')
+        self.remote('readme.txt', 'readme', parent = folder['id'])
+        plan = plan_pull(self.container, self.tree, 'root', self.manifest)
+        self.assertEqual(sorted(x['path'] for x in plan.downloads),
+            ['changed.txt', 'docs/readme.txt'])
+        self.assertEqual([ x['path'] for x in plan.folders ], ['docs'])
+        self.assertEqual([ x['path'] for x in plan.deletes ], ['local.txt'])
+
+    def test_deleted_folder_keeps_ignored_files(self):
+        self.write('logs/a.txt', 'a')
+        self.write('logs/nested/b.txt', 'b')
+        self.write('logs/nested/debug.log', 'ignored')
+        plan = plan_pull(self.container, self.tree, 'root', self.manifest,
+            ignore = IgnoreRules(['*.log']))
+        # Contents come before the folders holding them, and the ignored file
+        # isn't deleted
+        self.assertEqual([ x['path'] for x in plan.deletes ],
+            ['logs/nested/b.txt', 'logs/nested', 'logs/a.txt', 'logs'])
+        self.assertEqual([ x['path'] for x in plan.top_deletes() ], ['logs'])
+
+class DetectMovesTest(PlanTest):
+    def test_push_moves_renamed_file(self):
+        self.remote('old.txt', 'contents')
+        self.write('new.txt', 'contents')
+        plan = self.push()
+        self.assertEqual([ (x['from'], x['to']) for x in plan.moves ], [('old.txt', 'new.txt')])
+        self.assertEqual(plan.uploads, [])
+        self.assertEqual(plan.deletes, [])
+
+    def test_push_moves_renamed_folder(self):
+        folder = self.remote('src')
+        self.remote('a.txt', 'one', parent = folder['id'])
+        self.remote('b.txt', 'two', parent = folder['id'])
+        self.write('lib/a.txt', 'one')
+        self.write('lib/b.txt', 'TWO')
+        self.write('lib/c.txt', 'three')
+        plan = self.push()
+        self.assertEqual([ (x['from'], x['to'], x['folder']) for x in plan.moves ],
+            [('src', 'lib', True)])
+        # The moved folder's contents are compared with Drive by checksum
+        self.assertEqual(sorted((x['path'], x['file_id']) for x in plan.uploads),
+            [('lib/b.txt', 'id3'), ('lib/c.txt', None)])
+        self.assertEqual(plan.folders, [])
+        self.assertEqual(plan.deletes, [])
+
+    def test_push_doesnt_move_folder_with_other_contents(self):
+        folder = self.remote('src')
+        self.remote('a.txt', 'aaaa', parent = folder['id'])
+        self.write('lib/a.txt', 'bbbb')
+        plan = self.push()
+        self.assertEqual(plan.moves, [])
+        self.assertEqual([ x['path'] for x in plan.folders ], ['lib'])
+        self.assertEqual([ x['path'] for x in plan.uploads ], ['lib/a.txt'])
+        self.assertEqual([ x['path'] for x in plan.deletes ], ['src'])
+
+    def test_pull_moves_renamed_file(self):
+        self.write('old.txt', 'contents')
+        self.write('other.txt', 'same size')
+        self.remote('new.txt', 'contents')
+        self.remote('other.txt', 'same size')
+        plan = plan_pull(self.container, self.tree, 'root', self.manifest)
+        self.assertEqual([ (x['from'], x['to']) for x in plan.moves ], [('old.txt', 'new.txt')])
+        self.assertEqual(plan.downloads, [])
+        self.assertEqual(plan.deletes, [])
+
+    def test_pull_moves_files_out_of_deleted_folder(self):
+        self.write('old/a.txt', 'contents')
+        self.write('old/b.txt', 'removed')
+        folder = self.remote('new')
+        self.remote('a.txt', 'contents', parent = folder['id'])
+        plan = plan_pull(self.container, self.tree, 'root', self.manifest)
+        self.assertEqual([ (x['from'], x['to']) for x in plan.moves ], [('old/a.txt', 'new/a.txt')])
+        self.assertEqual([ x['path'] for x in plan.folders ], ['new'])
+        self.assertEqual(plan.downloads, [])
+        self.assertEqual([ x['path'] for x in plan.deletes ], ['old/b.txt', 'old'])
+
+class CopyService(StubService):
+    """Service answering files().copy requests, failing for source IDs in
+    missing
+    """
+    def __init__(self, missing = ()):
+        super().__init__()
+        self.missing = missing
+        self.copied = []
+
+    def files(self):
+        return self
+
+    def copy(self, fileId, body, fields):
+        def request():
+            if fileId in self.missing:
+                raise LookupError(f"{fileId} not found")
+            self.copied.append((fileId, body['name'], body['parents']))
+            return { 'id': 'copy-' + body['name'], 'md5Checksum': 'md5-' + fileId }
+        return request
+
+class DetectCopiesTest(PlanTest):
+    def test_new_duplicates_are_copied(self):
+        self.synced('a.txt', 'dup')
+        self.write('b.txt', 'dup')
+        self.write('c.txt', 'twin')
+        self.write('d.txt', 'twin')
+        self.write('e.txt', 'uniq')
+        plan = self.push()
+        self.assertEqual(sorted(x['path'] for x in plan.uploads), ['c.txt', 'e.txt'])
+        copies = { x['path']: x for x in plan.copies }
+        self.assertEqual(sorted(copies), ['b.txt', 'd.txt'])
+        self.assertEqual(copies['b.txt']['source']['id'], 'id1')
+        # d.txt is copied from c.txt once it has been uploaded
+        self.assertIsNone(copies['d.txt']['source'])
+        self.assertEqual(copies['d.txt']['source_path'], 'c.txt')
+
+    def test_copy_files(self):
+        plan = self.push()
+        plan.folder_ids['sub'] = 'sub-id'
+        copies = [
+            { 'path': 'sub/b.txt', 'name': 'b.txt', 'parent': 'sub', 'size': 3,
+                'checksum': 'x', 'source': { 'id': 'id1' }, 'source_path': None },
+            { 'path': 'c.txt', 'name': 'c.txt', 'parent': '', 'size': 3,
+                'checksum': 'y', 'source': { 'id': 'gone' }, 'source_path': None },
+            # The folder it goes into wasn't created, so it isn't copied
+            { 'path': 'new/d.txt', 'name': 'd.txt', 'parent': 'new', 'size': 3,
+                'checksum': 'z', 'source': { 'id': 'id1' }, 'source_path': None },
+        ]
+        service = CopyService(missing = ['gone'])
+        with mock.patch('builtins.print') as printed:
+            copy_files(service, copies, plan, self.manifest)
+        self.assertEqual(service.copied, [('id1', 'b.txt', ['sub-id'])])
+        self.assertEqual([ x.get('copied', False) for x in copies ], [True, False, False])
+        self.assertIn('Failed to copy c.txt', printed.call_args[0][0])
+        entry = self.manifest.get('sub/b.txt')
+        self.assertEqual((entry['file_id'], entry['remote_md5']), ('copy-b.txt', 'md5-id1'))
+        self.assertIsNone(self.manifest.get('c.txt'))
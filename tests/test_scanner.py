@@ -0,0 +1,65 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from gitd import scanner
+from gitd.manifest import Manifest
+from gitd.scanner import hash_tree, scan_tree
+
+class ScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.container = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, self.container)
+        self.manifest = Manifest(self.container)
+        for relpath in ('a.txt', 'sub/b.txt', 'sub/deep/c.txt', '.gitd'):
+            self.write(relpath, relpath)
+        os.mkdir(os.path.join(self.container, 'empty'))
+
+    def write(self, relpath, text):
+        path = os.path.join(self.container, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_scan_tree(self):
+        tree = scan_tree(self.container)
+        self.assertEqual(sorted(x.path for x in tree.files()),
+            ['a.txt', 'sub/b.txt', 'sub/deep/c.txt'])
+        self.assertEqual(sorted(x.name for x in tree.get_folders('')), ['empty', 'sub'])
+        self.assertEqual([ x.path for x in tree.get_files('sub') ], ['sub/b.txt'])
+        self.assertTrue(tree.is_dir('empty'))
+        self.assertFalse(tree.is_dir('a.txt'))
+        stat = os.stat(os.path.join(self.container, 'sub/b.txt'))
+        entry = tree.get('sub/b.txt')
+        self.assertEqual((entry.st_size, entry.st_mtime_ns, entry.st_ino),
+            (stat.st_size, stat.st_mtime_ns, stat.st_ino))
+        # Gitd's own files are left out
+        self.assertIsNone(tree.get('.gitd'))
+
+    def test_scan_subtree(self):
+        tree = scan_tree(self.container, 'sub')
+        self.assertEqual(sorted(x.path for x in tree.files()), ['sub/b.txt', 'sub/deep/c.txt'])
+        self.assertEqual(scan_tree(self.container, 'missing').files(), [])
+
+    def test_hash_tree_only_hashes_changed_files(self):
+        hash_tree(self.container, scan_tree(self.container), self.manifest, jobs = 2)
+        self.assertEqual(self.manifest.get('sub/b.txt')['md5'],
+            hashlib.md5(b'sub/b.txt').hexdigest())
+
+        self.write('a.txt', 'changed')
+        hashed = []
+        def checksum(path):
+            hashed.append(os.path.relpath(path, self.container))
+            return 'md5'
+        with mock.patch.object(scanner, 'get_md5_checksum', checksum):
+            hash_tree(self.container, scan_tree(self.container), self.manifest, jobs = 2)
+        self.assertEqual(hashed, ['a.txt'])
+
+    def test_hash_tree_skips_deleted_files(self):
+        tree = scan_tree(self.container)
+        os.remove(os.path.join(self.container, 'a.txt'))
+        hash_tree(self.container, tree, self.manifest)
+        self.assertIsNone(self.manifest.get('a.txt'))
+        self.assertIsNotNone(self.manifest.get('sub/b.txt')['md5'])
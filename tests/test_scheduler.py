@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+import httplib2
+from googleapiclient.errors import HttpError
+from gitd.scheduler import RequestScheduler, error_status, is_retryable, is_throttled
+
+def http_error(status, reason = None):
+    content = b''
+    if reason:
+        content = json.dumps({ 'error': { 'errors': [{ 'reason': reason }] } }).encode()
+    return HttpError(httplib2.Response({ 'status': status }), content)
+
+class ErrorTest(unittest.TestCase):
+    def test_classifies_errors(self):
+        self.assertTrue(is_throttled(http_error(429)))
+        self.assertTrue(is_throttled(http_error(403, 'userRateLimitExceeded')))
+        self.assertFalse(is_throttled(http_error(403, 'insufficientPermissions')))
+        self.assertTrue(is_retryable(http_error(503)))
+        self.assertTrue(is_retryable(ConnectionError()))
+        self.assertFalse(is_retryable(http_error(404)))
+        self.assertFalse(is_retryable(ValueError()))
+
+    def test_status_is_read_from_the_response(self):
+        self.assertEqual(error_status(http_error(503)), 503)
+        self.assertIsNone(error_status(ConnectionError()))
+        self.assertIsNone(error_status(None))
+
+class RequestSchedulerTest(unittest.TestCase):
+    def scheduler(self, **kwargs):
+        scheduler = RequestScheduler(**kwargs)
+        sleeps = []
+        patcher = mock.patch('gitd.scheduler.time.sleep', sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return scheduler, sleeps
+
+    def failing(self, errors, result = 'done'):
+        """Returns a function raising the given errors in turn, then returning result"""
+        errors = list(errors)
+        def function():
+            if errors:
+                raise errors.pop(0)
+            return result
+        return function
+
+    def test_retries_with_growing_backoff(self):
+        scheduler, sleeps = self.scheduler(base_delay = 1, max_delay = 4)
+        with mock.patch('gitd.scheduler.random.uniform', lambda low, high: high):
+            result = scheduler.call(self.failing([http_error(503)] * 4))
+        self.assertEqual(result, 'done')
+        self.assertEqual(sleeps, [1, 2, 4, 4])
+        self.assertEqual(scheduler.retries, 4)
+
+    def test_gives_up_after_max_retries(self):
+        scheduler, sleeps = self.scheduler(max_retries = 2)
+        with self.assertRaises(HttpError):
+            scheduler.call(self.failing([http_error(500)] * 3))
+        self.assertEqual(len(sleeps), 2)
+
+    def test_does_not_retry_other_errors(self):
+        scheduler, sleeps = self.scheduler()
+        with self.assertRaises(HttpError):
+            scheduler.call(self.failing([http_error(404)]))
+        self.assertEqual(sleeps, [])
+
+    def test_throttling_halves_rate_and_concurrency(self):
+        scheduler, _ = self.scheduler(max_rate = 40, max_concurrency = 8)
+        # The successful retry doesn't add to the concurrency
+        with mock.patch('gitd.scheduler.random.random', lambda: 1):
+            scheduler.call(self.failing([http_error(429)]))
+        self.assertEqual(scheduler.throttles, 1)
+        self.assertEqual(scheduler.rate, 20 * 1.05)
+        self.assertEqual(scheduler.concurrency, 4)
+        # Successes speed back up, but never past the maximum
+        for _ in range(20):
+            scheduler.call(lambda: None)
+        self.assertEqual(scheduler.rate, 40)
+        self.assertLessEqual(scheduler.concurrency, 8)
+
+    def test_limits_requests_in_flight(self):
+        scheduler = RequestScheduler(max_concurrency = 2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+        def request():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+        threads = [ threading.Thread(target = scheduler.call, args = (request,)) for _ in range(6) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(scheduler.requests, 6)
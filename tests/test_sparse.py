@@ -0,0 +1,45 @@
+import os
+from .support import DriveTestCase
+
+class SparseCloneTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.push_source({ 'docs/guide.md': 'guide', 'docs/manual.pdf': 'manual',
+            'src/main.c': 'main', 'readme.md': 'readme' })
+        self.container = os.path.join(self.clones, 'repo')
+
+    def exists(self, relpath):
+        return os.path.exists(os.path.join(self.container, relpath))
+
+    def test_clone_only_includes_given_paths(self):
+        self.quiet(self.client.clone, self.clones, 'repo', include = ['docs'],
+            exclude = ['*.pdf'])
+        self.assertTrue(self.exists('docs/guide.md'))
+        self.assertFalse(self.exists('docs/manual.pdf'))
+        self.assertFalse(self.exists('src'))
+        self.assertFalse(self.exists('readme.md'))
+
+        # Paths left out are never deleted on Drive
+        self.write(self.container, 'docs/new.md', 'new')
+        self.quiet(self.client.push, self.container, force = True)
+        names = sorted(x['name'] for x in self.drive.files_.values() if not x['trashed'])
+        self.assertEqual(names, ['My Drive', 'docs', 'guide.md', 'main.c', 'manual.pdf', 'new.md',
+            'readme.md', 'repo', 'src'])
+
+    def test_metadata_only_clone_fetches_paths(self):
+        self.quiet(self.client.clone, self.clones, 'repo', metadata_only = True)
+        self.assertFalse(self.exists('docs'))
+        self.assertFalse(self.exists('readme.md'))
+
+        self.drive.reset_stats()
+        self.quiet(self.client.fetch, self.container, 'src/main.c')
+        self.assertTrue(self.exists('src/main.c'))
+        self.assertFalse(self.exists('docs'))
+        # The path is found in the index without listing Drive
+        self.assertEqual(self.drive.calls['files.list'], 0)
+
+        # Fetched files aren't uploaded again by the next push
+        self.drive.reset_stats()
+        self.quiet(self.client.push, self.container)
+        self.assertEqual(self.drive.calls['files.update'], 0)
+        self.assertEqual(self.drive.calls['files.create'], 0)
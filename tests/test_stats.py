@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from gitd.stats import Operation, Stats, format_latency
+
+class OperationTest(unittest.TestCase):
+    def test_percentiles_use_histogram_buckets(self):
+        operation = Operation()
+        for seconds in (0.0005, 0.003, 0.003, 0.04, 100):
+            operation.add(seconds, bytes = 10)
+        self.assertEqual((operation.count, operation.bytes), (5, 50))
+        self.assertEqual(operation.percentile(0.2), 0.001)
+        self.assertEqual(operation.percentile(0.5), 0.005)
+        self.assertEqual(operation.percentile(0.8), 0.05)
+        self.assertIsNone(operation.percentile(1))
+        self.assertEqual(format_latency(None), ">60s")
+
+class StatsTest(unittest.TestCase):
+    def test_spans_record_errors_and_nesting(self):
+        stats = Stats()
+        stats.enable_trace()
+        with stats.span('sync') as attrs:
+            attrs['bytes'] = 5
+            stats.record('files.list', 0.01)
+            with self.assertRaises(ValueError):
+                with stats.span('plan'):
+                    raise ValueError()
+        stats.retry('files.list', 2)
+        self.assertEqual(stats.operations['files.list'].retries, 2)
+        self.assertEqual(stats.operations['plan'].errors, 1)
+        self.assertEqual(stats.operations['sync'].bytes, 5)
+
+        spans = { x['name']: x for x in stats.spans }
+        self.assertIsNone(spans['sync']['parent'])
+        self.assertEqual(spans['plan']['parent'], spans['sync']['id'])
+        self.assertEqual(spans['files.list']['parent'], spans['sync']['id'])
+        self.assertEqual(spans['plan']['error'], 'ValueError')
+
+    def test_write_trace(self):
+        stats = Stats()
+        stats.enable_trace()
+        stats.record('files.get', 0.02, bytes = 100)
+        folder = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'trace.json')
+        stats.write_trace(path)
+        with open(path) as f:
+            trace = json.load(f)
+        self.assertEqual(trace['operations']['files.get']['histogram'], { '<=0.02': 1 })
+        self.assertEqual([ x['name'] for x in trace['spans'] ], ['files.get'])
+        self.assertIn('files.get', stats.summary())
@@ -0,0 +1,68 @@
+import contextlib
+import io
+import os
+from .support import DriveTestCase
+
+class PullDeleteTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.push_source({ '.gitdignore': '*.log\n', 'keep.txt': 'keep', 'logs/a.txt': 'a',
+            'logs/nested/b.txt': 'b' })
+        self.container = self.clone()
+        self.write(self.container, 'logs/nested/debug.log', 'ignored')
+
+    def check_deleted_folder(self):
+        self.drive.delete(self.drive_id('logs'))
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertFalse(os.path.exists(os.path.join(self.container, 'logs/a.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.container, 'logs/nested/b.txt')))
+        self.assertTrue(os.path.isfile(os.path.join(self.container, 'logs/nested/debug.log')))
+        self.assertTrue(os.path.isfile(os.path.join(self.container, 'keep.txt')))
+
+    def test_changes_keep_ignored_files_of_deleted_folder(self):
+        self.check_deleted_folder()
+
+    def test_full_walk_keeps_ignored_files_of_deleted_folder(self):
+        self.forget_changes_token(self.container)
+        self.check_deleted_folder()
+
+    def test_deleted_folder_without_ignored_files_is_removed(self):
+        os.remove(os.path.join(self.container, 'logs/nested/debug.log'))
+        self.drive.delete(self.drive_id('logs'))
+        self.quiet(self.client.pull, self.container, force = True)
+        self.assertFalse(os.path.exists(os.path.join(self.container, 'logs')))
+
+class PushOutputTest(DriveTestCase):
+    def test_throughput_is_reported_for_every_upload(self):
+        self.client.chunk_size = 256 * 1024
+        self.write(self.source, 'small.txt', 'small')
+        self.write(self.source, 'large.bin', 'x' * (512 * 1024))
+        self.quiet(self.client.init, self.source, 'repo')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.client.push(self.source, force = True)
+        uploaded = [ x.split(':')[0] for x in output.getvalue().splitlines()
+            if x.startswith('Uploaded ') ]
+        self.assertEqual(sorted(uploaded), ['Uploaded large.bin', 'Uploaded small.txt'])
+
+class PushConflictTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.push_source({ 'shared.txt': 'original', 'mine.txt': 'original' })
+        container = self.clone()
+        self.write(container, 'shared.txt', 'edited in the clone')
+        self.quiet(self.client.push, container, force = True)
+        self.write(self.source, 'shared.txt', 'edited in the source')
+        self.write(self.source, 'mine.txt', 'edited in the source')
+
+    def drive_text(self, name):
+        return self.drive.contents[self.drive_id(name)].decode()
+
+    def test_push_skips_files_changed_on_drive(self):
+        self.quiet(self.client.push, self.source)
+        self.assertEqual(self.drive_text('shared.txt'), 'edited in the clone')
+        self.assertEqual(self.drive_text('mine.txt'), 'edited in the source')
+
+    def test_forced_push_overwrites_them(self):
+        self.quiet(self.client.push, self.source, force = True)
+        self.assertEqual(self.drive_text('shared.txt'), 'edited in the source')
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import os
+import unittest
+from gitd.repository import REPO_FILE, find_repos
+from gitd.transfer import TransferPool
+from .support import DriveTestCase
+
+def fail(http, message):
+    raise IOError(message)
+
+class SyncAllTest(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repos = os.path.join(self.work, 'repos')
+        for name in ('alpha', 'group/beta'):
+            container = os.path.join(self.repos, name)
+            self.write(container, 'readme.txt', name)
+            self.quiet(self.client.init, container, name.replace('/', '-'))
+
+    def run_all(self, function, *args, **kwargs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            function(self.repos, *args, **kwargs)
+        return output.getvalue()
+
+    def test_find_repos_skips_hidden_and_nested_repositories(self):
+        self.write(self.repos, 'alpha/inner/' + REPO_FILE, '{}')
+        self.write(self.repos, '.hidden/' + REPO_FILE, '{}')
+        self.assertEqual(find_repos(self.repos),
+            [os.path.join(self.repos, 'alpha'), os.path.join(self.repos, 'group/beta')])
+
+    def test_push_all_then_pull_all(self):
+        output = self.run_all(self.client.push_all, force = True, repo_jobs = 2)
+        self.assertIn("Summary of 2 repositories:", output)
+        self.assertIn("Total: 2 upload(s)", output)
+        self.assertIn("2 changed", output)
+        self.assertIn("2 up-to-date, 0 changed", self.run_all(self.client.push_all, repo_jobs = 1))
+        beta = self.drive_id('group-beta')
+        readme = next(x['id'] for x in self.drive.files_.values()
+            if x['name'] == 'readme.txt' and beta in x.get('parents', []))
+        self.drive.update(readme, data = b'changed on Drive')
+        output = self.run_all(self.client.pull_all, force = True)
+        self.assertIn(" group/beta: 1 download(s)", output)
+        self.assertIn("1 up-to-date, 1 changed", output)
+        with open(os.path.join(self.repos, 'group/beta/readme.txt')) as f:
+            self.assertEqual(f.read(), 'changed on Drive')
+
+    def test_no_repositories(self):
+        self.repos = self.clones
+        self.assertIn("no repositories found", self.run_all(self.client.push_all))
+
+class SharedPoolTest(unittest.TestCase):
+    def test_shared_pools_keep_their_own_failures(self):
+        pool = TransferPool(jobs = 2)
+        first, second = pool.share(), pool.share()
+        first.submit('a', fail, 'disk full')
+        second.submit('b', lambda http: 'ok')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertFalse(first.report())
+            self.assertTrue(second.report())
+        first.close()
+        second.close()
+        pool.close()
+        self.assertEqual((first.failed, second.failed, pool.failed), (1, 0, 0))
+        self.assertIn(" a: disk full", output.getvalue())
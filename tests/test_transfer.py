@@ -0,0 +1,60 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+from gitd.transfer import TransferPool
+
+def sleep_then_return(http, delay, value):
+    time.sleep(delay)
+    return value
+
+def fail(http, message):
+    raise IOError(message)
+
+class TransferPoolTest(unittest.TestCase):
+    def test_callbacks_run_in_submission_order(self):
+        pool = TransferPool(jobs = 4)
+        done = []
+        threads = set()
+        def on_done(value):
+            done.append(value)
+            threads.add(threading.get_ident())
+        # Later transfers finish first
+        for i in range(8):
+            pool.submit(str(i), sleep_then_return, (8 - i) * 0.01, i, on_done = on_done)
+        pool.close()
+        self.assertEqual(done, list(range(8)))
+        self.assertEqual(threads, { threading.get_ident() })
+
+    def test_failures_are_reported_without_aborting(self):
+        for jobs in (1, 4):
+            pool = TransferPool(jobs = jobs)
+            done = []
+            pool.submit('a', sleep_then_return, 0, 'a', on_done = done.append)
+            pool.submit('b', fail, 'disk full', on_done = done.append)
+            pool.submit('c', sleep_then_return, 0, 'c', on_done = done.append)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertFalse(pool.report())
+            pool.close()
+            self.assertEqual(done, ['a', 'c'])
+            self.assertIn("1 transfer(s) failed", output.getvalue())
+            self.assertIn("b: disk full", output.getvalue())
+            # Failures are cleared once reported
+            self.assertTrue(pool.report())
+
+    def test_workers_get_their_own_transport(self):
+        created = []
+        def http_factory():
+            created.append(object())
+            return created[-1]
+        pool = TransferPool(http_factory = http_factory, jobs = 2)
+        seen = []
+        for i in range(6):
+            pool.submit(str(i), lambda http: http, on_done = seen.append)
+        pool.close()
+        self.assertTrue(all(x in created for x in seen))
+        self.assertLessEqual(len(created), 2)
+        # A single job uses the service's own transport
+        self.assertIsNone(TransferPool(http_factory = http_factory).get_http())
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from gitd import watch
+from gitd.ignore import IgnoreRules
+from gitd.watch import Watcher
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.container = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, self.container)
+        os.mkdir(os.path.join(self.container, 'sub'))
+        try:
+            self.watcher = Watcher(self.container, IgnoreRules(['*.tmp']), delay = 1,
+                max_delay = 10)
+        except OSError as e:
+            self.skipTest(f"inotify isn't available: {e}")
+        self.addCleanup(self.watcher.close)
+
+    def write(self, relpath, text = ''):
+        with open(os.path.join(self.container, relpath), 'w') as f:
+            f.write(text)
+
+    def read(self):
+        """Reads the events that are already queued"""
+        for _ in range(3):
+            self.watcher.read(0.05)
+
+    def test_writes_are_coalesced_per_path(self):
+        for i in range(5):
+            self.write('a.txt', str(i))
+        self.write('sub/b.txt')
+        self.write('ignored.tmp')
+        self.write('.gitd', '{}')
+        self.read()
+        paths, moves = self.watcher.take()
+        self.assertEqual(paths, { 'a.txt', 'sub/b.txt' })
+        self.assertEqual(moves, [])
+
+    def test_renames_are_paired_into_moves(self):
+        self.write('a.txt')
+        self.read()
+        self.watcher.take()
+        os.rename(os.path.join(self.container, 'a.txt'), os.path.join(self.container, 'b.txt'))
+        os.rename(os.path.join(self.container, 'b.txt'),
+            os.path.join(self.container, 'sub/c.txt'))
+        self.read()
+        self.assertEqual(self.watcher.take(), (set(), [('a.txt', 'sub/c.txt')]))
+
+    def test_moved_folders_keep_being_watched(self):
+        os.rename(os.path.join(self.container, 'sub'), os.path.join(self.container, 'new'))
+        self.read()
+        self.assertEqual(self.watcher.take(), (set(), [('sub', 'new')]))
+        self.write('new/d.txt')
+        self.read()
+        self.assertEqual(self.watcher.take()[0], { 'new/d.txt' })
+
+    def test_files_moved_out_are_reported_as_changed(self):
+        self.write('a.txt')
+        self.read()
+        self.watcher.take()
+        outside = tempfile.mkdtemp(prefix = 'gitd-test-')
+        self.addCleanup(shutil.rmtree, outside)
+        os.rename(os.path.join(self.container, 'a.txt'), os.path.join(outside, 'a.txt'))
+        self.read()
+        self.assertEqual(self.watcher.take(), ({ 'a.txt' }, []))
+
+    def test_burst_is_ready_after_delay_or_max_delay(self):
+        with mock.patch.object(watch.time, 'monotonic', return_value = 100):
+            self.write('a.txt')
+            self.read()
+        self.assertEqual(self.watcher.first_event, 100)
+        with mock.patch.object(watch.time, 'monotonic', return_value = 100.5):
+            self.assertFalse(self.watcher.is_ready())
+            self.assertEqual(self.watcher.timeout(), 0.5)
+        with mock.patch.object(watch.time, 'monotonic', return_value = 101):
+            self.assertTrue(self.watcher.is_ready())
+
+        # Events arriving every half second keep the burst going until
+        # max_delay has passed since the first one
+        self.watcher.last_event = 109.5
+        with mock.patch.object(watch.time, 'monotonic', return_value = 109.6):
+            self.assertFalse(self.watcher.is_ready())
+        with mock.patch.object(watch.time, 'monotonic', return_value = 110):
+            self.assertTrue(self.watcher.is_ready())
+        self.watcher.take()
+        self.assertIsNone(self.watcher.timeout())